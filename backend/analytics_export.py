@@ -0,0 +1,533 @@
+import os
+import json
+import hashlib
+import shutil
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from database import engine
+from invoice_partitions import load_manifest as load_partition_manifest, PARTITION_DIR
+
+# =========================
+# Export Configuration
+# =========================
+
+EXPORT_DIR = os.getenv(
+    "ANALYTICS_EXPORT_DIR",
+    os.path.join(os.path.dirname(__file__), "analytics_export")
+)
+MANIFEST_FILE = "manifest.json"
+
+# Rows pulled from SQLite per export batch
+EXPORT_BATCH_ROWS = 500_000
+
+# Column name -> logical type ("str", "int", "float", "date")
+TABLE_SPECS = {
+    "invoices": {
+        "sql": """
+            SELECT i.rowid, i.invoice_id, i.invoice_date,
+                   i.seller_name, i.seller_state, i.seller_gstin,
+                   i.buyer_name, i.buyer_state, i.buyer_gstin,
+                   i.sub_total, i.cgst_total, i.sgst_total, i.igst_total,
+                   i.total_tax, i.grand_total, i.payment_method
+            FROM invoices i
+            WHERE i.rowid > ?
+            ORDER BY i.rowid
+            LIMIT ?
+        """,
+        "columns": {
+            "invoice_id": "str",
+            "invoice_date": "date",
+            "seller_name": "str",
+            "seller_state": "str",
+            "seller_gstin": "str",
+            "buyer_name": "str",
+            "buyer_state": "str",
+            "buyer_gstin": "str",
+            "sub_total": "float",
+            "cgst_total": "float",
+            "sgst_total": "float",
+            "igst_total": "float",
+            "total_tax": "float",
+            "grand_total": "float",
+            "payment_method": "str",
+        },
+    },
+    # Line items are denormalized with the header fields reports group by
+    "invoice_items": {
+        "sql": """
+            SELECT it.rowid, it.id, it.invoice_id, i.invoice_date,
+                   i.seller_gstin, i.seller_state, i.buyer_gstin, i.buyer_state,
+                   it.hsn_code, it.item_category, it.quantity, it.unit_price,
+                   it.total_price, it.cgst_rate, it.sgst_rate, it.igst_rate,
+                   it.tax_amount
+            FROM invoice_items it
+            LEFT JOIN invoices i ON i.invoice_id = it.invoice_id
+            WHERE it.rowid > ?
+            ORDER BY it.rowid
+            LIMIT ?
+        """,
+        "columns": {
+            "id": "int",
+            "invoice_id": "str",
+            "invoice_date": "date",
+            "seller_gstin": "str",
+            "seller_state": "str",
+            "buyer_gstin": "str",
+            "buyer_state": "str",
+            "hsn_code": "str",
+            "item_category": "str",
+            "quantity": "int",
+            "unit_price": "float",
+            "total_price": "float",
+            "cgst_rate": "float",
+            "sgst_rate": "float",
+            "igst_rate": "float",
+            "tax_amount": "float",
+        },
+    },
+}
+
+SUPPORTED_METRICS = ("sum", "count", "min", "max", "mean")
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# =========================
+# Manifest
+# =========================
+
+def _manifest_path(export_dir: str) -> str:
+    return os.path.join(export_dir, MANIFEST_FILE)
+
+
+def load_manifest(export_dir: str = EXPORT_DIR) -> dict:
+    path = _manifest_path(export_dir)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(export_dir: str, manifest: dict):
+    path = _manifest_path(export_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# =========================
+# Column Conversion
+# =========================
+
+def to_array(values: list, kind: str) -> np.ndarray:
+    if kind == "float":
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if kind == "int":
+        return np.array([0 if v is None else v for v in values], dtype=np.int64)
+    if kind == "date":
+        return np.array(
+            [str(v)[:10] if v else "NaT" for v in values], dtype="datetime64[D]"
+        )
+    return np.array(["" if v is None else str(v) for v in values], dtype=str)
+
+
+def _write_part(part_dir: str, name: str, arrays: dict, fmt: str):
+    os.makedirs(part_dir, exist_ok=True)
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pydict({c: pa.array(a) for c, a in arrays.items()})
+        pq.write_table(table, os.path.join(part_dir, f"{name}.parquet"), compression="zstd")
+    else:
+        np.savez_compressed(os.path.join(part_dir, f"{name}.npz"), **arrays)
+
+
+# =========================
+# Incremental Export
+# =========================
+
+# Part files are named by source: "live-..." for rows read from the live
+# tables, "fy<year>-..." for archived financial-year partitions
+LIVE_PREFIX = "live"
+
+
+def _open_source_connection(path: str = None):
+    if path:
+        # Archived partitions never change once written
+        return sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+    return sqlite3.connect(f"file:{engine.url.database}?mode=ro", uri=True)
+
+
+def _row_fingerprint(row) -> int:
+    return int.from_bytes(hashlib.sha1(repr(tuple(row)).encode()).digest()[:8], "big")
+
+
+def _add_checksum(checksum: int, rows) -> int:
+    """
+    Order-independent checksum of exported rows: the sum of their
+    fingerprints modulo 2**64, so it can be extended batch by batch.
+    """
+    return (checksum + sum(_row_fingerprint(r) for r in rows)) % (1 << 64)
+
+
+def _remove_parts(table: str, export_dir: str, prefix: str):
+    table_dir = os.path.join(export_dir, table)
+    if not os.path.isdir(table_dir):
+        return
+    for month_dir in os.listdir(table_dir):
+        full_dir = os.path.join(table_dir, month_dir)
+        for name in os.listdir(full_dir):
+            if name.startswith(prefix + "-"):
+                os.remove(os.path.join(full_dir, name))
+
+
+def _export_rows(conn, table: str, export_dir: str, fmt: str, prefix: str,
+                 after_rowid: int, batch_rows: int, on_batch=None) -> int:
+    """
+    Write rows with rowid above after_rowid to month partitions as
+    <prefix>-<first rowid>-<last rowid> parts. on_batch(batch) runs once
+    each batch is on disk. Returns the number of rows exported.
+    """
+    spec = TABLE_SPECS[table]
+    columns = spec["columns"]
+    # Column order in the spec follows the SELECT list after rowid
+    date_index = 1 + list(columns).index("invoice_date")
+
+    exported = 0
+    while True:
+        batch = conn.execute(spec["sql"], (after_rowid, batch_rows)).fetchall()
+        if not batch:
+            break
+
+        by_month = {}
+        for r in batch:
+            date_value = r[date_index]
+            month = str(date_value)[:7] if date_value else "unknown"
+            by_month.setdefault(month, []).append(r[1:])
+
+        part_name = f"{prefix}-{batch[0][0]:012d}-{batch[-1][0]:012d}"
+        for month, month_rows in by_month.items():
+            arrays = {}
+            for idx, (name, kind) in enumerate(columns.items()):
+                arrays[name] = to_array([row[idx] for row in month_rows], kind)
+            part_dir = os.path.join(export_dir, table, f"month={month}")
+            _write_part(part_dir, part_name, arrays, fmt)
+
+        after_rowid = batch[-1][0]
+        exported += len(batch)
+        if on_batch:
+            on_batch(batch)
+        print(f"[analytics_export] {table}: exported {len(batch)} {prefix} rows up to rowid {after_rowid}")
+    return exported
+
+
+def _live_mark_valid(conn, table: str, live: dict, batch_rows: int) -> bool:
+    """
+    The live tables have no monotonic key: VACUUM renumbers the implicit
+    rowids of invoices, deleting the newest rows lets SQLite hand their
+    rowids out again, and a replaced invoice (delete + insert) comes back
+    above the mark. The high-water mark is only trusted while the rows at
+    or below it are still, by count and checksum, the rows exported. This
+    re-reads the exported live rows, which archiving keeps to the open
+    financial years.
+    """
+    if not live["high_water_mark"]:
+        return True
+    if "checksum" not in live:
+        return False
+    sql = TABLE_SPECS[table]["sql"]
+    count, checksum, after_rowid = 0, 0, 0
+    while True:
+        batch = conn.execute(sql, (after_rowid, batch_rows)).fetchall()
+        batch = [r for r in batch if r[0] <= live["high_water_mark"]]
+        if not batch:
+            break
+        count += len(batch)
+        checksum = _add_checksum(checksum, batch)
+        after_rowid = batch[-1][0]
+    return count == live["rows"] and checksum == live["checksum"]
+
+
+def export_table(table: str, export_dir: str = EXPORT_DIR, fmt: str = "npz",
+                 batch_rows: int = EXPORT_BATCH_ROWS) -> int:
+    """
+    Export new rows to month partitions. Archived financial years are
+    exported once each; live rows above the high-water mark are appended.
+    The live parts are rebuilt when the rows up to the high-water mark no
+    longer match the exported row count and checksum (renumbered, replaced
+    or edited rows), or when a year was archived since the last run (its
+    rows moved out of the live tables).
+    Returns the number of rows exported.
+    """
+    manifest = load_manifest(export_dir)
+    state = manifest.get(table)
+    if state is not None and "live" not in state:
+        # Exported before archived partitions were tracked separately
+        _remove_parts(table, export_dir, "part")
+        state = None
+    if state is None:
+        state = {
+            "format": fmt, "rows": 0, "partitions": {},
+            "live": {"high_water_mark": 0, "checksum": 0, "rows": 0, "partitions": []},
+        }
+        manifest[table] = state
+    if state["format"] != fmt:
+        raise ValueError(
+            f"{table} was exported as {state['format']}; run a full refresh to switch to {fmt}"
+        )
+    live = state["live"]
+
+    def _save():
+        state["rows"] = live["rows"] + sum(state["partitions"].values())
+        _save_manifest(export_dir, manifest)
+
+    exported = 0
+    for partition in load_partition_manifest():
+        # Pending partitions still have their rows in the live tables
+        if partition["fy"] in state["partitions"] or partition.get("pending"):
+            continue
+        prefix = f"fy{partition['fy'].replace('-', '_')}"
+        _remove_parts(table, export_dir, prefix)
+        conn = _open_source_connection(os.path.join(PARTITION_DIR, partition["path"]))
+        try:
+            count = _export_rows(conn, table, export_dir, fmt, prefix, 0, batch_rows)
+        finally:
+            conn.close()
+        state["partitions"][partition["fy"]] = count
+        exported += count
+        _save()
+
+    def _advance(batch):
+        live["high_water_mark"] = batch[-1][0]
+        live["checksum"] = _add_checksum(live["checksum"], batch)
+        live["rows"] += len(batch)
+        _save()
+
+    conn = _open_source_connection()
+    try:
+        archived_since = live["partitions"] != sorted(state["partitions"])
+        if archived_since or not _live_mark_valid(conn, table, live, batch_rows):
+            print(f"[analytics_export] {table}: live rows were archived or changed; rebuilding live parts")
+            _remove_parts(table, export_dir, LIVE_PREFIX)
+            live.pop("fingerprint", None)
+            live.update(high_water_mark=0, checksum=0, rows=0, partitions=sorted(state["partitions"]))
+            _save()
+        exported += _export_rows(
+            conn, table, export_dir, fmt, LIVE_PREFIX,
+            live["high_water_mark"], batch_rows, on_batch=_advance
+        )
+    finally:
+        conn.close()
+
+    return exported
+
+
+def export_all(export_dir: str = EXPORT_DIR, fmt: str = "npz", full_refresh: bool = False) -> dict:
+    if fmt == "parquet" and not _parquet_available():
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    if full_refresh and os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    return {table: export_table(table, export_dir, fmt) for table in TABLE_SPECS}
+
+
+# =========================
+# Vectorized Aggregation
+# =========================
+
+def _list_parts(table: str, export_dir: str, months):
+    table_dir = os.path.join(export_dir, table)
+    if not os.path.isdir(table_dir):
+        return []
+    parts = []
+    for month_dir in sorted(os.listdir(table_dir)):
+        month = month_dir.split("=", 1)[-1]
+        # Undated rows cannot be ruled out of any range
+        if months and month != "unknown" and not (months[0] <= month <= months[1]):
+            continue
+        full_dir = os.path.join(table_dir, month_dir)
+        for name in sorted(os.listdir(full_dir)):
+            parts.append((month, os.path.join(full_dir, name)))
+    return parts
+
+
+def _load_columns(path: str, names: set) -> dict:
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=sorted(names))
+        return {n: table.column(n).to_numpy(zero_copy_only=False) for n in names}
+    with np.load(path) as npz:
+        return {n: npz[n] for n in names}
+
+
+def _aggregate_part(month: str, path: str, group_by: list, metrics: dict, filters: dict) -> dict:
+    needed = {c for c in group_by if c != "month"} | set(metrics) | set(filters or {})
+    cols = _load_columns(path, needed)
+    size = len(next(iter(cols.values()))) if cols else 0
+    if size == 0:
+        return {}
+
+    mask = np.ones(size, dtype=bool)
+    for name, wanted in (filters or {}).items():
+        values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+        mask &= np.isin(cols[name], list(values))
+    if not mask.all():
+        cols = {n: a[mask] for n, a in cols.items()}
+        size = int(mask.sum())
+        if size == 0:
+            return {}
+
+    # Encode every group column to dense codes, then combine them into one key
+    key_values = []
+    group_codes = np.zeros(size, dtype=np.int64)
+    for name in group_by:
+        if name == "month":
+            uniques, inverse = np.array([month]), np.zeros(size, dtype=np.int64)
+        else:
+            uniques, inverse = np.unique(cols[name], return_inverse=True)
+        key_values.append(uniques)
+        group_codes = group_codes * len(uniques) + inverse.reshape(-1)
+    combined, group_index = np.unique(group_codes, return_inverse=True)
+    group_index = group_index.reshape(-1)
+    n_groups = len(combined)
+
+    counts = np.bincount(group_index, minlength=n_groups)
+    order = np.argsort(group_index, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    partials = {}
+    for name, ops in metrics.items():
+        state = {"count": counts}
+        partials[name] = state
+        if set(ops) == {"count"}:
+            continue
+        values = cols[name].astype(np.float64)
+        if "sum" in ops or "mean" in ops:
+            state["sum"] = np.bincount(group_index, weights=np.nan_to_num(values), minlength=n_groups)
+        if "min" in ops:
+            state["min"] = np.minimum.reduceat(values[order], starts)
+        if "max" in ops:
+            state["max"] = np.maximum.reduceat(values[order], starts)
+
+    # Decode combined keys back into per-column values
+    result = {}
+    for g, code in enumerate(combined):
+        key = []
+        for uniques in reversed(key_values):
+            code, idx = divmod(int(code), len(uniques))
+            key.append(uniques[idx].item() if hasattr(uniques[idx], "item") else uniques[idx])
+        key = tuple(str(k) for k in reversed(key))
+        result[key] = {
+            name: {stat: arr[g] for stat, arr in state.items()}
+            for name, state in partials.items()
+        }
+    return result
+
+
+def _merge(into: dict, part: dict):
+    for key, metrics in part.items():
+        existing = into.get(key)
+        if existing is None:
+            into[key] = {n: dict(s) for n, s in metrics.items()}
+            continue
+        for name, state in metrics.items():
+            target = existing[name]
+            for stat, value in state.items():
+                if stat == "min":
+                    target[stat] = min(target[stat], value)
+                elif stat == "max":
+                    target[stat] = max(target[stat], value)
+                else:
+                    target[stat] = target[stat] + value
+
+
+def aggregate(table: str, group_by: list, metrics: dict,
+              months: tuple = None, filters: dict = None,
+              export_dir: str = EXPORT_DIR) -> list[dict]:
+    """
+    Group-by aggregation over the exported partitions.
+
+    group_by: column names, plus the pseudo column "month"
+    metrics:  {column: op or [ops]}, ops from "sum", "count", "min", "max", "mean"
+    months:   optional inclusive ("YYYY-MM", "YYYY-MM") partition range
+    filters:  {column: value or list of values} equality filters
+    """
+    metrics = {
+        name: [ops] if isinstance(ops, str) else list(ops)
+        for name, ops in metrics.items()
+    }
+    for name, ops in metrics.items():
+        for op in ops:
+            if op not in SUPPORTED_METRICS:
+                raise ValueError(f"Unsupported metric {op!r} for {name}")
+
+    parts = _list_parts(table, export_dir, months)
+    merged = {}
+    workers = min(len(parts), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_aggregate_part, month, path, group_by, metrics, filters)
+            for month, path in parts
+        ]
+        for future in futures:
+            _merge(merged, future.result())
+
+    rows = []
+    for key in sorted(merged):
+        row = dict(zip(group_by, key))
+        for name, ops in metrics.items():
+            state = merged[key][name]
+            for op in ops:
+                if op == "count":
+                    value = int(state["count"])
+                elif op == "mean":
+                    value = float(state["sum"] / state["count"]) if state["count"] else None
+                else:
+                    value = float(state[op])
+                row[f"{name}_{op}"] = value
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar export of the invoice database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = sub.add_parser("export", help="Export new rows since the last run")
+    export_cmd.add_argument("--format", choices=["npz", "parquet"], default="npz")
+    export_cmd.add_argument("--full-refresh", action="store_true")
+
+    agg_cmd = sub.add_parser("aggregate", help="Group-by aggregation over the export")
+    agg_cmd.add_argument("table", choices=list(TABLE_SPECS))
+    agg_cmd.add_argument("--group-by", default="month")
+    agg_cmd.add_argument("--metric", action="append", default=[],
+                         help="column:op, e.g. tax_amount:sum (repeatable)")
+    agg_cmd.add_argument("--from-month")
+    agg_cmd.add_argument("--to-month")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        print(export_all(fmt=args.format, full_refresh=args.full_refresh))
+    else:
+        metric_specs = {}
+        for metric in args.metric:
+            column, op = metric.split(":", 1)
+            metric_specs.setdefault(column, []).append(op)
+        metric_specs = metric_specs or {"invoice_id": "count"}
+        month_range = None
+        if args.from_month or args.to_month:
+            month_range = (args.from_month or "0000-00", args.to_month or "9999-99")
+        for out_row in aggregate(args.table, args.group_by.split(","), metric_specs, month_range):
+            print(out_row)
@@ -0,0 +1,483 @@
+"""
+End-to-end benchmark for the query and ingestion pipelines.
+
+Runs the FastAPI app in-process against a throwaway SQLite database,
+vector store and GST docs folder, with the deterministic FakeProvider
+standing in for Gemini. Example:
+
+    python benchmark.py --line-items 100000 --concurrency 8 --out bench.json
+    python benchmark.py --line-items 100000 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Seconds between RSS samples while a stage runs
+RSS_SAMPLE_SECONDS = 0.05
+
+STATES = [
+    ("Maharashtra", "27"), ("Karnataka", "29"), ("Tamil Nadu", "33"),
+    ("Gujarat", "24"), ("Delhi", "07"), ("Uttar Pradesh", "09"),
+]
+HSN_RATES = [("2523", 28), ("7214", 18), ("8471", 18), ("3004", 12), ("1006", 5), ("0401", 0)]
+ITEM_NAMES = ["Cement", "TMT bars", "Laptop", "Medicines", "Rice", "Milk"]
+
+QUERIES = [
+    "List all invoices from January 2024",
+    "What is the total tax collected per seller?",
+    "What is the GST rate on cement?",
+    "Explain the rules for input tax credit on capital goods",
+    "Which invoices charged IGST on intra-state supplies, and is that compliant with GST rules?",
+    "Show the top 10 buyers by grand total",
+]
+
+RULE_TOPICS = [
+    "input tax credit", "reverse charge", "place of supply", "e-invoicing",
+    "composition scheme", "HSN classification", "export of services", "TDS under GST",
+]
+
+
+# =========================
+# Synthetic Data
+# =========================
+
+def _gstin(rng, state_code: str) -> str:
+    letters = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(5))
+    return f"{state_code}{letters}{rng.randint(1000, 9999)}{rng.choice('ABCDEFGHJK')}1Z{rng.randint(0, 9)}"
+
+
+def generate_invoice_db(db_path: str, line_items: int, items_per_invoice: int = 5, seed: int = 7):
+    """
+    Bulk-load a synthetic invoices/invoice_items dataset straight into SQLite.
+    """
+    from database import Base
+    from sqlalchemy import create_engine
+
+    Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_path}"))
+
+    rng = random.Random(seed)
+    sellers = [(_gstin(rng, code), name, f"Seller {i}") for i, (name, code) in
+               enumerate(rng.choice(STATES) for _ in range(200))]
+    buyers = [(_gstin(rng, code), name, f"Buyer {i}") for i, (name, code) in
+              enumerate(rng.choice(STATES) for _ in range(500))]
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    invoice_count = max(1, line_items // items_per_invoice)
+    batch_invoices, batch_items = [], []
+
+    def flush():
+        conn.executemany(
+            "INSERT INTO invoices (invoice_id, invoice_date, seller_name, seller_state, seller_gstin, "
+            "buyer_name, buyer_state, buyer_gstin, sub_total, cgst_total, sgst_total, igst_total, "
+            "total_tax, grand_total, payment_method) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            batch_invoices,
+        )
+        conn.executemany(
+            "INSERT INTO invoice_items (invoice_id, description, quantity, unit_price, total_price, "
+            "hsn_code, item_category, cgst_rate, sgst_rate, igst_rate, tax_amount) "
+            "VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            batch_items,
+        )
+        batch_invoices.clear()
+        batch_items.clear()
+
+    for n in range(invoice_count):
+        seller_gstin, seller_state, seller_name = rng.choice(sellers)
+        buyer_gstin, buyer_state, buyer_name = rng.choice(buyers)
+        intra_state = seller_state == buyer_state
+        invoice_id = f"INV-{n:08d}"
+        sub_total = cgst = sgst = igst = 0.0
+        for _ in range(items_per_invoice):
+            k = rng.randrange(len(HSN_RATES))
+            hsn, rate = HSN_RATES[k]
+            quantity = rng.randint(1, 50)
+            unit_price = round(rng.uniform(10, 5000), 2)
+            total_price = round(quantity * unit_price, 2)
+            tax = round(total_price * rate / 100, 2)
+            c_rate = s_rate = rate / 2 if intra_state else 0
+            i_rate = 0 if intra_state else rate
+            sub_total += total_price
+            if intra_state:
+                cgst += tax / 2
+                sgst += tax / 2
+            else:
+                igst += tax
+            batch_items.append((invoice_id, ITEM_NAMES[k], quantity, unit_price, total_price,
+                                hsn, "Goods", c_rate, s_rate, i_rate, tax))
+        total_tax = round(cgst + sgst + igst, 2)
+        batch_invoices.append((
+            invoice_id, f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            seller_name, seller_state, seller_gstin, buyer_name, buyer_state, buyer_gstin,
+            round(sub_total, 2), round(cgst, 2), round(sgst, 2), round(igst, 2),
+            total_tax, round(sub_total + total_tax, 2), rng.choice(["UPI", "NEFT", "Cash"]),
+        ))
+        if len(batch_items) >= 50_000:
+            flush()
+    flush()
+    conn.commit()
+    conn.close()
+    return invoice_count
+
+
+def generate_rule_corpus(docs_dir: str, documents: int, paragraphs: int = 20, seed: int = 11) -> list[str]:
+    rng = random.Random(seed)
+    os.makedirs(docs_dir, exist_ok=True)
+    paths = []
+    for d in range(documents):
+        topic = RULE_TOPICS[d % len(RULE_TOPICS)]
+        lines = [f"Circular {d}: clarification on {topic}."]
+        for p in range(paragraphs):
+            hsn, rate = rng.choice(HSN_RATES)
+            lines.append(
+                f"Para {p}. Goods under HSN {hsn} attract GST at {rate} percent. "
+                f"For {topic}, the registered person shall comply within {rng.randint(7, 90)} days "
+                f"of the invoice date, failing which interest under section {rng.randint(40, 80)} applies."
+            )
+        path = os.path.join(docs_dir, f"circular_{d:05d}.txt")
+        with open(path, "w") as f:
+            f.write("\n\n".join(lines))
+        paths.append(path)
+    return paths
+
+
+# =========================
+# Measurement
+# =========================
+
+def current_rss_mb():
+    """
+    Current (not lifetime-peak) resident set size, or None if unavailable.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RSSSampler:
+    """
+    Samples RSS on a background thread for the duration of a stage, so
+    each stage reports its own peak instead of the process high-water mark.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start_mb = self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+
+    def __enter__(self):
+        self.start_mb = current_rss_mb()
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def summary(self) -> dict:
+        if self.start_mb is None:
+            return {"rss_start_mb": None, "rss_peak_mb": None, "rss_delta_mb": None}
+        return {
+            "rss_start_mb": round(self.start_mb, 1),
+            "rss_peak_mb": round(self.peak_mb, 1),
+            "rss_delta_mb": round(self.peak_mb - self.start_mb, 1),
+        }
+
+
+def _percentile(sorted_values: list, pct: float):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_stage(name: str, tasks: list, concurrency: int) -> dict:
+    """
+    Run callables with a thread pool; each returns True on success.
+    """
+    latencies, errors = [], 0
+
+    def timed(task):
+        started = time.perf_counter()
+        try:
+            ok = task()
+        except Exception as e:
+            print(f"[{name}] error: {e}")
+            ok = False
+        return (time.perf_counter() - started) * 1000, ok
+
+    started = time.perf_counter()
+    with RSSSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, ok in pool.map(timed, tasks):
+            latencies.append(latency)
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": len(tasks),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(tasks) / wall, 2) if wall else None,
+        "p50_ms": round(_percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99), 2) if latencies else None,
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+        **rss.summary(),
+    }
+    print(
+        f"[{name}] {result['requests']} req, {errors} errors, {result['throughput_rps']} req/s, "
+        f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+        f"rss +{result['rss_delta_mb']}MB"
+    )
+    return result
+
+
+def measure_startup(workdir: str, port: int = 8765, timeout: float = 120.0) -> dict:
+    """
+    Launch uvicorn in a subprocess and poll until the first request
+    succeeds and until /ready reports ready. The subprocess gets its own
+    vector store, ingest manifest and dedup index under workdir/startup:
+    it is killed as soon as it is ready, possibly mid-ingest, and must not
+    leave half-written files behind for the in-process stages.
+    """
+    startup_dir = os.path.join(workdir, "startup")
+    os.makedirs(startup_dir, exist_ok=True)
+    env = dict(
+        os.environ,
+        GST_VECTOR_STORE=os.path.join(startup_dir, "vector_store.pkl"),
+        GST_INGEST_MANIFEST=os.path.join(startup_dir, "vector_store.pkl.manifest.json"),
+        INVOICE_DEDUP_INDEX=os.path.join(startup_dir, "dedup_index.pkl"),
+        EXTRACTION_CACHE_DIR=os.path.join(startup_dir, "extraction_cache"),
+    )
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    result = {"time_to_first_request_s": None, "time_to_ready_s": None}
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                if result["time_to_first_request_s"] is None:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+                    result["time_to_first_request_s"] = round(time.perf_counter() - started, 3)
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1)
+                result["time_to_ready_s"] = round(time.perf_counter() - started, 3)
+                break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    print(
+        f"[startup] first request after {result['time_to_first_request_s']}s, "
+        f"ready after {result['time_to_ready_s']}s"
+    )
+    return result
+
+
+def compare(current: dict, baseline: dict, threshold_pct: float) -> list[str]:
+    regressions = []
+    for stage, now in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+        for metric, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("p99_ms", True),
+                                        ("throughput_rps", False), ("time_to_first_request_s", True),
+                                        ("time_to_ready_s", True)):
+            old, new = before.get(metric), now.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = change > threshold_pct if higher_is_worse else change < -threshold_pct
+            flag = "REGRESSION" if worse else "ok"
+            print(f"{stage:>10} {metric:<15} {old:>10} -> {new:<10} ({change:+.1f}%) {flag}")
+            if worse:
+                regressions.append(f"{stage}.{metric}")
+    return regressions
+
+
+# =========================
+# Benchmark Driver
+# =========================
+
+def run_stages(client, stages: list, rule_paths: list, args) -> dict:
+    results = {}
+    if "ingest" in stages:
+        def ingest_task(path):
+            with open(path) as f:
+                content = f.read()
+            doc_id = os.path.basename(path)
+            return lambda: client.post("/ingest", json={"doc_id": doc_id, "content": content}).status_code == 200
+        results["ingest"] = run_stage("ingest", [ingest_task(p) for p in rule_paths], args.concurrency)
+
+    if "watchdog" in stages:
+        from gst_watchdog import GSTFolderHandler
+        handler = GSTFolderHandler()
+
+        def watchdog_task(path):
+            def run():
+                handler.process_file(path)
+                return True
+            return run
+        results["watchdog"] = run_stage("watchdog", [watchdog_task(p) for p in rule_paths], args.concurrency)
+
+    if "upload" in stages:
+        def upload_task(n):
+            payload = f"%PDF-1.4 synthetic benchmark invoice {n} {time.time_ns()}".encode()
+            return lambda: client.post(
+                "/upload-invoice",
+                files={"file": (f"bench_{n}.pdf", payload, "application/pdf")},
+                # Fake extractions can collide on seller/date/total
+                params={"allow_duplicate": "true"},
+            ).status_code == 200
+        results["upload"] = run_stage("upload", [upload_task(n) for n in range(args.uploads)], args.concurrency)
+
+    if "query" in stages:
+        rng = random.Random(3)
+
+        def query_task(query):
+            return lambda: client.post("/query", json={"query": query}).status_code == 200
+        tasks = [query_task(rng.choice(QUERIES)) for _ in range(args.queries)]
+        results["query"] = run_stage("query", tasks, args.concurrency)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query and ingestion pipelines")
+    parser.add_argument("--line-items", type=int, default=10_000)
+    parser.add_argument("--rule-docs", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-latency-ms", type=float, default=50.0)
+    parser.add_argument("--model-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--model-error-rate", type=float, default=0.0)
+    parser.add_argument("--stages", default="startup,ingest,watchdog,upload,query")
+    parser.add_argument("--workdir", help="Keep generated data here instead of a temp dir")
+    parser.add_argument("--out", help="Write results JSON to this path")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--regression-threshold", type=float, default=10.0,
+                        help="Percent change flagged as a regression")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gst_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "bench_invoices.db")
+    # The watched folder stays empty: ingestion is driven by the stages,
+    # not by the startup folder scan
+    docs_dir = os.path.join(workdir, "gst_docs")
+    corpus_dir = os.path.join(workdir, "rule_corpus")
+    os.makedirs(docs_dir, exist_ok=True)
+
+    # Point every store at the workdir before the app modules are imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["GST_VECTOR_STORE"] = os.path.join(workdir, "bench_vector_store.pkl")
+    os.environ["GST_DOCS_DIR"] = docs_dir
+    os.environ["INVOICE_DEDUP_INDEX"] = os.path.join(workdir, "bench_dedup_index.pkl")
+    os.environ["EXTRACTION_CACHE_DIR"] = os.path.join(workdir, "extraction_cache")
+    os.environ["INVOICE_PARTITION_DIR"] = os.path.join(workdir, "partitions")
+    os.environ["ANALYTICS_EXPORT_DIR"] = os.path.join(workdir, "analytics_export")
+    os.environ["MODEL_PROVIDER"] = "fake"
+
+    print(f"Workdir: {workdir}")
+    started = time.perf_counter()
+    if not os.path.exists(db_path):
+        invoices = generate_invoice_db(db_path, args.line_items)
+        print(f"Generated {invoices} invoices / {args.line_items} line items "
+              f"in {time.perf_counter() - started:.1f}s")
+    rule_paths = generate_rule_corpus(corpus_dir, args.rule_docs)
+
+    from model_provider import FakeProvider, set_provider
+    set_provider(FakeProvider(
+        latency_ms=args.model_latency_ms,
+        jitter_ms=args.model_jitter_ms,
+        error_rate=args.model_error_rate,
+    ))
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    results = {}
+
+    if "startup" in stages:
+        # Before the in-process app import, so the subprocess starts cold
+        results["startup"] = measure_startup(workdir)
+
+    import main as app_main
+    from fastapi.testclient import TestClient
+
+    # The context manager runs the app's startup hooks (init_db, watchdog,
+    # background loads) exactly as uvicorn would
+    with TestClient(app_main.app) as client:
+        deadline = time.perf_counter() + 60
+        while client.get("/ready").status_code != 200 and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        results.update(run_stages(client, stages, rule_paths, args))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": results,
+    }
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.regression_threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+import os
+import csv
+import time
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from analytics_export import to_array
+from invoice_partitions import attach_partitions, MANIFEST_PATH as PARTITION_MANIFEST_PATH
+from sql_guard import open_readonly_connection
+from database import engine
+from telemetry import cache_hit
+from rate_limiter import SingleFlight
+
+# =========================
+# Check Settings
+# =========================
+
+CHUNK_ROWS = int(os.getenv("COMPLIANCE_CHUNK_ROWS", "200000"))
+
+# Flagged rows kept per check; counts always cover every row
+MAX_FLAGS_PER_CHECK = int(os.getenv("COMPLIANCE_MAX_FLAGS", "1000"))
+
+# Reports kept for different check selections over the same data
+REPORT_CACHE_SIZE = int(os.getenv("COMPLIANCE_REPORT_CACHE_SIZE", "8"))
+
+# Rupee tolerance for amount comparisons, plus a relative one for large values
+AMOUNT_TOLERANCE = 1.0
+RELATIVE_TOLERANCE = 0.01
+
+GST_SLABS = np.array([0, 0.1, 0.25, 1, 1.5, 3, 5, 6, 7.5, 12, 18, 28])
+
+STATE_CODES = {
+    "jammu and kashmir": "01", "himachal pradesh": "02", "punjab": "03", "chandigarh": "04",
+    "uttarakhand": "05", "haryana": "06", "delhi": "07", "rajasthan": "08",
+    "uttar pradesh": "09", "bihar": "10", "sikkim": "11", "arunachal pradesh": "12",
+    "nagaland": "13", "manipur": "14", "mizoram": "15", "tripura": "16",
+    "meghalaya": "17", "assam": "18", "west bengal": "19", "jharkhand": "20",
+    "odisha": "21", "chhattisgarh": "22", "madhya pradesh": "23", "gujarat": "24",
+    "dadra and nagar haveli and daman and diu": "26", "maharashtra": "27",
+    "karnataka": "29", "goa": "30", "lakshadweep": "31", "kerala": "32",
+    "tamil nadu": "33", "puducherry": "34", "andaman and nicobar islands": "35",
+    "telangana": "36", "andhra pradesh": "37", "ladakh": "38",
+}
+
+ITEMS_SQL = """
+    SELECT it.id, it.invoice_id, i.invoice_date,
+           i.seller_state, i.seller_gstin, i.buyer_state, i.buyer_gstin,
+           it.hsn_code, it.total_price, it.cgst_rate, it.sgst_rate, it.igst_rate,
+           it.tax_amount
+    FROM invoice_items it
+    JOIN invoices i ON i.invoice_id = it.invoice_id
+    {where}
+"""
+ITEM_COLUMNS = {
+    "id": "int", "invoice_id": "str", "invoice_date": "str",
+    "seller_state": "str", "seller_gstin": "str", "buyer_state": "str", "buyer_gstin": "str",
+    "hsn_code": "str", "total_price": "float", "cgst_rate": "float", "sgst_rate": "float",
+    "igst_rate": "float", "tax_amount": "float",
+}
+
+INVOICES_SQL = """
+    SELECT i.invoice_id, i.invoice_date, i.seller_state, i.seller_gstin,
+           i.buyer_state, i.buyer_gstin, i.sub_total, i.cgst_total, i.sgst_total,
+           i.igst_total, i.total_tax, i.grand_total,
+           s.items_value, s.items_tax, s.item_count
+    FROM invoices i
+    LEFT JOIN (
+        SELECT invoice_id, SUM(total_price) AS items_value, SUM(tax_amount) AS items_tax,
+               COUNT(*) AS item_count
+        FROM invoice_items GROUP BY invoice_id
+    ) s ON s.invoice_id = i.invoice_id
+    {where}
+"""
+INVOICE_COLUMNS = {
+    "invoice_id": "str", "invoice_date": "str",
+    "seller_state": "str", "seller_gstin": "str", "buyer_state": "str", "buyer_gstin": "str",
+    "sub_total": "float", "cgst_total": "float", "sgst_total": "float", "igst_total": "float",
+    "total_tax": "float", "grand_total": "float",
+    "items_value": "float", "items_tax": "float", "item_count": "int",
+}
+
+# Modal total rate per HSN code, the reference for hsn_rate_outlier
+HSN_RATE_SQL = """
+    SELECT hsn_code, cgst_rate + sgst_rate + igst_rate AS rate, COUNT(*) AS n
+    FROM invoice_items
+    WHERE hsn_code IS NOT NULL AND hsn_code != ''
+    GROUP BY hsn_code, rate
+"""
+
+
+# =========================
+# Vector Helpers
+# =========================
+
+def _differs(actual: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    tolerance = np.maximum(AMOUNT_TOLERANCE, RELATIVE_TOLERANCE * np.abs(expected))
+    return np.abs(np.nan_to_num(actual) - np.nan_to_num(expected)) > tolerance
+
+
+def _map_values(values: np.ndarray, fn, dtype) -> np.ndarray:
+    # Columns like state and HSN code have few distinct values: map those once
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return np.array([fn(v) for v in distinct], dtype=dtype)[inverse]
+
+
+def gstin_state_codes(gstins: np.ndarray) -> np.ndarray:
+    """
+    Leading state code of each GSTIN, or "" when the value does not start
+    with two digits (blank, "URP" for unregistered buyers, "NA", ...).
+    """
+    prefix = np.char.strip(gstins.astype(str)).astype("U2")
+    return np.where(np.char.isdigit(prefix) & (np.char.str_len(prefix) == 2), prefix, "")
+
+
+def _state_codes(states: np.ndarray, gstins: np.ndarray) -> np.ndarray:
+    """
+    Two-digit state code per row: from the GSTIN when it carries one, else
+    from the state name. Unknown states come back as "".
+    """
+    from_gstin = gstin_state_codes(gstins)
+    from_name = _map_values(states, lambda s: STATE_CODES.get(s.strip().lower(), ""), "U2")
+    return np.where(from_gstin != "", from_gstin, from_name)
+
+
+def gstin_valid(gstins: np.ndarray) -> np.ndarray:
+    """
+    Format (2 digits, PAN, entity code, 'Z', check char) and mod-36
+    checksum of each GSTIN, vectorized over a byte matrix.
+    """
+    upper = np.char.upper(np.char.strip(gstins.astype(str)))
+    ok_length = np.char.str_len(upper) == 15
+    raw = np.char.encode(np.char.ljust(upper, 15), "ascii", "replace").astype("S15")
+    chars = np.frombuffer(raw.tobytes(), dtype=np.uint8).reshape(-1, 15).astype(np.int64)
+
+    is_digit = (chars >= 48) & (chars <= 57)
+    is_alpha = (chars >= 65) & (chars <= 90)
+    ok_format = (
+        ok_length
+        & is_digit[:, 0:2].all(axis=1)
+        & is_alpha[:, 2:7].all(axis=1)
+        & is_digit[:, 7:11].all(axis=1)
+        & is_alpha[:, 11]
+        & (is_digit[:, 12] | is_alpha[:, 12]) & (chars[:, 12] != 48)
+        & (chars[:, 13] == ord("Z"))
+        & (is_digit[:, 14] | is_alpha[:, 14])
+    )
+
+    values = np.where(is_digit, chars - 48, chars - 55)
+    factors = np.where(np.arange(14) % 2 == 0, 1, 2)
+    products = values[:, :14] * factors
+    total = (products // 36 + products % 36).sum(axis=1)
+    check = (36 - total % 36) % 36
+    return ok_format & (values[:, 14] == check)
+
+
+# =========================
+# Check Library
+# =========================
+
+def _intra_state(c):
+    return c["seller_code"] == c["buyer_code"]
+
+
+def _inter_state(c):
+    return (c["seller_code"] != "") & (c["buyer_code"] != "") & (c["seller_code"] != c["buyer_code"])
+
+
+# level: which table a check runs over; rule: columns -> boolean mask of violations
+CHECKS = {
+    "igst_on_intra_state": {
+        "level": "item",
+        "severity": "high",
+        "description": "IGST charged although seller and buyer are in the same state",
+        "rule": lambda c: (c["seller_code"] != "") & _intra_state(c) & (c["igst_rate"] > 0),
+    },
+    "cgst_sgst_on_inter_state": {
+        "level": "item",
+        "severity": "high",
+        "description": "CGST/SGST charged on an inter-state supply (IGST expected)",
+        "rule": lambda c: _inter_state(c) & ((c["cgst_rate"] > 0) | (c["sgst_rate"] > 0)),
+    },
+    "cgst_sgst_unequal": {
+        "level": "item",
+        "severity": "medium",
+        "description": "CGST and SGST rates differ",
+        "rule": lambda c: np.abs(np.nan_to_num(c["cgst_rate"]) - np.nan_to_num(c["sgst_rate"])) > 1e-6,
+    },
+    "tax_amount_mismatch": {
+        "level": "item",
+        "severity": "high",
+        "description": "tax_amount differs from total_price x applicable rate",
+        "rule": lambda c: _differs(c["tax_amount"], c["total_price"] * c["total_rate"] / 100),
+    },
+    "invalid_gst_slab": {
+        "level": "item",
+        "severity": "medium",
+        "description": "Total GST rate is not a notified slab",
+        "rule": lambda c: np.abs(c["total_rate"][:, None] - GST_SLABS[None, :]).min(axis=1) > 1e-6,
+    },
+    "hsn_rate_outlier": {
+        "level": "item",
+        "severity": "medium",
+        "description": "Rate differs from the rate most commonly used for this HSN code",
+        "rule": lambda c: ~np.isnan(c["hsn_modal_rate"]) & (np.abs(c["total_rate"] - c["hsn_modal_rate"]) > 1e-6),
+    },
+    "totals_mismatch": {
+        "level": "invoice",
+        "severity": "high",
+        "description": "sub_total + total_tax does not equal grand_total",
+        "rule": lambda c: _differs(c["grand_total"], c["sub_total"] + c["total_tax"]),
+    },
+    "tax_split_mismatch": {
+        "level": "invoice",
+        "severity": "medium",
+        "description": "CGST + SGST + IGST totals do not add up to total_tax",
+        "rule": lambda c: _differs(c["total_tax"], c["cgst_total"] + c["sgst_total"] + c["igst_total"]),
+    },
+    "line_items_mismatch": {
+        "level": "invoice",
+        "severity": "medium",
+        "description": "Line items do not add up to the invoice sub_total / total_tax",
+        "rule": lambda c: (c["item_count"] > 0) & (
+            _differs(c["items_value"], c["sub_total"]) | _differs(c["items_tax"], c["total_tax"])
+        ),
+    },
+    "invalid_seller_gstin": {
+        "level": "invoice",
+        "severity": "high",
+        "description": "Seller GSTIN is missing, malformed or fails its checksum",
+        "rule": lambda c: ~c["seller_gstin_valid"],
+    },
+    "invalid_buyer_gstin": {
+        "level": "invoice",
+        "severity": "medium",
+        "description": "Buyer GSTIN is malformed or fails its checksum (blank = unregistered buyer)",
+        "rule": lambda c: (np.char.str_len(c["buyer_gstin"]) > 0) & ~c["buyer_gstin_valid"],
+    },
+    "gstin_state_mismatch": {
+        "level": "invoice",
+        "severity": "low",
+        "description": "State code in the seller GSTIN does not match seller_state",
+        "rule": lambda c: (c["seller_name_code"] != "") & (c["seller_gstin_code"] != "")
+                          & (c["seller_name_code"] != c["seller_gstin_code"]),
+    },
+}
+
+
+# =========================
+# Evaluation
+# =========================
+
+def _load_hsn_modal_rates(conn) -> dict:
+    best = {}
+    for hsn, rate, n in conn.execute(HSN_RATE_SQL):
+        if hsn not in best or n > best[hsn][1]:
+            best[hsn] = (rate or 0.0, n)
+    return {hsn: rate for hsn, (rate, _) in best.items()}
+
+
+def _derive_item_columns(c: dict, modal_rates: dict):
+    c["seller_code"] = _state_codes(c["seller_state"], c["seller_gstin"])
+    c["buyer_code"] = _state_codes(c["buyer_state"], c["buyer_gstin"])
+    c["total_rate"] = np.nan_to_num(c["cgst_rate"]) + np.nan_to_num(c["sgst_rate"]) + np.nan_to_num(c["igst_rate"])
+    c["hsn_modal_rate"] = _map_values(c["hsn_code"], lambda h: modal_rates.get(h, np.nan), np.float64)
+
+
+def _derive_invoice_columns(c: dict, _modal_rates: dict):
+    c["seller_gstin_valid"] = gstin_valid(c["seller_gstin"])
+    c["buyer_gstin_valid"] = gstin_valid(c["buyer_gstin"])
+    c["seller_gstin_code"] = gstin_state_codes(c["seller_gstin"])
+    c["seller_name_code"] = _map_values(
+        c["seller_state"], lambda s: STATE_CODES.get(s.strip().lower(), ""), "U2"
+    )
+
+
+LEVELS = {
+    "item": (ITEMS_SQL, ITEM_COLUMNS, _derive_item_columns),
+    "invoice": (INVOICES_SQL, INVOICE_COLUMNS, _derive_invoice_columns),
+}
+
+
+def _flag_row(check: str, spec: dict, c: dict, idx: int) -> dict:
+    # Same keys for every check so flags from both levels form one table
+    row = {
+        "check": check,
+        "severity": spec["severity"],
+        "invoice_id": str(c["invoice_id"][idx]),
+        "item_id": int(c["id"][idx]) if "id" in c else None,
+        "invoice_date": str(c["invoice_date"][idx]),
+        "hsn_code": None, "total_price": None, "rate": None, "tax_amount": None,
+        "seller_gstin": None, "sub_total": None, "total_tax": None, "grand_total": None,
+    }
+    if spec["level"] == "item":
+        row.update({
+            "hsn_code": str(c["hsn_code"][idx]),
+            "total_price": float(c["total_price"][idx]),
+            "rate": float(c["total_rate"][idx]),
+            "tax_amount": float(c["tax_amount"][idx]),
+        })
+    else:
+        row.update({
+            "seller_gstin": str(c["seller_gstin"][idx]),
+            "sub_total": float(c["sub_total"][idx]),
+            "total_tax": float(c["total_tax"][idx]),
+            "grand_total": float(c["grand_total"][idx]),
+        })
+    return row
+
+
+def run_checks(checks: list = None, date_from: str = None, date_to: str = None,
+               chunk_rows: int = CHUNK_ROWS, max_flags: int = MAX_FLAGS_PER_CHECK) -> dict:
+    """
+    Evaluate the check library over invoices and line items (including
+    archived partitions in range), streaming CHUNK_ROWS rows at a time.
+    Returns counts per check, up to max_flags flagged rows per check and
+    timings.
+    """
+    checks = checks or list(CHECKS)
+    started = time.perf_counter()
+    report = {
+        "checks": {name: {"description": CHECKS[name]["description"],
+                          "severity": CHECKS[name]["severity"], "violations": 0} for name in checks},
+        "rows_scanned": {},
+        "flags": [],
+    }
+
+    conditions, params, routing = [], [], []
+    if date_from:
+        conditions.append("i.invoice_date >= ?")
+        params.append(date_from)
+        routing.append(f"invoice_date >= '{date_from}'")
+    if date_to:
+        conditions.append("i.invoice_date <= ?")
+        params.append(date_to)
+        routing.append(f"invoice_date <= '{date_to}'")
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    conn = open_readonly_connection()
+    try:
+        # Literal dates let the partition router attach only the years in range
+        routing_where = ("WHERE " + " AND ".join(routing)) if routing else ""
+        attach_partitions(conn, f"SELECT * FROM invoices {routing_where}")
+        modal_rates = _load_hsn_modal_rates(conn)
+
+        for level, (sql, columns, derive) in LEVELS.items():
+            level_checks = [name for name in checks if CHECKS[name]["level"] == level]
+            if not level_checks:
+                continue
+            scanned = 0
+            cursor = conn.execute(sql.format(where=where), params)
+            while True:
+                batch = cursor.fetchmany(chunk_rows)
+                if not batch:
+                    break
+                scanned += len(batch)
+                c = {name: to_array(values, kind)
+                     for (name, kind), values in zip(columns.items(), zip(*batch))}
+                derive(c, modal_rates)
+                for name in level_checks:
+                    mask = CHECKS[name]["rule"](c)
+                    hits = np.flatnonzero(mask)
+                    entry = report["checks"][name]
+                    room = max_flags - min(entry["violations"], max_flags)
+                    entry["violations"] += int(len(hits))
+                    report["flags"].extend(_flag_row(name, CHECKS[name], c, i) for i in hits[:room])
+            report["rows_scanned"][level] = scanned
+    finally:
+        conn.close()
+
+    report["timings_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    print(
+        f"[compliance] scanned {report['rows_scanned']} in {report['timings_ms']:.0f}ms, "
+        f"{sum(v['violations'] for v in report['checks'].values())} violations"
+    )
+    return report
+
+
+# =========================
+# Cached Report
+# =========================
+
+_report_cache = OrderedDict()  # (checks, data version) -> report, least recently used first
+_report_lock = threading.Lock()
+# Concurrent requests for the same report share one run_checks()
+_report_flight = SingleFlight("compliance_report")
+
+
+def _data_version() -> tuple:
+    paths = [engine.url.database, PARTITION_MANIFEST_PATH]
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else 0 for p in paths)
+
+
+def get_compliance_report(checks: list = None) -> dict:
+    """
+    run_checks() over all data, reused until the database or partition
+    manifest changes on disk.
+    """
+    key = (tuple(sorted(checks or CHECKS)), _data_version())
+    with _report_lock:
+        report = _report_cache.get(key)
+        if report is not None:
+            _report_cache.move_to_end(key)
+    cache_hit("compliance_report", report is not None)
+    if report is not None:
+        return report
+
+    # The scan runs outside the lock so other reports stay readable meanwhile
+    report = _report_flight.do(key, lambda: run_checks(checks))
+    with _report_lock:
+        version = _data_version()
+        if key[1] == version:
+            # Reports over older data can never be hit again
+            for stale in [k for k in _report_cache if k[1] != version]:
+                del _report_cache[stale]
+            _report_cache[key] = report
+            while len(_report_cache) > REPORT_CACHE_SIZE:
+                _report_cache.popitem(last=False)
+    return report
+
+
+# Query words that point at particular checks
+# Phrases are specific to one kind of violation: words like "total" or
+# "rate" appear in ordinary data questions and would trigger needless scans
+CHECK_KEYWORDS = {
+    "igst_on_intra_state": ("igst on intra", "intra-state", "intra state", "intrastate", "same state"),
+    "cgst_sgst_on_inter_state": ("inter-state", "inter state", "interstate"),
+    "cgst_sgst_unequal": ("cgst and sgst", "cgst/sgst", "unequal cgst", "unequal sgst"),
+    "tax_amount_mismatch": ("tax amount", "tax_amount", "wrong tax", "incorrect tax", "miscalculat"),
+    "invalid_gst_slab": ("slab", "invalid rate", "wrong rate", "incorrect rate"),
+    "hsn_rate_outlier": ("hsn",),
+    "totals_mismatch": ("grand total", "grand_total", "totals mismatch", "totals don't", "totals do not"),
+    "tax_split_mismatch": ("tax split", "split of tax", "tax breakup", "tax break-up"),
+    "line_items_mismatch": ("line item", "sub total", "subtotal", "sub_total"),
+    "invalid_seller_gstin": ("gstin", "checksum"),
+    "invalid_buyer_gstin": ("gstin", "checksum"),
+    "gstin_state_mismatch": ("gstin state", "state code"),
+}
+GENERIC_KEYWORDS = ("compliance", "compliant", "anomal", "violation", "audit", "discrepanc", "mismatch")
+
+
+def checks_for_query(query: str) -> list:
+    """
+    Checks relevant to a natural-language question; every check for
+    generic compliance questions, none if nothing matches.
+    """
+    q = query.lower()
+    matched = [name for name, words in CHECK_KEYWORDS.items() if any(w in q for w in words)]
+    if matched:
+        return matched
+    if any(w in q for w in GENERIC_KEYWORDS):
+        return list(CHECKS)
+    return []
+
+
+def write_report_csv(report: dict, path: str):
+    fields = sorted({k for row in report["flags"] for k in row})
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(report["flags"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic GST compliance checks")
+    parser.add_argument("--check", action="append", choices=list(CHECKS), help="Run only these checks")
+    parser.add_argument("--from-date")
+    parser.add_argument("--to-date")
+    parser.add_argument("--out", help="Write flagged rows to this CSV file")
+    args = parser.parse_args()
+
+    result = run_checks(args.check, args.from_date, args.to_date)
+    for check_name, summary in result["checks"].items():
+        print(f"{check_name:28s} {summary['violations']:>10,}  {summary['description']}")
+    if args.out:
+        write_report_csv(result, args.out)
+        print(f"Wrote {len(result['flags'])} flagged rows to {args.out}")
@@ -0,0 +1,252 @@
+import os
+import re
+import time
+import uuid
+import calendar
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+# =========================
+# Session Settings
+# =========================
+
+MAX_SESSIONS = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+
+# Rule chunks carried between turns of one conversation
+MAX_SESSION_CHUNKS = 8
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+
+# Refinement openers ("and in March?", "what about 2023?", "same for Karnataka")
+FOLLOW_UP_PREFIX_RE = re.compile(
+    r"^\s*(and|but|also|what about|how about|same for|same but|now|then|only|just|"
+    r"what if|instead)\b",
+    re.IGNORECASE,
+)
+# Anaphora pointing back at the previous answer. These are ordinary words
+# too ("goods that are exported", "invoices above 10000"), so they only
+# count in queries too short to stand alone
+FOLLOW_UP_REFERENCE_RE = re.compile(
+    r"\b(that|those|these|them|it|same|previous|above|earlier)\b", re.IGNORECASE
+)
+# Words that carry no topic of their own in "explain those" or "for March?"
+FILLER_WORDS = {
+    "a", "an", "the", "in", "for", "of", "during", "to", "on", "about", "is", "are", "was",
+    "what", "why", "how", "me", "please", "show", "explain", "summarise", "summarize",
+    "elaborate", "again", "ok", "okay", "then", "results", "result", "data", "rows",
+    "which", "ones", "one",
+}
+# A query with this many topic words is a question of its own
+STANDALONE_MIN_WORDS = 2
+SAME_DATA_RE = re.compile(r"\b(explain|summari[sz]e|why|elaborate|break (it|that) down)\b", re.IGNORECASE)
+
+# Short follow-ups only; longer questions are treated as new topics
+FOLLOW_UP_MAX_WORDS = 10
+
+DATE_LITERAL_RE = re.compile(r"'(\d{4})-(\d{2})(-\d{2})?(%?)'")
+MONTH_ONLY_RE = re.compile(r"(strftime\s*\(\s*'%m'\s*,[^)]*\)\s*=\s*)'(\d{2})'", re.IGNORECASE)
+YEAR_ONLY_RE = re.compile(r"(strftime\s*\(\s*'%Y'\s*,[^)]*\)\s*=\s*)'(\d{4})'", re.IGNORECASE)
+
+
+@dataclass
+class SessionState:
+    session_id: str
+    query_type: str = None
+    last_query: str = None
+    sql_query: str = None
+    query_result: list = None
+    row_limit_reached: bool = False
+    rule_chunks: list = field(default_factory=list)  # [{"id", "document"}]
+    turns: int = 0
+    updated_at: float = field(default_factory=time.time)
+    # Concurrent requests of one conversation read and update under this
+    lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def snapshot(self) -> "SessionState":
+        """
+        Consistent copy of the state for one request to read from.
+        """
+        with self.lock:
+            return replace(self, rule_chunks=list(self.rule_chunks))
+
+    def record_turn(self, **changes):
+        with self.lock:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.turns += 1
+            self.updated_at = time.time()
+
+
+class SessionStore:
+    """
+    Bounded LRU of conversation state; idle sessions expire after
+    SESSION_TTL_SECONDS. Session ids are always minted here: an unknown or
+    expired id from a client starts a new session under a fresh id.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id: str = None) -> SessionState:
+        with self._lock:
+            state = self._sessions.get(session_id) if session_id else None
+            if state is not None and time.time() - state.updated_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                state = None
+            if state is None:
+                state = SessionState(session_id=uuid.uuid4().hex)
+                self._sessions[state.session_id] = state
+            self._sessions.move_to_end(state.session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return state
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions = SessionStore()
+
+
+# =========================
+# Follow-up Detection
+# =========================
+
+def _topic_words(query: str) -> list:
+    """
+    Words left once periods, references and filler are removed.
+    """
+    return [
+        word for word in re.findall(r"[a-z0-9]+", query.lower())
+        if word not in FILLER_WORDS and word not in MONTHS
+        and not re.fullmatch(r"20\d{2}", word) and not FOLLOW_UP_REFERENCE_RE.fullmatch(word)
+    ]
+
+
+def is_follow_up(query: str, state: SessionState) -> bool:
+    """
+    True for short queries that open with a refinement ("and for March?",
+    "what about 2023?"), or that are too short to stand alone and either
+    name a period ("for March?") or refer back ("explain those"). If the
+    query names a period, the previous SQL must also patch cleanly to it;
+    anything else goes through full classification.
+    """
+    if not state.turns or not state.query_type:
+        return False
+    if len(query.split()) > FOLLOW_UP_MAX_WORDS:
+        return False
+    period = mentioned_period(query) != (None, None)
+    if not FOLLOW_UP_PREFIX_RE.search(query):
+        if len(_topic_words(query)) >= STANDALONE_MIN_WORDS:
+            return False
+        if not (period or FOLLOW_UP_REFERENCE_RE.search(query)):
+            return False
+    if period:
+        return bool(state.sql_query) and patch_sql_period(state.sql_query, query) is not None
+    return True
+
+
+def wants_same_data(query: str) -> bool:
+    """
+    Follow-ups that only ask to explain the previous result set.
+    """
+    return bool(SAME_DATA_RE.search(query)) and mentioned_period(query) == (None, None)
+
+
+def mentioned_period(query: str) -> tuple:
+    """
+    (month, year) named in a follow-up, e.g. "and for November?" -> (11, None).
+    """
+    month = year = None
+    lowered = query.lower()
+    for word in re.findall(r"[a-z]+", lowered):
+        if word not in MONTHS:
+            continue
+        # "may" is usually the verb unless it reads like a period
+        if word == "may" and not re.search(r"\b(in|for|of|during)\s+may\b|\bmay\s+\d{4}\b", lowered):
+            continue
+        month = MONTHS[word]
+        break
+    year_match = re.search(r"\b(20\d{2})\b", query)
+    if year_match:
+        year = int(year_match.group(1))
+    return month, year
+
+
+# =========================
+# SQL Predicate Patching
+# =========================
+
+def _shift_month(year: int, month: int, delta: int) -> tuple:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def patch_sql_period(sql: str, query: str):
+    """
+    Move the date predicates of the previous SQL to the month/year named in
+    a follow-up by shifting every date literal by the same number of months.
+    Returns None when the SQL has no date literals to shift or the previous
+    range is too wide to tell which month to replace.
+    """
+    month, year = mentioned_period(query)
+    if month is None and year is None:
+        return None
+
+    literals = [(int(m.group(1)), int(m.group(2))) for m in DATE_LITERAL_RE.finditer(sql)]
+    patched = sql
+    if literals:
+        first = min(literals)
+        last = max(literals)
+        span_months = (last[0] * 12 + last[1]) - (first[0] * 12 + first[1])
+        if month is not None and span_months > 1:
+            return None
+        target = (year or first[0], month or first[1])
+        delta = (target[0] * 12 + target[1]) - (first[0] * 12 + first[1])
+
+        def shift(match):
+            y, m = _shift_month(int(match.group(1)), int(match.group(2)), delta)
+            day = match.group(3)
+            if day:
+                old_last = calendar.monthrange(int(match.group(1)), int(match.group(2)))[1]
+                d = int(day[1:])
+                d = calendar.monthrange(y, m)[1] if d == old_last else min(d, calendar.monthrange(y, m)[1])
+                day = f"-{d:02d}"
+            return f"'{y:04d}-{m:02d}{day or ''}{match.group(4)}'"
+
+        patched = DATE_LITERAL_RE.sub(shift, patched)
+    else:
+        month_hits = MONTH_ONLY_RE.search(sql)
+        year_hits = YEAR_ONLY_RE.search(sql)
+        if (month is not None and not month_hits) or (year is not None and not year_hits and month is None):
+            return None
+        if month is not None:
+            patched = MONTH_ONLY_RE.sub(lambda m: f"{m.group(1)}'{month:02d}'", patched)
+        if year is not None and year_hits:
+            patched = YEAR_ONLY_RE.sub(lambda m: f"{m.group(1)}'{year:04d}'", patched)
+
+    return patched if patched != sql else None
+
+
+# =========================
+# Retrieved Context
+# =========================
+
+def merge_chunks(previous: list, new: list, limit: int = MAX_SESSION_CHUNKS) -> list:
+    """
+    New chunks first, then earlier ones not retrieved again, capped at limit.
+    """
+    merged, seen = [], set()
+    for chunk in list(new) + list(previous):
+        if chunk["id"] in seen:
+            continue
+        seen.add(chunk["id"])
+        merged.append(chunk)
+    return merged[:limit]
@@ -1,3 +1,5 @@
+import os
+
 from sqlalchemy import (
     create_engine,
     Column,
@@ -6,7 +8,8 @@ from sqlalchemy import (
     Float,
     Date,
     ForeignKey,
-    Text
+    Text,
+    text
 )
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
@@ -14,7 +17,7 @@ from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 # Database Configuration
 # =========================
 
-DATABASE_URL = "sqlite:///./invoices.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./invoices.db")
 
 engine = create_engine(
     DATABASE_URL,
@@ -37,7 +40,7 @@ class Invoice(Base):
     __tablename__ = "invoices"
 
     invoice_id = Column(String, primary_key=True, index=True)
-    invoice_date = Column(Date, nullable=False)
+    invoice_date = Column(Date, nullable=False, index=True)
 
     # Seller Details
     seller_name = Column(String, nullable=False)
@@ -77,7 +80,7 @@ class InvoiceItem(Base):
     __tablename__ = "invoice_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    invoice_id = Column(String, ForeignKey("invoices.invoice_id"), nullable=False)
+    invoice_id = Column(String, ForeignKey("invoices.invoice_id"), nullable=False, index=True)
 
     description = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False)
@@ -101,6 +104,10 @@ class InvoiceItem(Base):
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_invoice_date ON invoices (invoice_date)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoice_items_invoice_id ON invoice_items (invoice_id)"))
 
 
 def get_db():
@@ -0,0 +1,318 @@
+import io
+import os
+import zipfile
+import itertools
+import tempfile
+import threading
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from model_provider import get_provider, Attachment
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # optional: without it every PDF goes to the model
+    PdfReader = PdfWriter = None
+
+# =========================
+# Extraction Settings
+# =========================
+
+# Pages with less text than this are treated as scanned and sent to the model
+MIN_PAGE_CHARS = int(os.getenv("EXTRACT_MIN_PAGE_CHARS", "25"))
+# PDFs with at least this many pages are parsed in the shared process pool
+PARALLEL_MIN_PAGES = int(os.getenv("EXTRACT_PARALLEL_MIN_PAGES", "16"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Passage size used when splitting documents for the vector store
+CHUNK_CHARS = int(os.getenv("INGEST_CHUNK_CHARS", "2000"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "200"))
+
+TEXT_MIME_TYPES = {"application/json", "application/xml", "application/csv"}
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+UNKNOWN_MIME_TYPE = "application/octet-stream"
+
+# Leading bytes of formats we may receive without a usable mime type
+MAGIC_MIME_TYPES = (
+    (b"%PDF", "application/pdf"),
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+
+# Passage split points, best first
+CHUNK_SEPARATORS = ("\n\n", "\n", ". ")
+
+MODEL_EXTRACTION_PROMPT = "Extract all text from this document for RAG ingestion. If it's a GST rule or notice, ensure all details are captured."
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+# =========================
+# Model Fallback
+# =========================
+
+def extract_with_model(file_bytes: bytes, mime_type: str):
+    try:
+        print(f"Calling model for text extraction ({len(file_bytes) / (1024 * 1024):.2f} MB, {mime_type})...")
+        response_text = get_provider().generate([
+            MODEL_EXTRACTION_PROMPT,
+            Attachment(data=file_bytes, mime_type=mime_type)
+        ])
+        return response_text.strip()
+    except Exception as e:
+        print(f"Model text extraction error: {e}")
+        return None
+
+
+# =========================
+# Native Parsers
+# =========================
+
+def _decode_text(file_bytes: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return file_bytes.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return file_bytes.decode("utf-8", errors="replace")
+
+
+def _extract_docx(file_bytes: bytes) -> str:
+    """
+    Paragraph text from word/document.xml, streamed with iterparse.
+    """
+    paragraphs = []
+    with zipfile.ZipFile(io.BytesIO(file_bytes)) as archive:
+        with archive.open("word/document.xml") as xml_file:
+            for _, element in ET.iterparse(xml_file, events=("end",)):
+                if element.tag == f"{_W_NS}p":
+                    text = "".join(t.text or "" for t in element.iter(f"{_W_NS}t"))
+                    if text.strip():
+                        paragraphs.append(text)
+                    element.clear()
+    return "\n".join(paragraphs)
+
+
+def _read_pages(reader, start: int, end: int) -> list[str]:
+    pages = []
+    for page_no in range(start, end):
+        try:
+            pages.append(reader.pages[page_no].extract_text() or "")
+        except Exception as e:
+            print(f"Error extracting PDF page {page_no + 1}: {e}")
+            pages.append("")
+    return pages
+
+
+# Only set inside pool workers: the last PDF opened, keyed by (path, mtime)
+_worker_pdf = (None, None)
+
+
+def _extract_page_range(task):
+    """
+    Pool task: (path, start, end) -> page texts. Workers keep the last PDF
+    they opened, so consecutive ranges of one file are parsed once.
+    """
+    global _worker_pdf
+    path, start, end = task
+    key = (path, os.stat(path).st_mtime_ns)
+    if _worker_pdf[0] != key:
+        _worker_pdf = (key, PdfReader(path))
+    return _read_pages(_worker_pdf[1], start, end)
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    One process pool for every large PDF. Workers are spawned rather than
+    forked, since callers run on server and watchdog threads.
+    """
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pdf_pool
+
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _single_page_pdf(reader, page_no: int) -> bytes:
+    writer = PdfWriter()
+    writer.add_page(reader.pages[page_no])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def iter_pdf_pages(file_bytes: bytes):
+    """
+    Yield (page_no, text) in order. Text-layer pages are parsed locally
+    (in the shared process pool for large files, which read the PDF from
+    a temporary file); pages without a usable text layer are sent to the
+    model one page at a time.
+    """
+    reader = PdfReader(io.BytesIO(file_bytes))
+    page_count = len(reader.pages)
+
+    if page_count < PARALLEL_MIN_PAGES or EXTRACT_WORKERS <= 1:
+        yield from _with_ocr_fallback(reader, _read_pages(reader, 0, page_count))
+        return
+
+    step = max(1, -(-page_count // (EXTRACT_WORKERS * 4)))
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(file_bytes)
+        path = f.name
+    try:
+        tasks = [(path, s, min(s + step, page_count)) for s in range(0, page_count, step)]
+        batches = get_pdf_pool().map(_extract_page_range, tasks)
+        page_texts = (text for batch in batches for text in batch)
+        yield from _with_ocr_fallback(reader, page_texts)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); the next PDF gets a new pool
+        _reset_pdf_pool()
+        raise
+    finally:
+        os.remove(path)
+
+
+def _with_ocr_fallback(reader, page_texts):
+    for page_no, text in enumerate(page_texts):
+        if len(text.strip()) < MIN_PAGE_CHARS:
+            print(f"Page {page_no + 1} has no text layer, falling back to model")
+            text = extract_with_model(_single_page_pdf(reader, page_no), "application/pdf") or ""
+        yield page_no, text
+
+
+# =========================
+# Entry Point
+# =========================
+
+def sniff_mime_type(file_bytes: bytes) -> str:
+    """
+    Best guess from the content when the caller has no mime type.
+    """
+    for magic, mime_type in MAGIC_MIME_TYPES:
+        if file_bytes.startswith(magic):
+            return mime_type
+    if file_bytes.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(io.BytesIO(file_bytes)) as archive:
+                if "word/document.xml" in archive.namelist():
+                    return DOCX_MIME_TYPE
+        except zipfile.BadZipFile:
+            pass
+        return UNKNOWN_MIME_TYPE
+    try:
+        file_bytes.decode("utf-8")
+        return "text/plain"
+    except UnicodeDecodeError:
+        return UNKNOWN_MIME_TYPE
+
+
+def iter_text(file_bytes: bytes, mime_type: str = None):
+    """
+    Yield the text of a document in order: page by page for PDFs, in one
+    piece otherwise. Parsed locally where possible; yields nothing if no
+    text could be extracted.
+    """
+    if not mime_type or mime_type == UNKNOWN_MIME_TYPE:
+        mime_type = sniff_mime_type(file_bytes)
+
+    if mime_type.startswith("text/") or mime_type in TEXT_MIME_TYPES:
+        yield _decode_text(file_bytes)
+        return
+
+    if mime_type == DOCX_MIME_TYPE:
+        try:
+            text = _extract_docx(file_bytes)
+        except Exception as e:
+            print(f"DOCX parse failed ({e}), falling back to model")
+            text = extract_with_model(file_bytes, mime_type)
+        if text:
+            yield text
+        return
+
+    if mime_type == "application/pdf" and PdfReader is not None:
+        try:
+            pages = iter_pdf_pages(file_bytes)
+            # The PDF is opened on the first step; after that errors are per page
+            first = next(pages, None)
+        except Exception as e:
+            print(f"PDF parse failed ({e}), falling back to model")
+        else:
+            page_count = 0
+            for _, text in itertools.chain([first] if first else [], pages):
+                page_count += 1
+                if text.strip():
+                    yield text
+            print(f"Extracted {page_count} PDF pages locally")
+            return
+
+    # Images, unknown formats and unreadable PDFs
+    text = extract_with_model(file_bytes, mime_type)
+    if text:
+        yield text
+
+
+def extract_text(file_bytes: bytes, mime_type: str = None):
+    """
+    Text of a document as one string (see iter_text). Returns None if
+    nothing could be extracted.
+    """
+    return "\n\n".join(iter_text(file_bytes, mime_type)) or None
+
+
+def _passage_end(text: str, max_chars: int) -> int:
+    window = text[:max_chars]
+    # A paragraph break in the second half beats a later line or sentence break
+    for separator in CHUNK_SEPARATORS:
+        cut = window.rfind(separator)
+        if cut > max_chars // 2:
+            return cut + 1
+    return max_chars
+
+
+def iter_chunks(texts, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP):
+    """
+    Split a stream of texts (e.g. PDF pages, joined by blank lines) into
+    passages of at most max_chars, preferring paragraph and sentence
+    boundaries, with a small overlap between passages. Only the text not
+    yet emitted is held, so long documents are never joined in memory.
+    """
+    buffer = ""
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        buffer = f"{buffer}\n\n{text}" if buffer else text
+        while len(buffer) > max_chars:
+            end = _passage_end(buffer, max_chars)
+            chunk = buffer[:end].strip()
+            if chunk:
+                yield chunk
+            buffer = buffer[max(end - overlap, 1):]
+    buffer = buffer.strip()
+    if buffer:
+        yield buffer
+
+
+def chunk_text(content: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """
+    Split text into passages; see iter_chunks.
+    """
+    return list(iter_chunks([content], max_chars, overlap))
+
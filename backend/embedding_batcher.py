@@ -0,0 +1,94 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from model_provider import get_provider
+from telemetry import observe, traced_for
+
+# =========================
+# Batching Settings
+# =========================
+
+# Gemini accepts up to 100 texts per embed_content call
+MAX_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+MAX_CONCURRENT_BATCHES = int(os.getenv("EMBED_BATCH_CONCURRENCY", "4"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100)
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts from concurrent callers for up to MAX_WAIT_MS (or until
+    MAX_BATCH_SIZE) and embeds them with one provider call per task type,
+    resolving each caller's future with its own vector.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+                 max_concurrent_batches: int = MAX_CONCURRENT_BATCHES):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embed-batch")
+        self._worker = threading.Thread(target=self._collect_loop, name="embed-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> Future:
+        future = Future()
+        # The caller's context travels with the text so the batched model
+        # call is still recorded on the caller's request trace
+        self._queue.put((text, task_type, future, contextvars.copy_context()))
+        return future
+
+    def embed(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+        futures = [self.submit(t, task_type) for t in texts]
+        return [f.result() for f in futures]
+
+    def _collect_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            by_task = {}
+            for request in batch:
+                by_task.setdefault(request[1], []).append(request)
+            for task_type, requests in by_task.items():
+                self._pool.submit(self._dispatch, task_type, requests)
+
+    def _dispatch(self, task_type: str, requests: list):
+        observe("gst_embed_batch_size", len(requests), buckets=BATCH_SIZE_BUCKETS)
+        try:
+            with traced_for([r[3] for r in requests]):
+                vectors = get_provider().embed([r[0] for r in requests], task_type=task_type)
+            if len(vectors) != len(requests):
+                raise ValueError(f"Expected {len(requests)} embeddings, got {len(vectors)}")
+        except Exception as e:
+            for _, _, future, _ in requests:
+                future.set_exception(e)
+            return
+        for (_, _, future, _), vector in zip(requests, vectors):
+            future.set_result(vector)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = EmbeddingBatcher()
+    return _batcher
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import argparse
+import threading
+
+# =========================
+# Cache Settings
+# =========================
+
+CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "extraction_cache")
+)
+
+# Cache entries checked against the live and archived tables per batch
+REMATERIALIZE_CHUNK = 500
+
+
+class ExtractionCache:
+    """
+    Parsed invoice JSON on disk, one file per (version, sha256 of the upload):
+    <dir>/<version>/<sha[:2]>/<sha>.json. Bumping the version (prompt or
+    schema change) starts a fresh namespace; old entries stay re-readable.
+    Uploads rejected as duplicates keep their entry, marked with
+    "rejected_as_duplicate_of", so re-materialization can leave them out.
+    """
+
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, version: str, file_hash: str) -> str:
+        return os.path.join(self.root, version, file_hash[:2], f"{file_hash}.json")
+
+    def get(self, file_hash: str, version: str):
+        path = self._path(version, file_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)["data"]
+        except Exception as e:
+            print(f"Error reading extraction cache entry {path}: {e}")
+            return None
+
+    def _write_locked(self, path: str, entry: dict):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def put(self, file_hash: str, version: str, data: dict, mime_type: str = None):
+        path = self._path(version, file_hash)
+        entry = {
+            "file_sha256": file_hash,
+            "version": version,
+            "mime_type": mime_type,
+            "extracted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "data": data,
+        }
+        try:
+            with self._lock:
+                self._write_locked(path, entry)
+        except Exception as e:
+            print(f"Error writing extraction cache entry {path}: {e}")
+
+    def mark_rejected(self, file_hash: str, version: str, duplicate_of: dict = None):
+        """
+        Record that the upload was refused as a duplicate of duplicate_of,
+        or clear the mark (duplicate_of=None) once it is saved after all.
+        """
+        path = self._path(version, file_hash)
+        try:
+            with self._lock:
+                if not os.path.exists(path):
+                    return
+                with open(path, "r") as f:
+                    entry = json.load(f)
+                if entry.get("rejected_as_duplicate_of") == duplicate_of:
+                    return
+                if duplicate_of is None:
+                    entry.pop("rejected_as_duplicate_of", None)
+                else:
+                    entry["rejected_as_duplicate_of"] = duplicate_of
+                self._write_locked(path, entry)
+        except Exception as e:
+            print(f"Error updating extraction cache entry {path}: {e}")
+
+    def iter_entries(self, version: str):
+        version_dir = os.path.join(self.root, version)
+        if not os.path.isdir(version_dir):
+            return
+        for prefix in sorted(os.listdir(version_dir)):
+            prefix_dir = os.path.join(version_dir, prefix)
+            for name in sorted(os.listdir(prefix_dir)):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(prefix_dir, name), "r") as f:
+                        yield json.load(f)
+                except Exception as e:
+                    print(f"Skipping unreadable cache entry {name}: {e}")
+
+    def versions(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
+
+
+# =========================
+# Re-materialization
+# =========================
+
+def rematerialize(version: str = None, replace: bool = False) -> dict:
+    """
+    Rebuild invoices/invoice_items from cached extractions, with no model
+    calls. Existing invoices are kept unless replace=True; extractions the
+    upload endpoint rejected as duplicates are never replayed.
+    """
+    from database import SessionLocal, Invoice, init_db
+    from structured_agent import save_invoice_to_db, EXTRACTION_VERSION
+    from invoice_dedup import get_dedup_index
+    from invoice_partitions import archived_invoice_ids
+
+    version = version or EXTRACTION_VERSION
+    init_db()
+    summary = {"version": version, "saved": 0, "skipped": 0, "rejected": 0, "failed": 0}
+    indexed = []
+
+    def _rematerialize_chunk(entries):
+        ids = [e["data"].get("invoice_id") for e in entries]
+        # Archived years are read-only; never re-insert them into the live tables
+        archived = archived_invoice_ids(ids)
+        db = SessionLocal()
+        try:
+            live = {r[0] for r in db.query(Invoice.invoice_id).filter(Invoice.invoice_id.in_(ids))}
+        finally:
+            db.close()
+
+        for entry in entries:
+            data = entry["data"]
+            invoice_id = data.get("invoice_id")
+            exists = invoice_id in live
+            if invoice_id in archived or (exists and not replace):
+                summary["skipped"] += 1
+                continue
+            # Delete and re-insert commit together inside save_invoice_to_db
+            if save_invoice_to_db(data, replace=exists):
+                indexed.append((invoice_id, data, entry["file_sha256"]))
+                summary["saved"] += 1
+            else:
+                summary["failed"] += 1
+
+    chunk = []
+    for entry in get_extraction_cache().iter_entries(version):
+        if entry.get("rejected_as_duplicate_of"):
+            summary["rejected"] += 1
+            continue
+        chunk.append(entry)
+        if len(chunk) >= REMATERIALIZE_CHUNK:
+            _rematerialize_chunk(chunk)
+            chunk = []
+    if chunk:
+        _rematerialize_chunk(chunk)
+
+    # One dedup log append for the whole run
+    if indexed:
+        get_dedup_index().add_many(indexed)
+    print(f"Re-materialized from extraction cache: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cached invoice extractions")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    remat_cmd = sub.add_parser("rematerialize", help="Rebuild the invoice tables from cached extractions")
+    remat_cmd.add_argument("--version", help="Cache version (defaults to the current extraction version)")
+    remat_cmd.add_argument("--replace", action="store_true", help="Overwrite invoices that already exist")
+
+    sub.add_parser("versions", help="List cached extraction versions")
+
+    args = parser.parse_args()
+    if args.command == "rematerialize":
+        rematerialize(args.version, args.replace)
+    else:
+        for cache_version in get_extraction_cache().versions():
+            print(cache_version)
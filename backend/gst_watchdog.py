@@ -1,14 +1,49 @@
 import os
+import json
 import time
 import mimetypes
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from dotenv import load_dotenv
-load_dotenv()
-from unstructured_agent import ingest_document_file, store
+from unstructured_agent import ingest_document_file, get_store, VECTOR_STORE_PATH
 import threading
 
-WATCH_DIRECTORY = os.path.join(os.path.dirname(__file__), "gst_docs")
+WATCH_DIRECTORY = os.getenv("GST_DOCS_DIR", os.path.join(os.path.dirname(__file__), "gst_docs"))
+
+# size + mtime of every ingested file, so restarts only re-ingest changed files
+MANIFEST_PATH = os.getenv("GST_INGEST_MANIFEST", VECTOR_STORE_PATH + ".manifest.json")
+_manifest_lock = threading.Lock()
+
+# Read by the /ready endpoint
+scan_state = {"initial_scan_done": False, "files_ingested": 0, "files_skipped": 0}
+
+
+def _load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        try:
+            with open(MANIFEST_PATH, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading ingest manifest: {e}")
+    return {}
+
+
+def _update_manifest(doc_id, signature):
+    with _manifest_lock:
+        manifest = _load_manifest()
+        if signature is None:
+            manifest.pop(doc_id, None)
+        else:
+            manifest[doc_id] = signature
+        with open(MANIFEST_PATH, "w") as f:
+            json.dump(manifest, f)
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+mimetypes.add_type("text/markdown", ".md")
+mimetypes.add_type("application/vnd.openxmlformats-officedocument.wordprocessingml.document", ".docx")
 
 def get_mime_type(file_path):
     mime_type, _ = mimetypes.guess_type(file_path)
@@ -28,7 +63,8 @@ class GSTFolderHandler(FileSystemEventHandler):
             doc_id = os.path.basename(event.src_path)
             print(f"File deleted: {doc_id}. Removing from vector store...")
             try:
-                store.delete(ids=[doc_id])
+                get_store().delete_document(doc_id)
+                _update_manifest(doc_id, None)
                 print(f"Successfully removed {doc_id} from Vector Store.")
             except Exception as e:
                 print(f"Error removing {doc_id} from Vector Store: {e}")
@@ -41,12 +77,14 @@ class GSTFolderHandler(FileSystemEventHandler):
             
         print(f"Processing file: {filename}")
         try:
+            signature = _file_signature(file_path)
             with open(file_path, "rb") as f:
                 file_bytes = f.read()
             
             mime_type = get_mime_type(file_path)
             success = ingest_document_file(filename, file_bytes, mime_type)
             if success:
+                _update_manifest(filename, signature)
                 print(f"Successfully ingested {filename}")
             else:
                 print(f"Failed to ingest {filename}")
@@ -60,17 +98,29 @@ def run_initial_scan():
         print(f"Created directory: {WATCH_DIRECTORY}")
         return
 
+    manifest = _load_manifest()
+    known_ids = get_store().document_ids()
+    handler = GSTFolderHandler()
     for filename in os.listdir(WATCH_DIRECTORY):
         file_path = os.path.join(WATCH_DIRECTORY, filename)
         if os.path.isfile(file_path):
-            # Check if already in collection if possible, or just upsert
-            # For simplicity, we just upsert everything on startup
-            handler = GSTFolderHandler()
+            # Unchanged since the last ingestion: keep the stored vectors
+            if manifest.get(filename) == _file_signature(file_path) and filename in known_ids:
+                scan_state["files_skipped"] += 1
+                continue
             handler.process_file(file_path)
+            scan_state["files_ingested"] += 1
+    print(
+        f"Initial scan done: {scan_state['files_ingested']} ingested, "
+        f"{scan_state['files_skipped']} unchanged"
+    )
 
 def start_watchdog():
-    # Run initial scan in a separate thread to not block the main process
+    # Runs in a background thread (see start_watchdog_background); the
+    # vector store is loaded here rather than at import time
+    get_store()
     run_initial_scan()
+    scan_state["initial_scan_done"] = True
     
     event_handler = GSTFolderHandler()
     observer = Observer()
@@ -0,0 +1,491 @@
+import os
+import re
+import csv
+import json
+import zlib
+import argparse
+import tempfile
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+
+from invoice_partitions import open_invoice_reader
+
+# =========================
+# Reconciliation Settings
+# =========================
+
+# Rows read per chunk from the database / CSV inputs
+CHUNK_ROWS = 100_000
+
+# Bucket count for the on-disk hash partitioning; every bucket is
+# reconciled on its own, so memory is bounded by the largest bucket
+DEFAULT_BUCKETS = 64
+
+# Amount differences (in rupees) treated as equal
+AMOUNT_TOLERANCE = 1.0
+
+# Max days between book and supplier invoice dates for a fuzzy match
+DATE_WINDOW_DAYS = 7
+
+# Fuzzy candidates kept per book row, best scores first
+FUZZY_MAX_CANDIDATES = 10
+
+# Invoice-number similarity (0-1) a value/date pair needs to count as a
+# fuzzy match; weaker pairs are only reported as probable matches
+FUZZY_MIN_NUMBER_SIMILARITY = 0.5
+
+# Accepted CSV headers for each normalized field (first match wins)
+COLUMN_ALIASES = {
+    "gstin": ["gstin", "supplier_gstin", "seller_gstin", "gstin_of_supplier", "ctin"],
+    "invoice_no": ["invoice_no", "invoice_number", "invoice_id", "inum"],
+    "invoice_date": ["invoice_date", "date", "idt"],
+    "taxable_value": ["taxable_value", "sub_total", "txval"],
+    "tax": ["tax", "total_tax", "tax_amount"],
+    "invoice_value": ["invoice_value", "grand_total", "val"],
+}
+TAX_PARTS = ["igst", "cgst", "sgst", "cess"]
+
+BUCKET_FIELDS = ["gstin", "invoice_no", "invoice_key", "invoice_date",
+                 "taxable_value", "tax", "invoice_value"]
+
+REPORT_FIELDS = [
+    "status", "reason", "gstin",
+    "book_invoice_no", "supplier_invoice_no",
+    "book_date", "supplier_date",
+    "book_invoice_value", "supplier_invoice_value",
+    "book_tax", "supplier_tax",
+    "invoice_value_diff", "tax_diff",
+]
+
+MATCHED = "MATCHED"
+FUZZY_MATCHED = "FUZZY_MATCHED"
+PROBABLE_MATCH = "PROBABLE_MATCH"
+MISMATCH = "MISMATCH"
+MISSING_IN_SUPPLIER = "MISSING_IN_SUPPLIER_DATA"
+MISSING_IN_BOOKS = "MISSING_IN_BOOKS"
+
+
+# =========================
+# Normalization
+# =========================
+
+def normalize_gstin(value) -> str:
+    return re.sub(r"\s+", "", str(value or "")).upper()
+
+
+def normalize_invoice_no(value) -> str:
+    """
+    Upper-case and split into letter and digit segments, dropping
+    separators and the leading zeros of each numeric segment, so that
+    'inv/0042', 'INV-42' and 'INV 042' share one key while
+    '2023/0042' and '2023/42' match but '1-23' and '12-3' do not.
+    """
+    segments = re.findall(r"[A-Z]+|[0-9]+", str(value or "").upper())
+    return "-".join((s.lstrip("0") or "0") if s.isdigit() else s for s in segments)
+
+
+@lru_cache(maxsize=65536)
+def _bigrams(key: str) -> frozenset:
+    return frozenset(key[i:i + 2] for i in range(len(key) - 1)) or frozenset([key])
+
+
+def invoice_no_similarity(a: str, b: str) -> float:
+    """
+    0-1 similarity of two normalized invoice keys (Dice coefficient of
+    character bigrams), used to score fuzzy pairs.
+    """
+    if not a or not b:
+        return 0.0
+    grams_a, grams_b = _bigrams(a), _bigrams(b)
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def normalize_date(value) -> str:
+    text = str(value or "").strip()
+    if not text:
+        return ""
+    for pattern in (r"(\d{4})-(\d{2})-(\d{2})", r"(\d{2})[-/](\d{2})[-/](\d{4})"):
+        match = re.match(pattern, text)
+        if match:
+            parts = match.groups()
+            if len(parts[0]) == 2:
+                parts = (parts[2], parts[1], parts[0])
+            return f"{parts[0]}-{parts[1]}-{parts[2]}"
+    return ""
+
+
+def _to_float(value) -> float:
+    try:
+        return float(str(value).replace(",", "")) if value not in (None, "") else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _date_ordinal(value: str) -> int:
+    try:
+        return date.fromisoformat(value).toordinal() if value else -1
+    except ValueError:
+        return -1
+
+
+def _normalize_record(raw: dict) -> dict:
+    invoice_no = str(raw.get("invoice_no") or "")
+    return {
+        "gstin": normalize_gstin(raw.get("gstin")),
+        "invoice_no": invoice_no,
+        "invoice_key": normalize_invoice_no(invoice_no),
+        "invoice_date": normalize_date(raw.get("invoice_date")),
+        "taxable_value": _to_float(raw.get("taxable_value")),
+        "tax": _to_float(raw.get("tax")),
+        "invoice_value": _to_float(raw.get("invoice_value")),
+    }
+
+
+# =========================
+# Chunked Readers
+# =========================
+
+def _resolve_columns(header: list) -> dict:
+    lowered = {re.sub(r"[^a-z0-9]+", "_", h.strip().lower()).strip("_"): h for h in header}
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                mapping[field] = lowered[alias]
+                break
+    mapping["tax_parts"] = [lowered[p] for p in TAX_PARTS if p in lowered]
+    return mapping
+
+
+def read_csv_chunks(path: str, chunk_rows: int = CHUNK_ROWS):
+    """
+    Stream a books or GSTR-2A/2B style CSV as lists of normalized records.
+    """
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        mapping = _resolve_columns(reader.fieldnames or [])
+        missing = [k for k in ("gstin", "invoice_no") if k not in mapping]
+        if missing:
+            raise ValueError(f"{path}: missing required columns {missing}")
+
+        chunk = []
+        for row in reader:
+            raw = {field: row.get(column) for field, column in mapping.items() if field != "tax_parts"}
+            if "tax" not in mapping and mapping["tax_parts"]:
+                raw["tax"] = sum(_to_float(row.get(c)) for c in mapping["tax_parts"])
+            chunk.append(_normalize_record(raw))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def read_books_from_db(chunk_rows: int = CHUNK_ROWS):
+    """
+    Stream our purchase register (invoices table, including archived
+    financial years) as normalized records.
+    """
+    conn = open_invoice_reader()
+    try:
+        cursor = conn.execute(
+            "SELECT seller_gstin, invoice_id, invoice_date, sub_total, total_tax, grand_total "
+            "FROM invoices"
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield [
+                _normalize_record({
+                    "gstin": r[0], "invoice_no": r[1], "invoice_date": r[2],
+                    "taxable_value": r[3], "tax": r[4], "invoice_value": r[5],
+                })
+                for r in rows
+            ]
+    finally:
+        conn.close()
+
+
+# =========================
+# Hash Partitioning
+# =========================
+
+def _bucket_of(gstin: str, buckets: int) -> int:
+    return zlib.crc32(gstin.encode()) % buckets
+
+
+def partition_to_disk(chunks, work_dir: str, side: str, buckets: int) -> int:
+    """
+    Spill records into per-GSTIN-hash bucket files so both sides of a
+    bucket fit in memory together. Returns the number of rows written.
+    """
+    files = [open(os.path.join(work_dir, f"{side}-{b:04d}.csv"), "w", newline="")
+             for b in range(buckets)]
+    writers = [csv.DictWriter(f, fieldnames=BUCKET_FIELDS) for f in files]
+    total = 0
+    try:
+        for chunk in chunks:
+            for record in chunk:
+                writers[_bucket_of(record["gstin"], buckets)].writerow(record)
+            total += len(chunk)
+    finally:
+        for f in files:
+            f.close()
+    return total
+
+
+def _read_bucket(work_dir: str, side: str, bucket: int) -> list[dict]:
+    path = os.path.join(work_dir, f"{side}-{bucket:04d}.csv")
+    records = []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f, fieldnames=BUCKET_FIELDS):
+            for field in ("taxable_value", "tax", "invoice_value"):
+                row[field] = float(row[field])
+            records.append(row)
+    return records
+
+
+# =========================
+# Matching
+# =========================
+
+def _report_row(status: str, book: dict = None, supplier: dict = None, reason: str = "") -> dict:
+    book = book or {}
+    supplier = supplier or {}
+    row = {
+        "status": status,
+        "reason": reason,
+        "gstin": book.get("gstin") or supplier.get("gstin"),
+        "book_invoice_no": book.get("invoice_no", ""),
+        "supplier_invoice_no": supplier.get("invoice_no", ""),
+        "book_date": book.get("invoice_date", ""),
+        "supplier_date": supplier.get("invoice_date", ""),
+        "book_invoice_value": book.get("invoice_value", ""),
+        "supplier_invoice_value": supplier.get("invoice_value", ""),
+        "book_tax": book.get("tax", ""),
+        "supplier_tax": supplier.get("tax", ""),
+        "invoice_value_diff": "",
+        "tax_diff": "",
+    }
+    if book and supplier:
+        row["invoice_value_diff"] = round(book["invoice_value"] - supplier["invoice_value"], 2)
+        row["tax_diff"] = round(book["tax"] - supplier["tax"], 2)
+    return row
+
+
+def _compare_exact(book: dict, supplier: dict, tolerance: float, window: int) -> tuple:
+    reasons = []
+    if abs(book["tax"] - supplier["tax"]) > tolerance:
+        reasons.append("tax")
+    if abs(book["invoice_value"] - supplier["invoice_value"]) > tolerance:
+        reasons.append("invoice_value")
+    book_day = _date_ordinal(book["invoice_date"])
+    supplier_day = _date_ordinal(supplier["invoice_date"])
+    if book_day >= 0 and supplier_day >= 0 and abs(book_day - supplier_day) > window:
+        reasons.append("date")
+    if reasons:
+        return MISMATCH, "+".join(reasons)
+    return MATCHED, ""
+
+
+def _supplier_blocks(suppliers: list, tolerance: float) -> dict:
+    """
+    Supplier row indices keyed by invoice value bucket (value / tolerance),
+    each split into date-sorted dated rows and undated rows.
+    """
+    step = max(tolerance, 1e-9)
+    grouped = {}
+    for i, s in enumerate(suppliers):
+        grouped.setdefault(int(s["invoice_value"] // step), []).append(i)
+    blocks = {}
+    for bucket, indices in grouped.items():
+        indices = np.array(indices)
+        days = np.array([_date_ordinal(suppliers[i]["invoice_date"]) for i in indices])
+        dated = np.argsort(days, kind="stable")
+        dated = dated[days[dated] >= 0]
+        blocks[bucket] = (days[dated], indices[dated], indices[days < 0])
+    return blocks
+
+
+def _fuzzy_match_group(books: list, suppliers: list, tolerance: float, window: int) -> list:
+    """
+    Pair leftover rows of one GSTIN by value/date closeness. Suppliers are
+    blocked by value bucket and sorted by date, so each book row is only
+    compared with suppliers inside the amount tolerance and date window,
+    and only its FUZZY_MAX_CANDIDATES best candidates are kept. Pairs are
+    then assigned greedily, best score first, one-to-one.
+    Returns [(book index, supplier index, invoice-number similarity)].
+    """
+    sup_value = np.array([s["invoice_value"] for s in suppliers])
+    sup_tax = np.array([s["tax"] for s in suppliers])
+    sup_day = np.array([_date_ordinal(s["invoice_date"]) for s in suppliers])
+    blocks = _supplier_blocks(suppliers, tolerance)
+    step = max(tolerance, 1e-9)
+
+    candidates = []
+    for b_index, book in enumerate(books):
+        b_day = _date_ordinal(book["invoice_date"])
+        bucket = int(book["invoice_value"] // step)
+        parts = []
+        for neighbour in (bucket - 1, bucket, bucket + 1):
+            if neighbour not in blocks:
+                continue
+            days, dated, undated = blocks[neighbour]
+            if b_day < 0:
+                parts.append(dated)
+            else:
+                lo = np.searchsorted(days, b_day - window, side="left")
+                hi = np.searchsorted(days, b_day + window, side="right")
+                parts.append(dated[lo:hi])
+            parts.append(undated)
+        block = np.concatenate(parts) if parts else np.array([], dtype=np.int64)
+        if not len(block):
+            continue
+
+        value_diff = np.abs(book["invoice_value"] - sup_value[block])
+        ok = (value_diff <= tolerance) & (np.abs(book["tax"] - sup_tax[block]) <= tolerance)
+        if not ok.any():
+            continue
+        block, value_diff = block[ok], value_diff[ok]
+        day_diff = np.where((b_day < 0) | (sup_day[block] < 0), 0, np.abs(b_day - sup_day[block]))
+
+        score = value_diff / step + day_diff / max(window, 1)
+        if len(block) > FUZZY_MAX_CANDIDATES:
+            best = np.argpartition(score, FUZZY_MAX_CANDIDATES - 1)[:FUZZY_MAX_CANDIDATES]
+            block, score = block[best], score[best]
+        for s_index, base_score in zip(block, score):
+            similarity = invoice_no_similarity(book["invoice_key"], suppliers[s_index]["invoice_key"])
+            candidates.append((float(base_score) + 1.0 - similarity, b_index, int(s_index), similarity))
+
+    candidates.sort()
+    used_books, used_suppliers, pairs = set(), set(), []
+    for _score, b, s, similarity in candidates:
+        if b in used_books or s in used_suppliers:
+            continue
+        used_books.add(b)
+        used_suppliers.add(s)
+        pairs.append((b, s, similarity))
+    return pairs
+
+
+def reconcile_bucket(books: list, suppliers: list,
+                     tolerance: float = AMOUNT_TOLERANCE,
+                     window: int = DATE_WINDOW_DAYS) -> list[dict]:
+    # Exact pass: hash index on (gstin, normalized invoice number). Rows
+    # without an invoice number cannot be keyed and go to the fuzzy pass.
+    index, supplier_leftovers = {}, []
+    for s in suppliers:
+        if s["invoice_key"]:
+            index.setdefault((s["gstin"], s["invoice_key"]), []).append(s)
+        else:
+            supplier_leftovers.append(s)
+
+    report, book_leftovers = [], []
+    for b in books:
+        matches = index.get((b["gstin"], b["invoice_key"])) if b["invoice_key"] else None
+        if matches:
+            supplier = matches.pop()
+            status, reason = _compare_exact(b, supplier, tolerance, window)
+            report.append(_report_row(status, b, supplier, reason))
+        else:
+            book_leftovers.append(b)
+    supplier_leftovers += [s for rows in index.values() for s in rows]
+
+    # Fuzzy pass per GSTIN on whatever the exact pass left behind
+    books_by_gstin, suppliers_by_gstin = {}, {}
+    for b in book_leftovers:
+        books_by_gstin.setdefault(b["gstin"], []).append(b)
+    for s in supplier_leftovers:
+        suppliers_by_gstin.setdefault(s["gstin"], []).append(s)
+
+    for gstin in set(books_by_gstin) | set(suppliers_by_gstin):
+        group_books = books_by_gstin.get(gstin, [])
+        group_suppliers = suppliers_by_gstin.get(gstin, [])
+        pairs = []
+        if group_books and group_suppliers:
+            pairs = _fuzzy_match_group(group_books, group_suppliers, tolerance, window)
+        matched_b = {b for b, _, _ in pairs}
+        matched_s = {s for _, s, _ in pairs}
+        for b, s, similarity in pairs:
+            # Value and date alone do not prove two invoices are the same one
+            if similarity >= FUZZY_MIN_NUMBER_SIMILARITY:
+                status, reason = FUZZY_MATCHED, f"invoice number differs (similarity {similarity:.2f})"
+            else:
+                status = PROBABLE_MATCH
+                reason = f"value and date match, invoice numbers do not (similarity {similarity:.2f})"
+            report.append(_report_row(status, group_books[b], group_suppliers[s], reason))
+        for i, b in enumerate(group_books):
+            if i not in matched_b:
+                report.append(_report_row(MISSING_IN_SUPPLIER, book=b))
+        for i, s in enumerate(group_suppliers):
+            if i not in matched_s:
+                report.append(_report_row(MISSING_IN_BOOKS, supplier=s))
+    return report
+
+
+# =========================
+# Reconciliation Driver
+# =========================
+
+def reconcile(supplier_chunks, book_chunks, report_path: str,
+              buckets: int = DEFAULT_BUCKETS,
+              tolerance: float = AMOUNT_TOLERANCE,
+              window: int = DATE_WINDOW_DAYS) -> dict:
+    """
+    Match books against supplier-filed (GSTR-2A/2B) data and write a CSV
+    mismatch report. Inputs are iterables of record chunks, so neither
+    side has to fit in memory. Returns summary counts and ITC at risk.
+    """
+    summary = {
+        "book_rows": 0,
+        "supplier_rows": 0,
+        "status_counts": {},
+        "itc_at_risk": 0.0,
+    }
+    with tempfile.TemporaryDirectory(prefix="gstr_recon_") as work_dir:
+        summary["book_rows"] = partition_to_disk(book_chunks, work_dir, "books", buckets)
+        summary["supplier_rows"] = partition_to_disk(supplier_chunks, work_dir, "supplier", buckets)
+        print(
+            f"[reconciliation] partitioned {summary['book_rows']} book rows and "
+            f"{summary['supplier_rows']} supplier rows into {buckets} buckets"
+        )
+
+        with open(report_path, "w", newline="") as out:
+            writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for bucket in range(buckets):
+                books = _read_bucket(work_dir, "books", bucket)
+                suppliers = _read_bucket(work_dir, "supplier", bucket)
+                for row in reconcile_bucket(books, suppliers, tolerance, window):
+                    writer.writerow(row)
+                    counts = summary["status_counts"]
+                    counts[row["status"]] = counts.get(row["status"], 0) + 1
+                    # ITC claimed in books but not backed by the supplier's filing
+                    if row["status"] in (MISSING_IN_SUPPLIER, PROBABLE_MATCH):
+                        summary["itc_at_risk"] += row["book_tax"]
+                    elif row["status"] == MISMATCH and row["tax_diff"] > 0:
+                        summary["itc_at_risk"] += row["tax_diff"]
+
+    summary["itc_at_risk"] = round(summary["itc_at_risk"], 2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile invoices against GSTR-2A/2B data")
+    parser.add_argument("--supplier", required=True, help="GSTR-2A/2B CSV file")
+    parser.add_argument("--books", help="Books CSV (defaults to the invoices table)")
+    parser.add_argument("--out", default="reconciliation_report.csv")
+    parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS)
+    parser.add_argument("--tolerance", type=float, default=AMOUNT_TOLERANCE)
+    parser.add_argument("--date-window", type=int, default=DATE_WINDOW_DAYS)
+    args = parser.parse_args()
+
+    books_source = read_csv_chunks(args.books) if args.books else read_books_from_db()
+    result = reconcile(
+        read_csv_chunks(args.supplier), books_source, args.out,
+        buckets=args.buckets, tolerance=args.tolerance, window=args.date_window,
+    )
+    print(json.dumps(result, indent=2))
@@ -1,34 +1,50 @@
-import os
-from dotenv import load_dotenv
-load_dotenv()
-from sqlalchemy import text
-from database import engine
 from structured_agent import process_structured_query
-from unstructured_agent import process_unstructured_query
-from google import genai
+from unstructured_agent import retrieve_rule_chunks, rule_context
+from retrieval import HYBRID_RETRIEVAL
+from result_formatter import summarize_rows
+from compliance_checks import checks_for_query, get_compliance_report
+from model_provider import get_provider
+from telemetry import span
 
-# Initialize Gemini client
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY is not set in your environment!")
-
-client = genai.Client(api_key=api_key)
-model_name = "gemini-2.5-flash"
-
-def process_hybrid_query(query: str):
-    # Step 1: Structured SQL (Skip NLP generation to save time)
-    structured_result = process_structured_query(query, generate_nlp=False)
+def process_hybrid_query(query: str, sql_query: str = None, prior_chunks: list = None):
+    # Step 1: Structured SQL (Skip NLP generation to save time); follow-ups
+    # pass the previous turn's patched SQL and retrieved rule chunks
+    structured_result = process_structured_query(query, generate_nlp=False, sql_query=sql_query)
     sql_query = structured_result.get("sql_query")
     
     # Reuse the results already fetched by structured_agent
     rows = structured_result.get("query_result", [])
-    data_context = str(rows) if rows else "No data found"
+    data_context = summarize_rows(
+        rows, truncated=structured_result.get("row_limit_reached", False)
+    )
+
+    # Step 2: Rule passages go straight into the final prompt, packed into
+    # the hybrid budget (no separate RAG answer call)
+    try:
+        rule_chunks = retrieve_rule_chunks(query, prior_chunks=prior_chunks, config=HYBRID_RETRIEVAL)
+    except Exception as e:
+        return {"error": f"Rule retrieval failed: {e}"}
+    gst_rule_context = rule_context(rule_chunks)
 
-    # Step 2: Unstructured RAG
-    unstructured_result = process_unstructured_query(query)
-    gst_rule_context = unstructured_result.get("rag_answer", "No rules found")
+    # Step 3: Deterministic compliance checks over the full invoice tables
+    check_names = checks_for_query(query)
+    compliance_counts = {}
+    compliance_context = "Not applicable to this query."
+    if check_names:
+        with span("compliance_checks", checks=len(check_names)):
+            report = get_compliance_report(check_names)
+        compliance_counts = {name: report["checks"][name]["violations"] for name in check_names}
+        count_lines = "\n".join(
+            f"    - {name}: {report['checks'][name]['violations']} ({report['checks'][name]['description']})"
+            for name in check_names
+        )
+        flagged_total = sum(compliance_counts.values())
+        compliance_context = f"""Violations by check:
+{count_lines}
+    Flagged rows:
+    {summarize_rows(report["flags"], truncated=flagged_total > len(report["flags"]), total_rows=flagged_total)}"""
 
-    # Step 3: Final reasoning
+    # Step 4: Final reasoning
     prompt = f"""
     You are a Hybrid Compliance Auditor.
 
@@ -38,29 +54,33 @@ def process_hybrid_query(query: str):
     Data Result:
     {data_context}
 
-    2. GST Rules (RAG):
+    2. GST Rules (retrieved passages):
     {gst_rule_context}
 
-    Task: Combine data + rules to answer the query.
+    3. Compliance Checks (deterministic, all invoices):
+    {compliance_context}
+
+    Task: Combine data + rules + check results to answer the query.
+    Cite flagged invoice ids from the compliance checks where relevant.
     Output final conclusion.
     """
 
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                "temperature": 0.0,
-                "max_output_tokens": 400
-            }
-        )
-        final_result = response.text.strip()
+        with span("hybrid_synthesis"):
+            response_text = get_provider().generate(
+                prompt,
+                temperature=0.0,
+                max_output_tokens=400
+            )
+        final_result = response_text.strip()
         return {
             "hybrid_analysis": {
                 "sql_used": sql_query,
                 "gst_rule_applied": gst_rule_context,
+                "compliance_checks": compliance_counts,
                 "final_result": final_result
-            }
+            },
+            "rule_chunks": rule_chunks
         }
     except Exception as e:
         return {"error": str(e)}
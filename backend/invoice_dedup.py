@@ -0,0 +1,365 @@
+import os
+import re
+import pickle
+import sqlite3
+import hashlib
+import threading
+import zlib
+
+import numpy as np
+
+from invoice_partitions import open_invoice_reader
+
+# =========================
+# Dedup Settings
+# =========================
+
+INDEX_PATH = os.getenv(
+    "INVOICE_DEDUP_INDEX",
+    os.path.join(os.path.dirname(__file__), "invoice_dedup_index.pkl")
+)
+
+# MinHash signature = NUM_BANDS * ROWS_PER_BAND hash minima
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERMUTATIONS = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_SIZE = 5
+
+# Estimated Jaccard similarity above which an LSH candidate is a duplicate
+NEAR_DUPLICATE_THRESHOLD = 0.85
+
+# Bumped when signatures or the index layout change; older snapshots are
+# rebuilt from the database on load
+INDEX_VERSION = 2
+
+# Uploads are appended to <index>.log; the pickle snapshot is rewritten
+# (and the log truncated) once this many entries have accumulated
+COMPACT_EVERY = 1000
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(20240401)
+# Coefficients span the whole field; small multipliers barely wrap mod p,
+# so every permutation kept the order of the shingle hashes and picked the
+# same minimum. The products wrap mod 2**64 first, which still mixes well.
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+# =========================
+# Fingerprints
+# =========================
+
+def file_sha256(file_bytes: bytes) -> str:
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def _norm(value) -> str:
+    return re.sub(r"[^A-Z0-9]", "", str(value or "").upper())
+
+
+def _amount(value) -> str:
+    try:
+        return str(int(round(float(value))))
+    except (TypeError, ValueError):
+        return "0"
+
+
+def header_key(data: dict) -> str:
+    """
+    Seller GSTIN + date + grand total rounded to the rupee: stable across
+    re-scans even when the extracted invoice id differs.
+    """
+    return "|".join([
+        _norm(data.get("seller_gstin")) or _norm(data.get("seller_name")),
+        str(data.get("invoice_date") or ""),
+        _amount(data.get("grand_total")),
+    ])
+
+
+def item_signature(data: dict) -> str:
+    """
+    Order-independent signature of line items (HSN + rounded amounts).
+    """
+    parts = sorted(
+        f"{_norm(item.get('hsn_code'))}:{_amount(item.get('total_price'))}:{_amount(item.get('tax_amount'))}"
+        for item in data.get("items") or []
+    )
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def fingerprint(data: dict) -> str:
+    return hashlib.sha1(f"{header_key(data)}#{item_signature(data)}".encode()).hexdigest()
+
+
+def invoice_text(data: dict) -> str:
+    """
+    Flatten the extracted fields the way they read on the document.
+    """
+    fields = [
+        data.get("invoice_id"), data.get("invoice_date"),
+        data.get("seller_name"), data.get("seller_gstin"),
+        data.get("buyer_name"), data.get("buyer_gstin"),
+        data.get("grand_total"), data.get("total_tax"),
+    ]
+    for item in data.get("items") or []:
+        fields.extend([
+            item.get("description"), item.get("hsn_code"),
+            item.get("quantity"), item.get("total_price"),
+        ])
+    return " ".join(str(f) for f in fields if f not in (None, "")).lower()
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    text = re.sub(r"\s+", " ", text)
+    if len(text) < SHINGLE_SIZE:
+        text = text.ljust(SHINGLE_SIZE)
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = np.array([zlib.crc32(s.encode()) for s in shingles], dtype=np.uint64)
+    # (a*x + b) mod p for every permutation/shingle pair, minimum per permutation
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return permuted.min(axis=0)
+
+
+def _bands(signature: np.ndarray):
+    for band in range(NUM_BANDS):
+        chunk = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        yield band, chunk.tobytes()
+
+
+# =========================
+# Dedup Index
+# =========================
+
+class InvoiceDedupIndex:
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self._lock = threading.Lock()
+        self._log_entries = 0
+        self.data = self._empty()
+        self._load()
+
+    @staticmethod
+    def _empty():
+        return {
+            "version": INDEX_VERSION,
+            "file_hashes": {},   # sha256 of raw upload -> invoice_id
+            "invoice_ids": set(),
+            "fingerprints": {},  # header + items fingerprint -> invoice_id
+            "header_keys": {},   # header key -> invoice_id
+            "signatures": {},    # invoice_id -> MinHash signature
+            "invoice_dates": {}, # invoice_id -> invoice date, gates near-duplicates
+            "lsh": {},           # (band, bucket bytes) -> set of invoice_ids
+        }
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    self.data = pickle.load(f)
+                if self.data.get("version") != INDEX_VERSION:
+                    self._migrate()
+                    return
+                self._replay_log()
+                print(f"Loaded dedup index from {self.path} with {len(self.data['invoice_ids'])} invoices.")
+                return
+            except Exception as e:
+                print(f"Error loading dedup index: {e}")
+                self.data = self._empty()
+        self.rebuild_from_db()
+
+    def _replay_log(self, apply=None):
+        apply = apply or self._add_locked
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r+b") as f:
+            while True:
+                good_offset = f.tell()
+                try:
+                    invoice_id, data, file_hash = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    # A torn final record from a crash mid-append; cut it off
+                    # so later appends stay readable
+                    print(f"Dropping truncated dedup log tail: {e}")
+                    f.truncate(good_offset)
+                    break
+                apply(invoice_id, data, file_hash)
+                self._log_entries += 1
+
+    def _migrate(self):
+        """
+        Rebuild an index written by an older version from the database,
+        keeping the upload hashes that only the index knows.
+        """
+        file_hashes = dict(self.data.get("file_hashes", {}))
+
+        def keep_file_hash(invoice_id, data, file_hash):
+            if file_hash:
+                file_hashes[file_hash] = invoice_id
+
+        self._replay_log(keep_file_hash)
+        print("Dedup index was written by an older version; rebuilding from the database")
+        self.rebuild_from_db()
+        with self._lock:
+            self.data["file_hashes"].update(file_hashes)
+            self._save()
+
+    def _save(self):
+        """
+        Write a full snapshot and truncate the log. Call with self._lock held
+        (or before the index is shared).
+        """
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self._log_entries = 0
+        except Exception as e:
+            print(f"Error saving dedup index: {e}")
+
+    def _append_log_locked(self, entries: list):
+        try:
+            with open(self.log_path, "ab") as f:
+                for entry in entries:
+                    pickle.dump(entry, f)
+            self._log_entries += len(entries)
+        except Exception as e:
+            print(f"Error appending to dedup log: {e}")
+        if self._log_entries >= COMPACT_EVERY:
+            self._save()
+
+    def rebuild_from_db(self):
+        """
+        Index every stored invoice, archived years included (file hashes are
+        only known for new uploads). Invoices and items are streamed in
+        invoice_id order and merged, so the rebuild is two sequential scans
+        instead of one item query per invoice.
+        """
+        conn = None
+        try:
+            conn = open_invoice_reader()
+            conn.row_factory = sqlite3.Row
+            invoices = iter(conn.execute(
+                "SELECT invoice_id, invoice_date, seller_name, seller_gstin, buyer_name, "
+                "buyer_gstin, grand_total, total_tax FROM invoices ORDER BY invoice_id"
+            ))
+            items = iter(conn.execute(
+                "SELECT invoice_id, description, hsn_code, quantity, total_price, tax_amount "
+                "FROM invoice_items ORDER BY invoice_id"
+            ))
+
+            with self._lock:
+                self.data = self._empty()
+                pending_item = next(items, None)
+                for row in invoices:
+                    data = dict(row)
+                    data["invoice_date"] = str(data["invoice_date"]) if data["invoice_date"] else None
+                    data["items"] = []
+                    while pending_item is not None and pending_item["invoice_id"] <= row["invoice_id"]:
+                        if pending_item["invoice_id"] == row["invoice_id"]:
+                            data["items"].append(dict(pending_item))
+                        pending_item = next(items, None)
+                    self._add_locked(row["invoice_id"], data)
+                self._save()
+            print(f"Built dedup index with {len(self.data['invoice_ids'])} invoices.")
+        except Exception as e:
+            print(f"Dedup index rebuild skipped: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _add_locked(self, invoice_id: str, data: dict, file_hash: str = None):
+        self.data["invoice_ids"].add(invoice_id)
+        if file_hash:
+            self.data["file_hashes"][file_hash] = invoice_id
+        self.data["fingerprints"][fingerprint(data)] = invoice_id
+        self.data["header_keys"].setdefault(header_key(data), invoice_id)
+        signature = minhash_signature(invoice_text(data))
+        self.data["signatures"][invoice_id] = signature
+        self.data["invoice_dates"][invoice_id] = str(data.get("invoice_date") or "")
+        for band_key in _bands(signature):
+            self.data["lsh"].setdefault(band_key, set()).add(invoice_id)
+
+    def add(self, invoice_id: str, data: dict, file_hash: str = None):
+        self.add_many([(invoice_id, data, file_hash)])
+
+    def add_many(self, entries: list):
+        """
+        Index [(invoice_id, data, file_hash)] and persist them with one
+        log append.
+        """
+        with self._lock:
+            for invoice_id, data, file_hash in entries:
+                self._add_locked(invoice_id, data, file_hash)
+            self._append_log_locked(entries)
+
+    def lookup_file(self, file_hash: str):
+        """
+        Invoice id previously stored from byte-identical upload, or None.
+        """
+        with self._lock:
+            return self.data["file_hashes"].get(file_hash)
+
+    def find_duplicate(self, data: dict):
+        """
+        Return {"invoice_id", "reason", "similarity", "soft"} for the most
+        likely stored duplicate of the extracted invoice, or None. soft=True
+        means only seller, date and total agree: recurring invoices (rent,
+        subscriptions) look like that too, so callers warn instead of reject.
+        """
+        signature = minhash_signature(invoice_text(data))
+        with self._lock:
+            invoice_id = data.get("invoice_id")
+            if invoice_id and invoice_id in self.data["invoice_ids"]:
+                return {"invoice_id": invoice_id, "reason": "same invoice_id", "similarity": 1.0, "soft": False}
+
+            match = self.data["fingerprints"].get(fingerprint(data))
+            if match:
+                return {
+                    "invoice_id": match, "reason": "same seller, date, total and line items",
+                    "similarity": 1.0, "soft": False,
+                }
+
+            candidates = set()
+            for band_key in _bands(signature):
+                candidates |= self.data["lsh"].get(band_key, set())
+
+            invoice_date = str(data.get("invoice_date") or "")
+            best = None
+            for candidate in candidates:
+                # Recurring invoices (rent, subscriptions) share almost all of
+                # their text; another date means another invoice, not a re-scan
+                candidate_date = self.data["invoice_dates"].get(candidate)
+                if invoice_date and candidate_date and candidate_date != invoice_date:
+                    continue
+                similarity = float(np.mean(self.data["signatures"][candidate] == signature))
+                if similarity >= NEAR_DUPLICATE_THRESHOLD and (best is None or similarity > best["similarity"]):
+                    best = {
+                        "invoice_id": candidate, "reason": "near-duplicate content",
+                        "similarity": round(similarity, 3), "soft": False,
+                    }
+            if best:
+                return best
+
+            match = self.data["header_keys"].get(header_key(data))
+            if match:
+                return {"invoice_id": match, "reason": "same seller, date and total", "similarity": 0.95, "soft": True}
+        return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_dedup_index() -> InvoiceDedupIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = InvoiceDedupIndex()
+    return _index
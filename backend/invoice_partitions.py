@@ -0,0 +1,519 @@
+import os
+import re
+import json
+import stat
+import sqlite3
+import argparse
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import create_engine
+
+from database import engine, Base, init_db
+
+# =========================
+# Partition Settings
+# =========================
+
+PARTITION_DIR = os.getenv(
+    "INVOICE_PARTITION_DIR",
+    os.path.join(os.path.dirname(__file__), "partitions")
+)
+MANIFEST_PATH = os.path.join(PARTITION_DIR, "manifest.json")
+
+# A financial year (April-March) stays open until ITC claims and amendments
+# for it are time-barred: 30 November of the following year (section 16(4))
+FY_CLOSE_MONTH_DAY = (11, 30)
+
+PARTITIONED_TABLES = ("invoices", "invoice_items")
+
+_manifest_lock = threading.Lock()
+
+
+# =========================
+# Financial Years
+# =========================
+
+def financial_year(d: date) -> str:
+    start = d.year if d.month >= 4 else d.year - 1
+    return f"{start}-{str(start + 1)[-2:]}"
+
+
+def fy_bounds(fy: str) -> tuple:
+    start = int(fy.split("-")[0])
+    return f"{start}-04-01", f"{start + 1}-03-31"
+
+
+def fy_closing_date(fy: str) -> date:
+    start = int(fy.split("-")[0])
+    return date(start + 2, *FY_CLOSE_MONTH_DAY)
+
+
+# =========================
+# Manifest
+# =========================
+
+def load_manifest() -> list:
+    if not os.path.exists(MANIFEST_PATH):
+        return []
+    try:
+        with open(MANIFEST_PATH, "r") as f:
+            return json.load(f)["partitions"]
+    except Exception as e:
+        print(f"Error loading partition manifest: {e}")
+        return []
+
+
+def _save_manifest(partitions: list):
+    os.makedirs(PARTITION_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"partitions": sorted(partitions, key=lambda p: p["date_from"])}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+# =========================
+# Archival
+# =========================
+
+# Financial year start of an ISO invoice_date, evaluated inside SQLite
+_FY_START_SQL = (
+    "CASE WHEN CAST(substr(invoice_date, 6, 2) AS INTEGER) >= 4 "
+    "THEN CAST(substr(invoice_date, 1, 4) AS INTEGER) "
+    "ELSE CAST(substr(invoice_date, 1, 4) AS INTEGER) - 1 END"
+)
+
+
+def _fy_label(start: int) -> str:
+    return f"{start}-{str(start + 1)[-2:]}"
+
+
+def live_financial_years() -> dict:
+    """
+    {fy: live invoice count} for every financial year with live rows.
+    """
+    with sqlite3.connect(engine.url.database) as conn:
+        rows = conn.execute(
+            f"SELECT {_FY_START_SQL} AS fy_start, COUNT(*) FROM invoices "
+            "WHERE invoice_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-*' GROUP BY fy_start"
+        ).fetchall()
+    return {_fy_label(start): count for start, count in rows}
+
+
+def closed_financial_years(today: date = None) -> list[str]:
+    """
+    Financial years that still have rows in the live database, whose
+    closing date has passed and that are not archived yet.
+    """
+    today = today or date.today()
+    archived = {p["fy"] for p in load_manifest() if not p.get("pending")}
+    return sorted(
+        fy for fy in live_financial_years()
+        if fy not in archived and fy_closing_date(fy) <= today
+    )
+
+
+def late_rows_in_archived_years() -> dict:
+    """
+    {fy: live invoice count} for archived years that received invoices
+    after archiving (e.g. a late upload). Partitions are immutable, so
+    these rows stay in the live tables, where every query still sees them.
+    """
+    archived = {p["fy"] for p in load_manifest() if not p.get("pending")}
+    return {fy: n for fy, n in live_financial_years().items() if fy in archived}
+
+
+def _fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _partition_complete(path: str, date_from: str, date_to: str) -> bool:
+    """
+    Whether a partition file left by an interrupted run holds exactly the
+    live rows of its year, so the run can resume from it.
+    """
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.execute("ATTACH DATABASE ? AS live", (f"file:{engine.url.database}?mode=ro",))
+    except sqlite3.Error:
+        return False
+    try:
+        if conn.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            return False
+        selected = "SELECT invoice_id FROM live.invoices WHERE invoice_date BETWEEN ? AND ?"
+        counts = conn.execute(
+            f"""SELECT
+                (SELECT COUNT(*) FROM main.invoices), (SELECT COUNT(*) FROM live.invoices
+                 WHERE invoice_date BETWEEN ? AND ?),
+                (SELECT COUNT(*) FROM main.invoice_items), (SELECT COUNT(*) FROM live.invoice_items
+                 WHERE invoice_id IN ({selected}))""",
+            (date_from, date_to, date_from, date_to),
+        ).fetchone()
+        return counts[0] == counts[1] and counts[2] == counts[3]
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+def _write_partition(path: str, date_from: str, date_to: str) -> tuple:
+    """
+    Copy one year into a new, ANALYZEd, VACUUMed, fsynced and read-only
+    partition file. The live tables are not modified.
+    """
+    # Same schema and indexes as the live tables
+    partition_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=partition_engine)
+    partition_engine.dispose()
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS live", (engine.url.database,))
+        selected = "SELECT invoice_id FROM live.invoices WHERE invoice_date BETWEEN ? AND ?"
+        conn.execute("BEGIN")
+        invoice_count = conn.execute(
+            "INSERT INTO main.invoices SELECT * FROM live.invoices WHERE invoice_date BETWEEN ? AND ?",
+            (date_from, date_to)
+        ).rowcount
+        item_count = conn.execute(
+            f"INSERT INTO main.invoice_items SELECT * FROM live.invoice_items WHERE invoice_id IN ({selected})",
+            (date_from, date_to)
+        ).rowcount
+        conn.commit()
+        conn.execute("DETACH DATABASE live")
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    _fsync_path(path)
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return invoice_count, item_count
+
+
+def _delete_live_rows(date_from: str, date_to: str):
+    conn = sqlite3.connect(engine.url.database)
+    try:
+        selected = "SELECT invoice_id FROM invoices WHERE invoice_date BETWEEN ? AND ?"
+        conn.execute("BEGIN")
+        conn.execute(f"DELETE FROM invoice_items WHERE invoice_id IN ({selected})", (date_from, date_to))
+        conn.execute("DELETE FROM invoices WHERE invoice_date BETWEEN ? AND ?", (date_from, date_to))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def archive_financial_year(fy: str, force: bool = False) -> dict:
+    """
+    Move one financial year out of the live tables into a read-only,
+    VACUUM-compacted partition file and register it in the manifest.
+
+    Crash-safe order: the partition is written and fsynced first, then
+    registered as pending (readers skip its rows that are still live), then
+    the live rows are deleted, then the entry is completed. A rerun resumes
+    a pending entry, and reuses a partition file that is on disk but not
+    yet in the manifest if it is complete (otherwise rebuilds it).
+    """
+    if not force and fy_closing_date(fy) > date.today():
+        raise ValueError(f"FY {fy} is still open until {fy_closing_date(fy)}; use force to archive anyway")
+
+    with _manifest_lock:
+        partitions = load_manifest()
+        entry = next((p for p in partitions if p["fy"] == fy), None)
+        if entry is not None and not entry.get("pending"):
+            raise ValueError(f"FY {fy} is already archived")
+
+        date_from, date_to = fy_bounds(fy)
+        path = os.path.join(PARTITION_DIR, f"invoices_fy{fy.replace('-', '_')}.db")
+
+        if entry is None:
+            os.makedirs(PARTITION_DIR, exist_ok=True)
+            if os.path.exists(path) and _partition_complete(path, date_from, date_to):
+                print(f"[partitions] resuming FY {fy} from {path}")
+                conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                invoice_count, item_count = conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM invoices), (SELECT COUNT(*) FROM invoice_items)"
+                ).fetchone()
+                conn.close()
+            else:
+                if os.path.exists(path):
+                    # Left incomplete by an interrupted run; the live rows are untouched
+                    os.remove(path)
+                try:
+                    invoice_count, item_count = _write_partition(path, date_from, date_to)
+                except Exception:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    raise
+            if not invoice_count:
+                os.remove(path)
+                raise ValueError(f"FY {fy} has no live invoices to archive")
+
+            entry = {
+                "fy": fy,
+                "path": os.path.basename(path),
+                "date_from": date_from,
+                "date_to": date_to,
+                "invoices": invoice_count,
+                "items": item_count,
+                "size_bytes": os.path.getsize(path),
+                "archived_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+                "pending": True,
+            }
+            partitions.append(entry)
+            _save_manifest(partitions)
+        else:
+            print(f"[partitions] resuming FY {fy}: removing rows still in the live tables")
+
+        _delete_live_rows(date_from, date_to)
+        entry.pop("pending", None)
+        _save_manifest(partitions)
+
+    print(f"Archived FY {fy}: {entry['invoices']} invoices, {entry['items']} items -> {path}")
+    return entry
+
+
+def archive_closed_periods(today: date = None, vacuum_live: bool = False) -> list:
+    # Interrupted runs first, then newly closed years
+    years = [p["fy"] for p in load_manifest() if p.get("pending")]
+    years += [fy for fy in closed_financial_years(today) if fy not in years]
+    archived = [archive_financial_year(fy) for fy in years]
+    for fy, count in late_rows_in_archived_years().items():
+        print(f"[partitions] FY {fy} is archived but has {count} late invoices in the live tables")
+    if archived and vacuum_live:
+        conn = sqlite3.connect(engine.url.database)
+        conn.execute("VACUUM")
+        conn.close()
+    return archived
+
+
+# =========================
+# Query Routing
+# =========================
+
+_DATE_COL = r"(?:\b\w+\.)?\binvoice_date\b"
+_DATE_VALUE = r"('[^']*'|date\s*\(\s*'now'[^)]*\))"
+_RANGE_PREDICATE_RE = re.compile(rf"{_DATE_COL}\s*(>=|<=|=|>|<)\s*{_DATE_VALUE}", re.IGNORECASE)
+_REVERSED_PREDICATE_RE = re.compile(rf"{_DATE_VALUE}\s*(>=|<=|=|>|<)\s*{_DATE_COL}", re.IGNORECASE)
+_BETWEEN_RE = re.compile(rf"{_DATE_COL}\s+BETWEEN\s+{_DATE_VALUE}\s+AND\s+{_DATE_VALUE}", re.IGNORECASE)
+_STRFTIME_RE = re.compile(rf"strftime\s*\(\s*'(%Y-%m|%Y)'\s*,\s*{_DATE_COL}\s*\)\s*=\s*'(\d{{4}}(?:-\d{{2}})?)'", re.IGNORECASE)
+_LIKE_RE = re.compile(rf"{_DATE_COL}\s+LIKE\s+'(\d{{4}}(?:-\d{{2}})?)(?:-\d{{2}})?-?%?'", re.IGNORECASE)
+
+_FLIPPED = {">=": "<=", "<=": ">=", ">": "<", "<": ">", "=": "="}
+
+
+def _date_value(token: str):
+    if token.startswith("'"):
+        value = token.strip("'")[:10]
+    else:
+        # date('now', 'start of month', ...) evaluated the same way SQLite will
+        value = sqlite3.connect(":memory:").execute(f"SELECT {token}").fetchone()[0]
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return value
+    except (TypeError, ValueError):
+        return None
+
+
+def _period_bounds(period: str) -> tuple:
+    if len(period) == 4:
+        return f"{period}-01-01", f"{period}-12-31"
+    return f"{period}-01", f"{period}-31"
+
+
+def _binds_to_invoices(column: str, invoice_names: set) -> bool:
+    # invoice_items has no invoice_date, so an unqualified column in a flat
+    # query that reads invoices can only mean invoices.invoice_date
+    qualifier = column.rsplit(".", 1)[0].strip().lower() if "." in column else None
+    return qualifier is None or qualifier in invoice_names
+
+
+def date_range_from_sql(sql: str):
+    """
+    Conservative [lower, upper] invoice_date range a query can touch, from
+    the literal date predicates in its WHERE clause. None means "cannot
+    tell": no predicates, OR/NOT/CASE logic, subqueries, CTEs or compound
+    selects (a predicate may then bind to a derived column rather than the
+    base table), a partitioned table read more than once, a predicate
+    outside the top-level WHERE, or bounds that do not combine.
+    """
+    from sql_guard import TABLE_REF_RE, NOT_AN_ALIAS
+
+    # Blank literals and comments in place so offsets still line up with sql
+    blank = lambda m: m.group(0)[0] + " " * (len(m.group(0)) - 2) + m.group(0)[-1]
+    tokens_only = re.sub(r"--[^\n]*|/\*.*?\*/", lambda m: " " * len(m.group(0)), sql, flags=re.DOTALL)
+    tokens_only = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", blank, tokens_only).upper()
+    if re.search(r"\b(OR|NOT|CASE|WITH|UNION|INTERSECT|EXCEPT)\b|\(\s*SELECT\b", tokens_only):
+        return None
+    references = TABLE_REF_RE.findall(tokens_only)
+    referenced = [t.split(".")[-1].lower() for t, _ in references]
+    if any(referenced.count(table) > 1 for table in PARTITIONED_TABLES):
+        return None
+    if "invoices" not in referenced:
+        return None
+    invoice_names = {"invoices"} | {
+        alias.lower() for t, alias in references
+        if t.split(".")[-1].lower() == "invoices" and alias and alias not in NOT_AN_ALIAS
+    }
+
+    where = re.search(r"\bWHERE\b", tokens_only)
+    if where is None:
+        return None
+    # Predicates after GROUP BY (HAVING) see aggregates, not base rows
+    where_end = re.search(r"\b(GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|WINDOW)\b", tokens_only[where.end():])
+    where_end = where.end() + where_end.start() if where_end else len(sql)
+
+    def in_where(match, column):
+        inside = where.start() < match.start() and match.end() <= where_end
+        return inside and _binds_to_invoices(column, invoice_names)
+
+    lowers, uppers = [], []
+    for column_first, pattern in ((True, _RANGE_PREDICATE_RE), (False, _REVERSED_PREDICATE_RE)):
+        for match in pattern.finditer(sql):
+            column = re.search(_DATE_COL, match.group(0), re.IGNORECASE).group(0)
+            if not in_where(match, column):
+                return None
+            op, token = match.groups() if column_first else (_FLIPPED[match.group(2)], match.group(1))
+            value = _date_value(token)
+            if value is None:
+                return None
+            if op in (">=", ">", "="):
+                lowers.append(value)
+            if op in ("<=", "<", "="):
+                uppers.append(value)
+    for match in _BETWEEN_RE.finditer(sql):
+        if not in_where(match, re.search(_DATE_COL, match.group(0), re.IGNORECASE).group(0)):
+            return None
+        low, high = _date_value(match.group(1)), _date_value(match.group(2))
+        if low is None or high is None:
+            return None
+        lowers.append(low)
+        uppers.append(high)
+    for match in list(_STRFTIME_RE.finditer(sql)) + list(_LIKE_RE.finditer(sql)):
+        if not in_where(match, re.search(_DATE_COL, match.group(0), re.IGNORECASE).group(0)):
+            return None
+        low, high = _period_bounds(match.groups()[-1])
+        lowers.append(low)
+        uppers.append(high)
+
+    if not lowers and not uppers:
+        return None
+    # One flat WHERE of ANDed predicates: every bound applies
+    lower = max(lowers) if lowers else None
+    upper = min(uppers) if uppers else None
+    if lower and upper and lower > upper:
+        return None
+    return lower, upper
+
+
+def partitions_for_range(date_range, partitions: list = None) -> list:
+    partitions = load_manifest() if partitions is None else partitions
+    if date_range is None:
+        return partitions
+    lower, upper = date_range
+    return [
+        p for p in partitions
+        if (upper is None or p["date_from"] <= upper) and (lower is None or p["date_to"] >= lower)
+    ]
+
+
+def attach_partitions(conn, sql: str = None) -> dict:
+    """
+    Attach the archived partitions the query can touch (all of them when
+    sql is None) and shadow the live tables with TEMP views over
+    main + partitions (UNION ALL).
+    Returns {"p<i>.<table>": row count} for the attached partitions.
+    """
+    partitions = partitions_for_range(date_range_from_sql(sql) if sql else None)
+    partition_rows = {}
+    if not partitions:
+        return partition_rows
+
+    for i, partition in enumerate(partitions):
+        path = os.path.join(PARTITION_DIR, partition["path"])
+        conn.execute(f"ATTACH DATABASE 'file:{path}?mode=ro&immutable=1' AS p{i}")
+        partition_rows[f"p{i}.invoices"] = partition["invoices"]
+        partition_rows[f"p{i}.invoice_items"] = partition["items"]
+
+    for table in PARTITIONED_TABLES:
+        members = [f"SELECT * FROM main.{table}"]
+        for i, partition in enumerate(partitions):
+            member = f"SELECT * FROM p{i}.{table}"
+            if partition.get("pending"):
+                # Archiving in progress: rows not yet deleted from live count once
+                member += " WHERE invoice_id NOT IN (SELECT invoice_id FROM main.invoices)"
+            members.append(member)
+        conn.execute(f"CREATE TEMP VIEW {table} AS " + " UNION ALL ".join(members))
+    print(f"[partitions] attached {', '.join(p['fy'] for p in partitions)}")
+    return partition_rows
+
+
+# =========================
+# Partition-aware Readers
+# =========================
+
+def open_invoice_reader():
+    """
+    Read-only connection where invoices/invoice_items cover the live
+    tables and every archived year. Readers that must see the full
+    history (books, dedup, re-materialization) go through this.
+    """
+    conn = sqlite3.connect(f"file:{engine.url.database}?mode=ro", uri=True, check_same_thread=False)
+    attach_partitions(conn)
+    return conn
+
+
+def archived_invoice_ids(invoice_ids) -> set:
+    """
+    The subset of invoice_ids already stored in an archived partition.
+    Archived rows are outside the live primary key, so writers check here.
+    """
+    invoice_ids = [i for i in invoice_ids if i]
+    found = set()
+    if not invoice_ids:
+        return found
+    for partition in load_manifest():
+        path = os.path.join(PARTITION_DIR, partition["path"])
+        conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+        try:
+            for start in range(0, len(invoice_ids), 500):
+                batch = invoice_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(r[0] for r in conn.execute(
+                    f"SELECT invoice_id FROM invoices WHERE invoice_id IN ({placeholders})", batch
+                ))
+        finally:
+            conn.close()
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Financial-year partitions of the invoice tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    archive_cmd = sub.add_parser("archive", help="Archive closed financial years")
+    archive_cmd.add_argument("--fy", help="Archive one financial year, e.g. 2022-23")
+    archive_cmd.add_argument("--force", action="store_true", help="Archive even if the year is still open")
+    archive_cmd.add_argument("--vacuum", action="store_true", help="VACUUM the live database afterwards")
+
+    sub.add_parser("list", help="Show archived partitions")
+
+    args = parser.parse_args()
+    init_db()
+    if args.command == "archive":
+        if args.fy:
+            print(archive_financial_year(args.fy, force=args.force))
+        else:
+            print(archive_closed_periods(vacuum_live=args.vacuum))
+    else:
+        for partition in load_manifest():
+            print(partition)
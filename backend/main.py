@@ -1,28 +1,57 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
+from fastapi.responses import PlainTextResponse, JSONResponse
 from pydantic import BaseModel
+from typing import Optional
 from dotenv import load_dotenv
-import os
+import threading
 
 # Load env vars first
 load_dotenv()
 
 # Agents
 from orchestrator import classify_query
-from structured_agent import process_structured_query, extract_invoice_data, save_invoice_to_db
-from unstructured_agent import process_unstructured_query, ingest_document_text, ingest_document_file
+from structured_agent import (
+    process_structured_query, extract_invoice_data, save_invoice_to_db,
+    refine_sql, format_natural_language_answer, EXTRACTION_VERSION
+)
+from unstructured_agent import process_unstructured_query, ingest_document_text, is_store_loaded
 from hybrid_agent import process_hybrid_query
+from invoice_dedup import get_dedup_index, file_sha256
+from extraction_cache import get_extraction_cache
 from database import init_db
-from gst_watchdog import start_watchdog_background
+from gst_watchdog import start_watchdog_background, scan_state
+from telemetry import start_trace, span, inc, cache_hit, render_prometheus
+from conversation_context import sessions, is_follow_up, wants_same_data, patch_sql_period
 
 app = FastAPI(title="Invoice & GST Compliance System")
 
+# Seconds since main.py started importing; reported by /ready
+startup_timings = {"import_s": round(time.perf_counter() - _import_started, 3)}
+
 @app.on_event("startup")
 def startup_event():
     init_db()
+    startup_timings["startup_s"] = round(time.perf_counter() - _import_started, 3)
+    # Vector store load, folder scan and dedup index are warmed in the
+    # background; structured queries are served immediately
     start_watchdog_background()
+    threading.Thread(target=get_dedup_index, daemon=True).start()
+    print(f"Startup complete in {startup_timings['startup_s']:.2f}s (import {startup_timings['import_s']:.2f}s)")
+
+@app.middleware("http")
+async def record_time_to_first_request(request: Request, call_next):
+    response = await call_next(request)
+    if "first_request_s" not in startup_timings:
+        startup_timings["first_request_s"] = round(time.perf_counter() - _import_started, 3)
+        print(f"Time to first request: {startup_timings['first_request_s']:.2f}s")
+    return response
 
 class QueryRequest(BaseModel):
     query: str
+    session_id: Optional[str] = None
 
 class IngestRequest(BaseModel):
     doc_id: str
@@ -32,6 +61,21 @@ class IngestRequest(BaseModel):
 def read_root():
     return {"status": "System Operational"}
 
+@app.get("/ready")
+def readiness():
+    status = {
+        "ready": is_store_loaded(),
+        "vector_store_loaded": is_store_loaded(),
+        "initial_scan_done": scan_state["initial_scan_done"],
+        "scan": scan_state,
+        "startup": startup_timings
+    }
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.post("/ingest")
 def ingest_doc(request: IngestRequest):
     try:
@@ -41,14 +85,44 @@ def ingest_doc(request: IngestRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload-invoice")
-async def upload_invoice(file: UploadFile = File(...)):
+async def upload_invoice(file: UploadFile = File(...), allow_duplicate: bool = False):
     try:
         content = await file.read()
-        extracted_data = extract_invoice_data(content, file.content_type)
+        dedup_index = get_dedup_index()
+        file_hash = file_sha256(content)
+
+        # Byte-identical re-upload: skip the Gemini extraction entirely
+        seen_invoice_id = dedup_index.lookup_file(file_hash)
+        cache_hit("upload_file_hash", seen_invoice_id is not None)
+        if seen_invoice_id and not allow_duplicate:
+            raise HTTPException(status_code=409, detail={
+                "message": "This file was already uploaded",
+                "duplicate_of": {"invoice_id": seen_invoice_id, "reason": "same file", "similarity": 1.0}
+            })
+
+        # Previously extracted files (e.g. after a failed save) come from the extraction cache
+        extracted_data = extract_invoice_data(content, file.content_type, file_hash)
         if extracted_data:
+            candidate = dedup_index.find_duplicate(extracted_data)
+            if candidate and not candidate["soft"] and not allow_duplicate:
+                # Keep the cached extraction, but never re-materialize it
+                get_extraction_cache().mark_rejected(file_hash, EXTRACTION_VERSION, candidate)
+                raise HTTPException(status_code=409, detail={
+                    "message": "Possible duplicate invoice",
+                    "duplicate_of": candidate,
+                    "data": extracted_data
+                })
+
             success = save_invoice_to_db(extracted_data)
             if success:
-                return {"status": "success", "data": extracted_data}
+                dedup_index.add(extracted_data.get("invoice_id"), extracted_data, file_hash)
+                if allow_duplicate:
+                    get_extraction_cache().mark_rejected(file_hash, EXTRACTION_VERSION, None)
+                response = {"status": "success", "data": extracted_data}
+                if candidate:
+                    # Same seller, date and total only: saved, but worth a look
+                    response["warning"] = {"message": "Looks like a stored invoice", "similar_to": candidate}
+                return response
             else:
                 raise HTTPException(status_code=500, detail="Failed to save to database")
         else:
@@ -62,33 +136,101 @@ async def upload_invoice(file: UploadFile = File(...)):
 
 
 
+def _follow_up_sql(state, query: str):
+    """
+    SQL for a follow-up: the previous SQL with its date predicates moved,
+    or a model edit of the previous SQL when patching is not possible.
+    """
+    patched = patch_sql_period(state.sql_query, query)
+    cache_hit("followup_sql_patch", patched is not None)
+    if patched:
+        return patched
+    refined = refine_sql(state.last_query, state.sql_query, query)
+    return refined.get("sql_query")
+
+
 @app.post("/query")
 def process_query(request: QueryRequest):
     query = request.query
+    trace = start_trace()
+    session = sessions.get_or_create(request.session_id)
+    # Read from a snapshot; concurrent turns of this session update it under its lock
+    state = session.snapshot()
+    follow_up = is_follow_up(query, state)
     
-    # 1. Orchestrator
-    query_type = classify_query(query)
-    
-    response = {
-        "query_type": query_type,
-        "reasoning": "Classified by AI Orchestrator",
-        "sql_query": None,
-        "rag_answer": None,
-        "hybrid_analysis": None
-    }
-    
-    # 2. Routing
-    if query_type == "STRUCTURED_QUERY":
-        result = process_structured_query(query)
-        response.update(result)
-        
-    elif query_type == "UNSTRUCTURED_QUERY":
-        result = process_unstructured_query(query)
-        response.update(result)
+    with span("query_total") as total_attrs:
+        # 1. Orchestrator (follow-ups keep the previous turn's classification)
+        if follow_up:
+            query_type = state.query_type
+            reasoning = "Follow-up: reused previous classification"
+        else:
+            query_type = classify_query(query)
+            reasoning = "Classified by AI Orchestrator"
+        total_attrs["query_type"] = query_type
+        total_attrs["follow_up"] = follow_up
         
-    else: # HYBRID_QUERY
-        result = process_hybrid_query(query)
-        response.update(result)
+        response = {
+            "query_type": query_type,
+            "reasoning": reasoning,
+            "sql_query": None,
+            "rag_answer": None,
+            "hybrid_analysis": None
+        }
         
-    return response
+        # 2. Routing
+        if query_type == "STRUCTURED_QUERY":
+            if follow_up and state.query_result is not None and wants_same_data(query):
+                # Explain the result set we already have: no SQL round trip
+                with span("answer_synthesis"):
+                    answer = format_natural_language_answer(
+                        query, state.sql_query, state.query_result, truncated=state.row_limit_reached
+                    )
+                result = {
+                    "sql_query": state.sql_query,
+                    "query_result": state.query_result,
+                    "row_limit_reached": state.row_limit_reached,
+                    "structured_answer": answer
+                }
+            else:
+                sql_query = _follow_up_sql(state, query) if follow_up and state.sql_query else None
+                result = process_structured_query(query, sql_query=sql_query)
+            response.update(result)
+            
+        elif query_type == "UNSTRUCTURED_QUERY":
+            result = process_unstructured_query(
+                query, prior_chunks=state.rule_chunks if follow_up else None
+            )
+            response.update(result)
+            
+        else: # HYBRID_QUERY
+            sql_query = _follow_up_sql(state, query) if follow_up and state.sql_query else None
+            result = process_hybrid_query(
+                query, sql_query=sql_query, prior_chunks=state.rule_chunks if follow_up else None
+            )
+            response.update(result)
+
+    # 3. Remember this turn's artifacts for follow-ups
+    rule_chunks = response.pop("rule_chunks", None)
+    if "error" not in response:
+        changes = {"query_type": query_type, "last_query": query}
+        # Only SQL that executed is worth patching next turn
+        if isinstance(response.get("query_result"), list):
+            changes["sql_query"] = response.get("sql_query")
+            changes["query_result"] = response["query_result"]
+            changes["row_limit_reached"] = response.get("row_limit_reached", False)
+        elif query_type == "HYBRID_QUERY" and response.get("hybrid_analysis"):
+            changes["sql_query"] = response["hybrid_analysis"].get("sql_used") or state.sql_query
+        if rule_chunks is not None:
+            changes["rule_chunks"] = rule_chunks
+        session.record_turn(**changes)
 
+    inc("gst_requests_total", {
+        "endpoint": "/query",
+        "query_type": query_type,
+        "outcome": "error" if "error" in response else "ok"
+    })
+    response["session_id"] = session.session_id
+    response["follow_up"] = follow_up
+    response["trace_id"] = trace.trace_id
+    response["timings"] = trace.summary()
+    return response
@@ -0,0 +1,430 @@
+import os
+import re
+import json
+import time
+import zlib
+import random
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from telemetry import record_model_call
+from result_formatter import estimate_tokens
+from rate_limiter import TokenBucket, SingleFlight, call_with_retry
+
+# =========================
+# Provider Settings
+# =========================
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_DIM = 768
+
+# Default Gemini request budgets (requests per minute); 0 disables the limit
+GEMINI_GENERATE_RPM = float(os.getenv("GEMINI_GENERATE_RPM", "1000"))
+GEMINI_EMBED_RPM = float(os.getenv("GEMINI_EMBED_RPM", "1500"))
+
+
+@dataclass
+class Attachment:
+    """Raw file passed alongside a prompt (PDF, image, ...)."""
+    data: bytes
+    mime_type: str
+
+
+class ModelProviderError(RuntimeError):
+    """Raised by providers when a model call fails; code is the HTTP status if any."""
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(c for c in contents if isinstance(c, str))
+
+
+def _call_key(kind: str, contents, *options) -> str:
+    """
+    Identity of a model call for single-flight coalescing.
+    """
+    h = hashlib.sha256(kind.encode())
+    items = [contents] if isinstance(contents, str) else list(contents)
+    for item in items:
+        if isinstance(item, Attachment):
+            h.update(item.mime_type.encode())
+            h.update(item.data)
+        else:
+            h.update(str(item).encode())
+        h.update(b"\x00")
+    h.update(repr(options).encode())
+    return h.hexdigest()
+
+
+def build_limiters(generate_rpm: float, embed_rpm: float) -> dict:
+    limiters = {}
+    if generate_rpm:
+        limiters["generate"] = TokenBucket("generate", generate_rpm)
+    if embed_rpm:
+        limiters["embed"] = TokenBucket("embed", embed_rpm)
+    return limiters
+
+
+class ModelProvider:
+    """
+    Interface shared by every agent: text generation (blocking or
+    streamed) and embeddings. `contents` is a prompt string or a list
+    of strings and Attachments.
+
+    Subclasses implement _generate/_stream/_embed; the public methods
+    add timing and token metrics, per-kind rate limits (self.limiters),
+    retries on transient errors and single-flight coalescing of
+    identical concurrent calls.
+    """
+    name = "base"
+    limiters = {}
+    _generate_flight = SingleFlight("generate")
+    _embed_flight = SingleFlight("embed")
+
+    def _generate(self, contents, temperature, max_output_tokens):
+        """Return (text, (prompt_tokens, response_tokens) or None)."""
+        raise NotImplementedError
+
+    def _stream(self, contents, temperature, max_output_tokens):
+        text, _usage = self._generate(contents, temperature, max_output_tokens)
+        yield text
+
+    def _embed(self, texts, task_type):
+        raise NotImplementedError
+
+    def generate(self, contents, temperature: float = None, max_output_tokens: int = None) -> str:
+        key = _call_key("generate", contents, temperature, max_output_tokens)
+        return self._generate_flight.do(key, lambda: call_with_retry(
+            lambda: self._timed_generate(contents, temperature, max_output_tokens),
+            self.limiters.get("generate"), "generate"
+        ))
+
+    def _timed_generate(self, contents, temperature, max_output_tokens) -> str:
+        started = time.perf_counter()
+        try:
+            text, usage = self._generate(contents, temperature, max_output_tokens)
+        except Exception:
+            record_model_call("generate", time.perf_counter() - started, ok=False)
+            raise
+        prompt_tokens, response_tokens = usage or (
+            estimate_tokens(_prompt_text(contents)), estimate_tokens(text)
+        )
+        record_model_call(
+            "generate", time.perf_counter() - started, ok=True,
+            prompt_tokens=prompt_tokens, response_tokens=response_tokens
+        )
+        return text
+
+    def stream(self, contents, temperature: float = None, max_output_tokens: int = None):
+        # Streams are not retried or coalesced: chunks may already be consumed
+        bucket = self.limiters.get("generate")
+        if bucket is not None:
+            bucket.acquire()
+        started = time.perf_counter()
+        pieces = []
+        try:
+            for piece in self._stream(contents, temperature, max_output_tokens):
+                pieces.append(piece)
+                yield piece
+        except Exception:
+            record_model_call("stream", time.perf_counter() - started, ok=False)
+            raise
+        record_model_call(
+            "stream", time.perf_counter() - started, ok=True,
+            prompt_tokens=estimate_tokens(_prompt_text(contents)),
+            response_tokens=estimate_tokens("".join(pieces))
+        )
+
+    def embed(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+        key = _call_key("embed", texts, task_type)
+        return self._embed_flight.do(key, lambda: call_with_retry(
+            lambda: self._timed_embed(texts, task_type),
+            self.limiters.get("embed"), "embed"
+        ))
+
+    def _timed_embed(self, texts, task_type) -> list[list[float]]:
+        started = time.perf_counter()
+        try:
+            vectors = self._embed(texts, task_type)
+        except Exception:
+            record_model_call("embed", time.perf_counter() - started, ok=False)
+            raise
+        record_model_call(
+            "embed", time.perf_counter() - started, ok=True,
+            prompt_tokens=sum(estimate_tokens(t) for t in texts)
+        )
+        return vectors
+
+
+# =========================
+# Gemini
+# =========================
+
+class GeminiProvider(ModelProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str = None, model_name: str = None, embedding_model: str = None):
+        from google import genai
+        from google.genai import types
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is not set in your environment!")
+
+        self._types = types
+        self.client = genai.Client(api_key=api_key)
+        self.limiters = build_limiters(GEMINI_GENERATE_RPM, GEMINI_EMBED_RPM)
+        self.model_name = model_name or os.getenv("GEMINI_MODEL", DEFAULT_MODEL)
+        self.embedding_model = embedding_model or os.getenv("GEMINI_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+
+    def _contents(self, contents):
+        if isinstance(contents, str):
+            return contents
+        return [
+            self._types.Part.from_bytes(data=c.data, mime_type=c.mime_type)
+            if isinstance(c, Attachment) else c
+            for c in contents
+        ]
+
+    @staticmethod
+    def _config(temperature, max_output_tokens):
+        config = {}
+        if temperature is not None:
+            config["temperature"] = temperature
+        if max_output_tokens is not None:
+            config["max_output_tokens"] = max_output_tokens
+        return config or None
+
+    def _generate(self, contents, temperature, max_output_tokens):
+        response = self.client.models.generate_content(
+            model=self.model_name,
+            contents=self._contents(contents),
+            config=self._config(temperature, max_output_tokens)
+        )
+        usage = None
+        meta = getattr(response, "usage_metadata", None)
+        if meta is not None and meta.prompt_token_count is not None:
+            usage = (meta.prompt_token_count, meta.candidates_token_count or 0)
+        return response.text or "", usage
+
+    def _stream(self, contents, temperature, max_output_tokens):
+        for chunk in self.client.models.generate_content_stream(
+            model=self.model_name,
+            contents=self._contents(contents),
+            config=self._config(temperature, max_output_tokens)
+        ):
+            if chunk.text:
+                yield chunk.text
+
+    def _embed(self, texts, task_type):
+        response = self.client.models.embed_content(
+            model=self.embedding_model,
+            contents=texts,
+            config=self._types.EmbedContentConfig(task_type=task_type)
+        )
+        return [e.values for e in response.embeddings]
+
+
+# =========================
+# Local Fake (benchmarks / offline)
+# =========================
+
+def _digest(*parts) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode())
+    return h.hexdigest()
+
+
+class FakeProvider(ModelProvider):
+    """
+    Deterministic stand-in: the same contents always produce the same
+    text/embedding. Latency and failure rate are configurable so load
+    tests can model a real endpoint. Known prompts from the agents get
+    well-formed answers (category, SQL, invoice JSON, document text).
+    """
+    name = "fake"
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0, embedding_dim: int = EMBEDDING_DIM,
+                 generate_rpm: float = 0, embed_rpm: float = 0):
+        self.limiters = build_limiters(generate_rpm, embed_rpm)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.embedding_dim = embedding_dim
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _simulate_call(self):
+        with self._rng_lock:
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            fail = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if fail:
+            raise ModelProviderError("429 RESOURCE_EXHAUSTED (simulated by FakeProvider)", code=429)
+
+    @staticmethod
+    def _split(contents):
+        if isinstance(contents, str):
+            return contents, []
+        text = "\n".join(c for c in contents if isinstance(c, str))
+        attachments = [c for c in contents if isinstance(c, Attachment)]
+        return text, attachments
+
+    @staticmethod
+    def _classify(prompt: str) -> str:
+        match = re.search(r'User Query: "(.*)"', prompt)
+        query = (match.group(1) if match else prompt).lower()
+        wants_rules = any(w in query for w in ("rule", "gst", "compliance", "rate", "section", "notice"))
+        wants_data = any(w in query for w in ("invoice", "total", "list", "how many", "sum", "seller", "buyer"))
+        if wants_rules and wants_data:
+            return "HYBRID_QUERY"
+        if wants_rules:
+            return "UNSTRUCTURED_QUERY"
+        if wants_data:
+            return "STRUCTURED_QUERY"
+        return "HYBRID_QUERY"
+
+    @staticmethod
+    def _invoice_json(seed: str) -> str:
+        n = int(seed[:8], 16)
+        quantity = 1 + n % 9
+        unit_price = float(100 + n % 900)
+        sub_total = round(quantity * unit_price, 2)
+        tax = round(sub_total * 0.18, 2)
+        return json.dumps({
+            "invoice_id": f"FAKE-{seed[:10].upper()}",
+            "invoice_date": f"2024-{1 + n % 12:02d}-{1 + n % 28:02d}",
+            "seller_name": "Fake Supplies Pvt Ltd",
+            "seller_state": "Maharashtra",
+            "seller_gstin": "27AAAAA0000A1Z5",
+            "buyer_name": "Fake Buyer",
+            "buyer_state": "Maharashtra",
+            "buyer_gstin": "27BBBBB0000B1Z5",
+            "items": [{
+                "description": "Fake item",
+                "quantity": quantity,
+                "unit_price": unit_price,
+                "total_price": sub_total,
+                "hsn_code": "2523",
+                "item_category": "Goods",
+                "cgst_rate": 9,
+                "sgst_rate": 9,
+                "igst_rate": 0,
+                "tax_amount": tax,
+            }],
+            "sub_total": sub_total,
+            "cgst_total": round(tax / 2, 2),
+            "sgst_total": round(tax / 2, 2),
+            "igst_total": 0,
+            "total_tax": tax,
+            "grand_total": round(sub_total + tax, 2),
+        })
+
+    def _respond(self, prompt: str, attachments: list) -> str:
+        seed = _digest(prompt, *[a.data for a in attachments])
+        if "query router" in prompt:
+            return self._classify(prompt)
+        if "valid SQLite SQL query" in prompt:
+            return (
+                "SELECT invoice_id, invoice_date, seller_name, grand_total "
+                "FROM invoices ORDER BY invoice_date DESC LIMIT 20"
+            )
+        if "Extract invoice information" in prompt:
+            return self._invoice_json(_digest(*[a.data for a in attachments]) if attachments else seed)
+        if "Extract all text" in prompt:
+            for a in attachments:
+                try:
+                    return a.data.decode("utf-8")
+                except UnicodeDecodeError:
+                    pass
+            return f"Extracted document text {seed[:16]}."
+        return f"Answer {seed[:12]}: {' '.join(prompt.split()[:40])}"
+
+    def _generate(self, contents, temperature, max_output_tokens):
+        self._simulate_call()
+        text = self._respond(*self._split(contents))
+        if max_output_tokens:
+            # Roughly 4 characters per token
+            text = text[:max_output_tokens * 4]
+        return text, None
+
+    def _stream(self, contents, temperature, max_output_tokens):
+        text, _usage = self._generate(contents, temperature, max_output_tokens)
+        for word in re.findall(r"\S+\s*", text):
+            yield word
+
+    def _embed_one(self, text: str) -> list[float]:
+        # Hashed bag of words: similar texts share dimensions, so retrieval
+        # over fake embeddings still behaves sensibly
+        vector = np.zeros(self.embedding_dim)
+        for token in re.findall(r"[a-z0-9]+", text.lower()):
+            h = zlib.crc32(token.encode())
+            vector[h % self.embedding_dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def _embed(self, texts, task_type):
+        self._simulate_call()
+        return [self._embed_one(t) for t in texts]
+
+
+# =========================
+# Shared Provider
+# =========================
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def create_provider(kind: str = None) -> ModelProvider:
+    """
+    Build the provider named by `kind` or the MODEL_PROVIDER env var
+    ("gemini" by default, "fake" for offline runs).
+    """
+    kind = (kind or os.getenv("MODEL_PROVIDER", "gemini")).lower()
+    if kind == "fake":
+        return FakeProvider(
+            latency_ms=float(os.getenv("FAKE_MODEL_LATENCY_MS", "0")),
+            jitter_ms=float(os.getenv("FAKE_MODEL_JITTER_MS", "0")),
+            error_rate=float(os.getenv("FAKE_MODEL_ERROR_RATE", "0")),
+            seed=int(os.getenv("FAKE_MODEL_SEED", "0")),
+            generate_rpm=float(os.getenv("FAKE_MODEL_GENERATE_RPM", "0")),
+            embed_rpm=float(os.getenv("FAKE_MODEL_EMBED_RPM", "0")),
+        )
+    if kind == "gemini":
+        return GeminiProvider()
+    raise ValueError(f"Unknown MODEL_PROVIDER: {kind}")
+
+
+def get_provider() -> ModelProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _provider = create_provider()
+                print(f"Model provider: {_provider.name}")
+    return _provider
+
+
+def set_provider(provider: ModelProvider):
+    """Swap the shared provider (benchmarks, offline runs)."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
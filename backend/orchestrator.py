@@ -1,15 +1,6 @@
-import os
-from dotenv import load_dotenv
-load_dotenv()
-from google import genai
-
-# Initialize Gemini client
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY is not set in your environment!")
-
-client = genai.Client(api_key=api_key)
-model_name = "gemini-2.5-flash"
+import re
+from model_provider import get_provider
+from telemetry import span
 
 def classify_query(query: str) -> str:
     """
@@ -30,19 +21,18 @@ def classify_query(query: str) -> str:
     """
 
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                "temperature": 0.0,
-                "max_output_tokens": 100
-            }
-        )
-        classification = response.text.strip().upper()
+        with span("classification"):
+            response_text = get_provider().generate(
+                prompt,
+                temperature=0.0,
+                max_output_tokens=100
+            )
+        classification = response_text.strip().upper()
 
         valid_classes = ["STRUCTURED_QUERY", "UNSTRUCTURED_QUERY", "HYBRID_QUERY"]
         for c in valid_classes:
-            if c in classification:
+            # Word boundary so "UNSTRUCTURED_QUERY" does not match "STRUCTURED_QUERY"
+            if re.search(rf"\b{c}\b", classification):
                 return c
         return "HYBRID_QUERY"
     except Exception as e:
@@ -0,0 +1,178 @@
+import time
+import random
+import threading
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from telemetry import inc, observe, cache_hit
+
+# =========================
+# Retry Settings
+# =========================
+
+MAX_ATTEMPTS = 5
+BASE_DELAY_SECONDS = 0.5
+MAX_DELAY_SECONDS = 20.0
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# google.genai APIError.status values worth retrying
+TRANSIENT_STATUSES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED"}
+RATE_LIMIT_STATUS = "RESOURCE_EXHAUSTED"
+
+# Network failures that never reached the provider's status handling
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError)
+if httpx is not None:
+    TRANSIENT_ERRORS += (httpx.TimeoutException, httpx.NetworkError)
+
+
+# =========================
+# Adaptive Token Bucket
+# =========================
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens/second up to `capacity`.
+    The rate adapts AIMD-style: halved on every 429 (down to min_rate)
+    and nudged back towards max_rate on each success.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst_seconds: float = 5.0):
+        self.name = name
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.max_rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    break
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            observe("gst_rate_limit_wait_seconds", waited, {"bucket": self.name})
+
+    def penalize(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drain the burst so the reduced rate takes effect immediately
+            self.tokens = min(self.tokens, 0.0)
+        print(f"[rate_limiter] {self.name}: throttled, rate now {self.rate * 60:.0f}/min")
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+# =========================
+# Retry with Jitter
+# =========================
+
+def _status_code(error: Exception):
+    # google.genai APIError and ModelProviderError carry .code, HTTP clients .status_code
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    return (_status_code(error) in TRANSIENT_STATUS_CODES
+            or getattr(error, "status", None) in TRANSIENT_STATUSES)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return _status_code(error) == 429 or getattr(error, "status", None) == RATE_LIMIT_STATUS
+
+
+def call_with_retry(fn, bucket: TokenBucket = None, kind: str = "generate",
+                    max_attempts: int = MAX_ATTEMPTS):
+    """
+    Call fn() under the bucket's rate budget, retrying transient errors
+    with full-jitter exponential backoff. Non-transient errors and the
+    last failed attempt are re-raised.
+    """
+    for attempt in range(max_attempts):
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            if bucket is not None and is_rate_limited(e):
+                bucket.penalize()
+            if attempt == max_attempts - 1 or not is_transient(e):
+                raise
+            delay = random.uniform(0, min(MAX_DELAY_SECONDS, BASE_DELAY_SECONDS * (2 ** attempt)))
+            inc("gst_model_retries_total", {"kind": kind})
+            print(f"[rate_limiter] {kind} attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        if bucket is not None:
+            bucket.reward()
+        return result
+
+
+# =========================
+# Single-Flight Coalescing
+# =========================
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent callers with the same key share one in-flight call:
+    the first runs fn(), the rest wait for and reuse its outcome.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        cache_hit(f"singleflight_{self.name}", not leader)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
@@ -0,0 +1,159 @@
+from datetime import date, datetime
+
+# =========================
+# Prompt Budget Settings
+# =========================
+
+# Rows rendered verbatim before the summarizer switches to sampling
+MAX_PROMPT_ROWS = 40
+
+# Columns with at most this many distinct values get value counts
+MAX_CATEGORY_VALUES = 5
+
+# Rough chars-per-token ratio for Gemini style tokenizers on English/SQL text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for prompt budgeting and savings reports.
+    """
+    if not text:
+        return 0
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+# =========================
+# Value Rendering
+# =========================
+
+def _type_name(values) -> str:
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return "bool"
+        if isinstance(v, int):
+            return "int"
+        if isinstance(v, float):
+            return "float"
+        if isinstance(v, (date, datetime)):
+            return "date"
+        return "str"
+    return "null"
+
+
+def _render(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+def _sample_indices(total: int, limit: int) -> list[int]:
+    """
+    First half of the budget from the head (keeps ORDER BY / top-N intact),
+    the rest spread evenly over the remainder.
+    """
+    head = limit // 2
+    rest = limit - head
+    if rest <= 0 or total <= head:
+        return list(range(min(total, limit)))
+    step = (total - head) / rest
+    return list(range(head)) + [head + int(i * step) for i in range(rest)]
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _column_stats(name: str, kind: str, values) -> str:
+    present = [v for v in values if v is not None]
+    if not present:
+        return f"{name}: all null"
+    # The kind comes from the first value; SQLite columns can still hold
+    # numeric text or other types further down. Columns that are mostly
+    # not numbers get value counts instead.
+    numbers = [v for v in present if _is_number(v)] if kind in ("int", "float") else []
+    if numbers and len(numbers) * 2 >= len(present):
+        total = sum(numbers)
+        stats = (
+            f"{name}: sum={_render(float(total))} min={_render(float(min(numbers)))} "
+            f"max={_render(float(max(numbers)))} avg={_render(total / len(numbers))}"
+        )
+        if len(numbers) < len(present):
+            stats += f" ({len(present) - len(numbers)} non-numeric values skipped)"
+        return stats
+    counts = {}
+    for v in present:
+        key = _render(v)
+        counts[key] = counts.get(key, 0) + 1
+    if len(counts) <= MAX_CATEGORY_VALUES:
+        parts = ", ".join(f"{k}={c}" for k, c in sorted(counts.items(), key=lambda kv: -kv[1]))
+        return f"{name}: {parts}"
+    return f"{name}: {len(counts)} distinct"
+
+
+# =========================
+# Row Summarizer
+# =========================
+
+def summarize_rows(rows, max_rows: int = MAX_PROMPT_ROWS, truncated: bool = False,
+                   total_rows: int = None) -> str:
+    """
+    Render SQL result rows as a compact pipe-delimited table for prompts:
+    header with column types once, one line per row, and for large results
+    a stated row count, a sample of rows and per-column aggregates over
+    the full result. total_rows is the exact size of a capped result when
+    the caller knows it.
+    """
+    if isinstance(rows, str):
+        # Error strings from execute_sql_query pass through unchanged
+        return rows
+    if not rows:
+        return "No data found"
+
+    columns = list(rows[0].keys())
+    column_values = {c: [r.get(c) for r in rows] for c in columns}
+    kinds = {c: _type_name(column_values[c]) for c in columns}
+
+    total = len(rows)
+    if truncated and total_rows is not None:
+        count_note = f"{total} of {total_rows} (row cap reached)"
+    elif truncated:
+        count_note = f"{total}+ (row cap reached)"
+    else:
+        count_note = str(total)
+    sampled = total > max_rows
+    indices = _sample_indices(total, max_rows) if sampled else range(total)
+
+    lines = []
+    if sampled:
+        lines.append(f"rows: {count_note}, showing {len(indices)} sampled rows")
+    else:
+        lines.append(f"rows: {count_note}")
+    lines.append(" | ".join(f"{c}:{kinds[c]}" for c in columns))
+    for i in indices:
+        lines.append("|".join(_render(rows[i].get(c)) for c in columns))
+
+    if sampled:
+        if truncated:
+            # Only the capped rows were fetched; the rest were never seen
+            lines.append(f"aggregates over the first {total} rows only (result was capped):")
+        else:
+            lines.append(f"aggregates over all {total} rows:")
+        for c in columns:
+            lines.append(_column_stats(c, kinds[c], column_values[c]))
+
+    compact = "\n".join(lines)
+
+    raw_tokens = estimate_tokens(str(rows))
+    compact_tokens = estimate_tokens(compact)
+    print(
+        f"[result_formatter] {total} rows: ~{raw_tokens} -> ~{compact_tokens} tokens "
+        f"(saved ~{raw_tokens - compact_tokens})"
+    )
+    return compact
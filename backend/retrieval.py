@@ -0,0 +1,134 @@
+import os
+import re
+from dataclasses import dataclass
+import numpy as np
+from result_formatter import estimate_tokens, CHARS_PER_TOKEN
+
+# =========================
+# Retrieval Settings
+# =========================
+
+@dataclass(frozen=True)
+class RetrievalConfig:
+    k: int                      # passages packed into the prompt at most
+    token_budget: int           # estimated tokens of rule context at most
+    candidates: int = 20        # nearest neighbours fetched before reranking
+    mmr_lambda: float = 0.7     # 1.0 = pure relevance, 0.0 = pure diversity
+    lexical_weight: float = 0.3 # share of relevance from query term overlap
+
+
+# RAG answers carry only the rule context
+RAG_RETRIEVAL = RetrievalConfig(
+    k=int(os.getenv("RAG_RETRIEVAL_K", "4")),
+    token_budget=int(os.getenv("RAG_CONTEXT_TOKENS", "1500")),
+)
+
+# Passages go straight into the hybrid prompt, next to the data summary
+# and compliance flags, so they get a smaller share
+HYBRID_RETRIEVAL = RetrievalConfig(
+    k=int(os.getenv("HYBRID_RETRIEVAL_K", "3")),
+    token_budget=int(os.getenv("HYBRID_CONTEXT_TOKENS", "800")),
+)
+
+STOPWORDS = {
+    "the", "and", "for", "are", "was", "what", "which", "with", "this", "that",
+    "from", "under", "does", "how", "can", "any", "all", "not", "has", "have",
+    "our", "per", "who", "when", "there", "their", "into", "about", "should",
+}
+
+TERM_RE = re.compile(r"[a-z0-9]+(?:\([0-9a-z]+\))*")
+
+
+# =========================
+# Local Reranking
+# =========================
+
+def query_terms(text: str) -> set:
+    # Keeps section references like 16(2) and short numbers, drops filler words
+    return {
+        term for term in TERM_RE.findall(text.lower())
+        if term not in STOPWORDS and (len(term) > 2 or term[0].isdigit())
+    }
+
+
+def lexical_overlap(terms: set, passage: str) -> float:
+    """
+    Share of query terms present in the passage.
+    """
+    if not terms:
+        return 0.0
+    return len(terms & query_terms(passage)) / len(terms)
+
+
+def mmr_order(relevance: np.ndarray, vectors: np.ndarray, mmr_lambda: float) -> list[int]:
+    """
+    Maximal marginal relevance: repeatedly take the candidate with the best
+    relevance minus its similarity to what is already taken, so near-duplicate
+    chunks of one circular do not crowd out other rules.
+    """
+    order = []
+    remaining = list(range(len(relevance)))
+    max_sim = np.zeros(len(relevance), dtype=np.float32)
+    while remaining:
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * max_sim[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        if remaining:
+            max_sim = np.maximum(max_sim, vectors @ vectors[best])
+    return order
+
+
+# =========================
+# Budget Packing
+# =========================
+
+def pack_chunks(chunks: list, token_budget: int, k: int) -> list:
+    """
+    Greedily keep chunks in rank order while they fit the budget; a chunk
+    that does not fit is skipped so shorter ones further down can still go in.
+    If not even the best chunk fits, it is trimmed to the budget.
+    """
+    packed, used = [], 0
+    for chunk in chunks:
+        if len(packed) >= k:
+            break
+        tokens = estimate_tokens(chunk["document"])
+        if used + tokens > token_budget:
+            continue
+        packed.append(chunk)
+        used += tokens
+    if not packed and chunks:
+        best = chunks[0]
+        packed = [dict(best, document=best["document"][:token_budget * CHARS_PER_TOKEN])]
+    return packed
+
+
+def retrieve(store, query: str, query_embedding: list[float], config: RetrievalConfig) -> list:
+    """
+    Over-fetch nearest passages, rerank them locally and pack the best into
+    config.token_budget. Returns ranked [{"id", "document", "score"}].
+    """
+    # One consistent version of the store, even if an ingest lands meanwhile
+    ids, documents, matrix = store.snapshot()
+    hits = store.search(query_embedding, config.candidates, matrix=matrix)
+    if not hits:
+        return []
+
+    terms = query_terms(query)
+    indices = [i for i, _ in hits]
+    cosine = np.array([sim for _, sim in hits], dtype=np.float32)
+    lexical = np.array(
+        [lexical_overlap(terms, documents[i]) for i in indices], dtype=np.float32
+    )
+    relevance = (1 - config.lexical_weight) * cosine + config.lexical_weight * lexical
+
+    order = mmr_order(relevance, matrix[indices], config.mmr_lambda)
+    ranked = [
+        {
+            "id": ids[indices[j]],
+            "document": documents[indices[j]],
+            "score": round(float(relevance[j]), 4),
+        }
+        for j in order
+    ]
+    return pack_chunks(ranked, config.token_budget, config.k)
@@ -1,11 +1,38 @@
 import pickle
 import os
+import re
+import threading
 import numpy as np
 
+
+CHUNK_SUFFIX = "#chunk"
+CHUNK_SUFFIX_RE = re.compile(re.escape(CHUNK_SUFFIX) + r"\d{4,}$")
+
+
+def chunk_id(doc_id: str, index: int) -> str:
+    # Passages of a chunked document are stored as doc_id#chunk0000, doc_id#chunk0001, ...
+    return f"{doc_id}{CHUNK_SUFFIX}{index:04d}"
+
+
+def base_doc_id(stored_id: str) -> str:
+    # Only the suffix added by chunk_id; names like "notice#2023.pdf" or "circular#0042" are kept
+    return CHUNK_SUFFIX_RE.sub("", stored_id)
+
+
 class SimpleVectorStore:
+    """
+    Writers build new lists and swap them in (copy-on-write), so a reader
+    holding a snapshot() never sees ids, documents and matrix out of step.
+    """
+
     def __init__(self, path: str):
         self.path = path
         self.data = {"documents": [], "embeddings": [], "ids": []}
+        # Row-normalized embedding matrix, rebuilt lazily after writes
+        self._matrix = None
+        # _lock guards the swap of data/_matrix; _write_lock serializes writers and saves
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
         self._load()
 
     def _load(self):
@@ -28,66 +55,123 @@ class SimpleVectorStore:
         except Exception as e:
             print(f"Error saving vector store: {e}")
 
-    def upsert(self, documents: list[str], embeddings: list[list[float]], ids: list[str]):
-        # Simple implementation: overwrite if id exists, else append
+    def _swap(self, data: dict, save: bool = True):
+        # Callers hold _write_lock; readers only ever see complete versions
+        with self._lock:
+            self.data = data
+            self._matrix = None
+        if save:
+            self._save()
+
+    @staticmethod
+    def _upserted(data: dict, documents: list[str], embeddings: list[list[float]], ids: list[str]) -> dict:
+        # Overwrite if id exists, else append; returns new lists
+        new = {key: list(data[key]) for key in ("documents", "embeddings", "ids")}
+        positions = {doc_id: i for i, doc_id in enumerate(new["ids"])}
         for doc, emb, doc_id in zip(documents, embeddings, ids):
-            if doc_id in self.data["ids"]:
-                # Update existing
-                idx = self.data["ids"].index(doc_id)
-                self.data["documents"][idx] = doc
-                self.data["embeddings"][idx] = emb
+            if doc_id in positions:
+                idx = positions[doc_id]
+                new["documents"][idx] = doc
+                new["embeddings"][idx] = emb
             else:
-                # Append new
-                self.data["documents"].append(doc)
-                self.data["embeddings"].append(emb)
-                self.data["ids"].append(doc_id)
-        self._save()
+                new["documents"].append(doc)
+                new["embeddings"].append(emb)
+                new["ids"].append(doc_id)
+                positions[doc_id] = len(new["ids"]) - 1
+        return new
+
+    @staticmethod
+    def _without(data: dict, keep_id) -> dict:
+        keep = [i for i, stored_id in enumerate(data["ids"]) if keep_id(stored_id)]
+        return {key: [data[key][i] for i in keep] for key in ("documents", "embeddings", "ids")}
+
+    def upsert(self, documents: list[str], embeddings: list[list[float]], ids: list[str]):
+        with self._write_lock:
+            self._swap(self._upserted(self.data, documents, embeddings, ids))
 
     def delete(self, ids: list[str]):
-        for doc_id in ids:
-            if doc_id in self.data["ids"]:
-                idx = self.data["ids"].index(doc_id)
-                self.data["documents"].pop(idx)
-                self.data["embeddings"].pop(idx)
-                self.data["ids"].pop(idx)
-        self._save()
+        drop = set(ids)
+        with self._write_lock:
+            self._swap(self._without(self.data, lambda stored_id: stored_id not in drop))
+
+    def delete_document(self, doc_id: str, save: bool = True) -> int:
+        """
+        Remove a document and all of its chunks; returns the number removed.
+        """
+        with self._write_lock:
+            data = self._without(self.data, lambda stored_id: base_doc_id(stored_id) != doc_id)
+            removed = len(self.data["ids"]) - len(data["ids"])
+            if removed:
+                self._swap(data, save=save)
+        return removed
+
+    def replace_document(self, doc_id: str, documents: list[str], embeddings: list[list[float]],
+                         ids: list[str]):
+        """
+        Swap all chunks of doc_id for new ones in one step, so searches never
+        see the document missing or half old, half new.
+        """
+        with self._write_lock:
+            data = self._without(self.data, lambda stored_id: base_doc_id(stored_id) != doc_id)
+            self._swap(self._upserted(data, documents, embeddings, ids))
+
+    def document_ids(self) -> set:
+        return {base_doc_id(stored_id) for stored_id in self.data["ids"]}
+
+    def matrix(self) -> np.ndarray:
+        """
+        Unit-length embeddings (zero vectors stay zero), cached between writes
+        so queries do not re-stack and re-normalize the whole store.
+        """
+        with self._lock:
+            if self._matrix is None:
+                matrix = np.asarray(self.data["embeddings"], dtype=np.float32)
+                if matrix.size:
+                    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                    norms[norms == 0] = 1.0
+                    matrix = matrix / norms
+                self._matrix = matrix
+            return self._matrix
+
+    def snapshot(self) -> tuple:
+        """
+        (ids, documents, matrix) of one store version. Writers never mutate
+        these lists in place, so they stay aligned after the lock is released.
+        """
+        with self._lock:
+            return self.data["ids"], self.data["documents"], self.matrix()
+
+    def search(self, query_embedding: list[float], n_results: int = 3,
+               matrix: np.ndarray = None) -> list[tuple[int, float]]:
+        """
+        (row index, cosine similarity) of the n_results nearest passages.
+        Pass the matrix of a snapshot() to index that snapshot's lists.
+        """
+        if matrix is None:
+            matrix = self.matrix()
+        if not len(matrix):
+            return []
+        q_emb = np.asarray(query_embedding, dtype=np.float32)
+        norm_q = np.linalg.norm(q_emb)
+        if norm_q == 0:
+            return []
+        similarities = matrix @ (q_emb / norm_q)
+        k = min(n_results, len(similarities))
+        top_k = np.argpartition(-similarities, k - 1)[:k]
+        top_k = top_k[np.argsort(-similarities[top_k], kind="stable")]
+        return [(int(i), float(similarities[i])) for i in top_k]
 
     def query(self, query_embeddings: list[list[float]], n_results: int = 3):
         results = {"ids": [], "documents": [], "distances": []}
-        
-        if not self.data["embeddings"]:
+        ids, documents, matrix = self.snapshot()
+
+        if not ids:
             return {"ids": [[]], "documents": [[]], "distances": [[]]}
 
-        db_embeddings = np.array(self.data["embeddings"])
-        
         for q_emb in query_embeddings:
-            q_emb = np.array(q_emb)
-            # Cosine similarity
-            norm_q = np.linalg.norm(q_emb)
-            norm_db = np.linalg.norm(db_embeddings, axis=1)
-            
-            # Avoid division by zero
-            if norm_q == 0:
-                # Should typically not happen with valid embeddings
-                results["ids"].append([])
-                results["documents"].append([])
-                continue
-                
-            # Element-wise division for broadcasting, handle zero norms in DB
-            with np.errstate(divide='ignore', invalid='ignore'):
-                 similarities = np.dot(db_embeddings, q_emb) / (norm_db * norm_q)
-            
-            # Replace NaNs with -1 (least similar)
-            similarities = np.nan_to_num(similarities, nan=-1.0)
-            
-            # Get top k indices
-            # If we have fewer documents than n_results, return all
-            k = min(n_results, len(self.data["ids"]))
-            top_k_indices = np.argsort(similarities)[::-1][:k]
-            
-            results["ids"].append([self.data["ids"][i] for i in top_k_indices])
-            results["documents"].append([self.data["documents"][i] for i in top_k_indices])
-            # sim to dist not strictly needed but good for compatibility if we used it
-            results["distances"].append([1 - similarities[i] for i in top_k_indices]) 
+            hits = self.search(q_emb, n_results, matrix=matrix)
+            results["ids"].append([ids[i] for i, _ in hits])
+            results["documents"].append([documents[i] for i, _ in hits])
+            results["distances"].append([1 - sim for _, sim in hits])
             
         return results
@@ -0,0 +1,305 @@
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+
+from database import engine
+from telemetry import observe, ROW_BUCKETS
+from invoice_partitions import attach_partitions
+
+# =========================
+# Guard Limits
+# =========================
+
+# Hard cap on rows handed back to the agents (and from there into prompts)
+MAX_RESULT_ROWS = int(os.getenv("SQL_MAX_RESULT_ROWS", "500"))
+
+# Wall-clock budget for a single generated query, enforced inside SQLite
+MAX_EXECUTION_SECONDS = float(os.getenv("SQL_MAX_EXECUTION_SECONDS", "5"))
+
+# Reject plans whose estimated row visits exceed this (e.g. cross joins)
+MAX_ESTIMATED_ROWS = int(os.getenv("SQL_MAX_ESTIMATED_ROWS", "100000000"))
+
+# SQLite VM instructions between two wall-clock checks
+PROGRESS_HANDLER_STEPS = 1000
+
+FORBIDDEN_KEYWORDS = (
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER",
+    "CREATE", "ATTACH", "DETACH", "PRAGMA", "VACUUM", "REINDEX", "ANALYZE",
+    "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE",
+)
+
+# Plan detail lines look like "SCAN i", "SCAN invoices USING COVERING INDEX ..."
+# or "SEARCH it USING INDEX ... (invoice_id=?)"
+PLAN_LOOP_RE = re.compile(r"^(SCAN|SEARCH)(?: TABLE)? (\S+)")
+
+TABLE_REF_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?",
+    re.IGNORECASE,
+)
+
+NOT_AN_ALIAS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL",
+    "OUTER", "ON", "USING", "GROUP", "ORDER", "LIMIT", "HAVING", "UNION",
+    "EXCEPT", "INTERSECT", "WINDOW",
+}
+
+# Row multiplier for an indexed lookup inside a loop
+SEARCH_ROW_FACTOR = 10
+
+
+class SQLGuardError(ValueError):
+    """Raised when a generated query is rejected before execution."""
+
+
+@dataclass
+class GuardedResult:
+    rows: list
+    columns: list
+    truncated: bool
+    estimated_rows: int
+    timings_ms: dict = field(default_factory=dict)
+
+
+# =========================
+# Validation
+# =========================
+
+def _strip_literals(sql: str) -> str:
+    """
+    Blank out comments, string literals and quoted identifiers so keyword
+    and statement-separator checks only look at real SQL tokens.
+    """
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    sql = re.sub(r'"(?:[^"]|"")*"', '""', sql)
+    return sql
+
+
+def clean_generated_sql(sql_query: str) -> str:
+    """
+    Remove markdown fences and trailing semicolons the model sometimes adds.
+    """
+    sql = (
+        sql_query
+        .replace("```sql", "")
+        .replace("```", "")
+        .strip()
+    )
+    return sql.rstrip(";").strip()
+
+
+def validate_select(sql_query: str) -> str:
+    """
+    Return the cleaned query if it is a single read-only SELECT,
+    otherwise raise SQLGuardError.
+    """
+    sql = clean_generated_sql(sql_query)
+    if not sql:
+        raise SQLGuardError("empty query")
+
+    tokens_only = _strip_literals(sql)
+    if ";" in tokens_only:
+        raise SQLGuardError("multiple statements are not allowed")
+
+    first_word = tokens_only.split(None, 1)[0].upper()
+    if first_word not in ("SELECT", "WITH"):
+        raise SQLGuardError(f"only SELECT queries are allowed (got {first_word})")
+
+    upper = tokens_only.upper()
+    for keyword in FORBIDDEN_KEYWORDS:
+        if re.search(rf"\b{keyword}\b", upper):
+            raise SQLGuardError(f"forbidden keyword: {keyword}")
+
+    return sql
+
+
+def apply_row_limit(sql: str, max_rows: int) -> str:
+    """
+    Wrap the query so SQLite stops producing rows after max_rows + 1;
+    the extra row tells us the result was truncated.
+    """
+    return f"SELECT * FROM (\n{sql}\n) LIMIT {max_rows + 1}"
+
+
+# =========================
+# Cost Estimation
+# =========================
+
+def _table_aliases(sql: str) -> dict:
+    aliases = {}
+    for table, alias in TABLE_REF_RE.findall(_strip_literals(sql)):
+        table = table.split(".")[-1]
+        aliases[table] = table
+        if alias and alias.upper() not in NOT_AN_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+
+def _table_sizes(conn, tables, partition_rows: dict = None) -> dict:
+    """
+    Row counts keyed by table (live + archived partitions) and by
+    schema-qualified name ("main.invoices", "p0.invoices").
+    """
+    sizes = dict(partition_rows or {})
+    for table in set(tables):
+        try:
+            # MIN/MAX(rowid) are O(log n) lookups, unlike COUNT(*), and stay
+            # close after old periods are archived; main. skips the TEMP
+            # views that stand in for partitioned tables
+            row = conn.execute(f'SELECT MAX(rowid) - MIN(rowid) + 1 FROM main."{table}"').fetchone()
+        except sqlite3.Error:
+            continue
+        sizes[f"main.{table}"] = int(row[0] or 0)
+        sizes[table] = sizes[f"main.{table}"] + sum(
+            n for name, n in (partition_rows or {}).items() if name.split(".")[-1] == table
+        )
+    return sizes
+
+
+# Plan nodes whose subtree runs once, feeding rows to a later SCAN of that name
+ONCE_NODE_PREFIXES = ("CO-ROUTINE", "MATERIALIZE")
+
+
+def estimate_query_cost(conn, sql: str, partition_rows: dict = None) -> int:
+    """
+    Rough row-visit estimate from EXPLAIN QUERY PLAN: every full SCAN
+    multiplies by the table size, every indexed SEARCH by a small factor.
+    Nested loops (joins, correlated subqueries) therefore multiply out;
+    UNION members and materialized subqueries add up.
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    aliases = _table_aliases(sql)
+    sizes = _table_sizes(conn, aliases.values(), partition_rows)
+    fallback_size = max(sizes.values(), default=0)
+
+    children = {}
+    for node_id, parent, _unused, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    def loop_factor(detail):
+        match = PLAN_LOOP_RE.match(detail)
+        if not match:
+            return 1
+        op, name = match.groups()
+        if op == "SEARCH":
+            return SEARCH_ROW_FACTOR
+        if name in sizes:
+            return max(sizes[name], 1)
+        return max(sizes.get(aliases.get(name, name), fallback_size), 1)
+
+    def subtree_cost(node_id, detail):
+        kids = children.get(node_id, [])
+        if detail.startswith("COMPOUND"):
+            return sum(subtree_cost(*kid) for kid in kids) or 1
+        once = sum(subtree_cost(*kid) for kid in kids if kid[1].startswith(ONCE_NODE_PREFIXES))
+        loops = loop_factor(detail)
+        for kid in kids:
+            if not kid[1].startswith(ONCE_NODE_PREFIXES):
+                loops *= subtree_cost(*kid)
+        return once + loops
+
+    return subtree_cost(0, "")
+
+
+# =========================
+# Guarded Execution
+# =========================
+
+def open_readonly_connection():
+    db_path = engine.url.database
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def run_guarded_query(sql_query: str,
+                      max_rows: int = MAX_RESULT_ROWS,
+                      timeout_seconds: float = MAX_EXECUTION_SECONDS) -> GuardedResult:
+    """
+    Validate, cost-check and execute LLM-generated SQL on a read-only
+    connection with a row cap and a wall-clock budget.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    try:
+        sql = validate_select(sql_query)
+    except SQLGuardError as e:
+        timings["validate"] = (time.perf_counter() - started) * 1000
+        print(f"[sql_guard] rejected ({e}) validate={timings['validate']:.2f}ms")
+        raise
+    timings["validate"] = (time.perf_counter() - started) * 1000
+
+    conn = open_readonly_connection()
+    try:
+        step = time.perf_counter()
+        # Archived financial years are attached only if the date predicates reach them
+        partition_rows = attach_partitions(conn, sql)
+        timings["route"] = (time.perf_counter() - step) * 1000
+
+        step = time.perf_counter()
+        estimated_rows = estimate_query_cost(conn, sql, partition_rows)
+        timings["plan"] = (time.perf_counter() - step) * 1000
+        if estimated_rows > MAX_ESTIMATED_ROWS:
+            print(
+                f"[sql_guard] rejected (estimated {estimated_rows:,} rows > "
+                f"{MAX_ESTIMATED_ROWS:,}) plan={timings['plan']:.2f}ms"
+            )
+            raise SQLGuardError(
+                f"query too expensive: ~{estimated_rows:,} row visits estimated"
+            )
+
+        limited_sql = apply_row_limit(sql, max_rows)
+        deadline = time.perf_counter() + timeout_seconds
+
+        def _check_deadline():
+            # Non-zero return value makes SQLite abort with "interrupted"
+            return 1 if time.perf_counter() > deadline else 0
+
+        conn.set_progress_handler(_check_deadline, PROGRESS_HANDLER_STEPS)
+
+        step = time.perf_counter()
+        try:
+            cursor = conn.execute(limited_sql)
+            columns = [d[0] for d in cursor.description or []]
+            rows = []
+            while len(rows) <= max_rows:
+                batch = cursor.fetchmany(min(100, max_rows + 1 - len(rows)))
+                if not batch:
+                    break
+                rows.extend(dict(zip(columns, r)) for r in batch)
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                timings["execute"] = (time.perf_counter() - step) * 1000
+                print(
+                    f"[sql_guard] aborted after {timings['execute']:.0f}ms "
+                    f"(budget {timeout_seconds:.1f}s)"
+                )
+                raise SQLGuardError(
+                    f"query exceeded {timeout_seconds:.1f}s time budget"
+                ) from e
+            raise
+        timings["execute"] = (time.perf_counter() - step) * 1000
+    finally:
+        conn.close()
+
+    truncated = len(rows) > max_rows
+    if truncated:
+        rows = rows[:max_rows]
+        print(f"[sql_guard] rewrote with LIMIT {max_rows}; result truncated")
+
+    timings["total"] = (time.perf_counter() - started) * 1000
+    observe("gst_sql_rows", len(rows), buckets=ROW_BUCKETS)
+    print(
+        f"[sql_guard] ok rows={len(rows)} est={estimated_rows:,} "
+        f"validate={timings['validate']:.2f}ms plan={timings['plan']:.2f}ms "
+        f"execute={timings['execute']:.2f}ms"
+    )
+    return GuardedResult(
+        rows=rows,
+        columns=columns,
+        truncated=truncated,
+        estimated_rows=estimated_rows,
+        timings_ms=timings,
+    )
@@ -1,31 +1,18 @@
-import os
 import json
+import hashlib
 from datetime import datetime
-from dotenv import load_dotenv
-
-from sqlalchemy import text
-from google import genai
-from google.genai import types
 
 from database import (
-    engine,
     SessionLocal,
     Invoice,
     InvoiceItem
 )
-
-# =========================
-# Environment & Gemini Setup
-# =========================
-
-load_dotenv()
-
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY is not set!")
-
-client = genai.Client(api_key=api_key)
-model_name = "gemini-2.5-flash"
+from sql_guard import run_guarded_query
+from result_formatter import summarize_rows
+from model_provider import get_provider, Attachment
+from telemetry import span, cache_hit
+from extraction_cache import get_extraction_cache
+from invoice_partitions import archived_invoice_ids
 
 # =========================
 # SAFE TYPE HELPERS
@@ -53,11 +40,7 @@ def safe_int(value, default=0):
 # Invoice Extraction
 # =========================
 
-def extract_invoice_data(file_bytes: bytes, mime_type: str):
-    """
-    Extract structured invoice data from PDF/image using Gemini
-    """
-    prompt = """
+INVOICE_EXTRACTION_PROMPT = """
     Extract invoice information into VALID JSON.
 
     Seller name is usually the company/brand at the TOP of the invoice.
@@ -100,26 +83,43 @@ def extract_invoice_data(file_bytes: bytes, mime_type: str):
     Return ONLY raw JSON.
     """
 
+# Bump when the expected JSON shape changes; prompt edits are picked up by the hash
+EXTRACTION_SCHEMA_VERSION = 1
+EXTRACTION_VERSION = (
+    f"v{EXTRACTION_SCHEMA_VERSION}-"
+    f"{hashlib.sha1(INVOICE_EXTRACTION_PROMPT.encode()).hexdigest()[:8]}"
+)
+
+
+def extract_invoice_data(file_bytes: bytes, mime_type: str, file_hash: str = None):
+    """
+    Extract structured invoice data from PDF/image using Gemini.
+    Results are cached by file hash + EXTRACTION_VERSION, so a file
+    that was extracted before never costs another model call.
+    """
+    file_hash = file_hash or hashlib.sha256(file_bytes).hexdigest()
+    cache = get_extraction_cache()
+    cached = cache.get(file_hash, EXTRACTION_VERSION)
+    cache_hit("invoice_extraction", cached is not None)
+    if cached is not None:
+        return cached
+
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[
-                prompt,
-                types.Part.from_bytes(
-                    data=file_bytes,
-                    mime_type=mime_type
-                )
-            ]
-        )
+        response_text = get_provider().generate([
+            INVOICE_EXTRACTION_PROMPT,
+            Attachment(data=file_bytes, mime_type=mime_type)
+        ])
 
         clean_text = (
-            response.text
+            response_text
             .replace("```json", "")
             .replace("```", "")
             .strip()
         )
 
-        return json.loads(clean_text)
+        data = json.loads(clean_text)
+        cache.put(file_hash, EXTRACTION_VERSION, data, mime_type)
+        return data
 
     except Exception as e:
         print("Invoice extraction error:", e)
@@ -130,13 +130,24 @@ def extract_invoice_data(file_bytes: bytes, mime_type: str):
 # Save Invoice to Database
 # =========================
 
-def save_invoice_to_db(data: dict):
+def save_invoice_to_db(data: dict, replace: bool = False):
     """
-    Save extracted invoice data to DB (NULL-SAFE)
+    Save extracted invoice data to DB (NULL-SAFE).
+    replace=True deletes an existing invoice with the same id in the same
+    transaction, so a failed save leaves the old rows in place.
     """
+    # The live primary key does not cover archived financial years
+    if archived_invoice_ids([data.get("invoice_id")]):
+        print(f"DB Save error: invoice {data.get('invoice_id')} already exists in an archived partition")
+        return False
+
     db = SessionLocal()
 
     try:
+        if replace:
+            db.query(InvoiceItem).filter(InvoiceItem.invoice_id == data.get("invoice_id")).delete()
+            db.query(Invoice).filter(Invoice.invoice_id == data.get("invoice_id")).delete()
+
         # ---------- Invoice Date ----------
         invoice_date = datetime.utcnow().date()
         if data.get("invoice_date"):
@@ -212,33 +223,33 @@ def save_invoice_to_db(data: dict):
 # =========================
 
 def execute_sql_query(sql_query: str):
+    """
+    Run generated SQL through the guard: read-only SELECTs only,
+    row-capped and time-boxed. Returns (rows or error string, truncated).
+    """
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(sql_query))
-            return [dict(row) for row in result.mappings()]
+        result = run_guarded_query(sql_query)
+        return result.rows, result.truncated
     except Exception as e:
-        return f"SQL Error: {e}"
+        return f"SQL Error: {e}", False
 
 
 # =========================
 # Natural Language Answer
 # =========================
 
-def format_natural_language_answer(query, sql_query, results):
+def format_natural_language_answer(query, sql_query, results, truncated=False):
     prompt = f"""
     User Question: {query}
     SQL Executed: {sql_query}
-    SQL Result: {results}
+    SQL Result:
+    {summarize_rows(results, truncated=truncated)}
 
     Answer clearly and concisely.
     """
 
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt
-        )
-        return response.text.strip()
+        return get_provider().generate(prompt).strip()
     except:
         return "Unable to generate answer."
 
@@ -247,19 +258,34 @@ def format_natural_language_answer(query, sql_query, results):
 # Structured Query Handler
 # =========================
 
-def process_structured_query(query: str):
-    sql_result = _generate_sql_only(query)
-
-    if "error" in sql_result:
-        return sql_result
-
-    sql_query = sql_result["sql_query"]
-    results = execute_sql_query(sql_query)
-    answer = format_natural_language_answer(query, sql_query, results)
+def process_structured_query(query: str, generate_nlp: bool = True, sql_query: str = None):
+    """
+    sql_query skips generation (follow-ups that patched or refined the
+    previous turn's SQL).
+    """
+    if sql_query is None:
+        with span("sql_generation"):
+            sql_result = _generate_sql_only(query)
+
+        if "error" in sql_result:
+            return sql_result
+
+        sql_query = sql_result["sql_query"]
+    with span("sql_execution") as attrs:
+        results, row_limit_reached = execute_sql_query(sql_query)
+        attrs["rows"] = len(results) if isinstance(results, list) else 0
+
+    answer = None
+    if generate_nlp:
+        with span("answer_synthesis"):
+            answer = format_natural_language_answer(
+                query, sql_query, results, truncated=row_limit_reached
+            )
 
     return {
         "sql_query": sql_query,
         "query_result": results,
+        "row_limit_reached": row_limit_reached,
         "structured_answer": answer
     }
 
@@ -268,6 +294,35 @@ def process_structured_query(query: str):
 # SQL Generator
 # =========================
 
+def refine_sql(previous_query: str, previous_sql: str, follow_up: str):
+    """
+    Ask the model to edit the previous turn's SQL for a follow-up question,
+    rather than writing a new query from the schema.
+    """
+    prompt = f"""
+    Previous question: "{previous_query}"
+    Previous SQLite SQL:
+    {previous_sql}
+
+    Follow-up question: "{follow_up}"
+
+    Task: Modify the previous SQL so it answers the follow-up question.
+    Keep everything the follow-up does not change.
+
+    Rules:
+    - Output ONLY SQL
+    - No explanations
+    - No markdown
+    """
+
+    try:
+        with span("sql_refinement"):
+            response_text = get_provider().generate(prompt, temperature=0)
+        return {"sql_query": response_text.strip()}
+    except Exception as e:
+        return {"error": str(e)}
+
+
 def _generate_sql_only(query: str):
     schema = """
     Table: invoices
@@ -305,13 +360,9 @@ def _generate_sql_only(query: str):
     """
 
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={"temperature": 0}
-        )
+        response_text = get_provider().generate(prompt, temperature=0)
 
-        return {"sql_query": response.text.strip()}
+        return {"sql_query": response_text.strip()}
 
     except Exception as e:
         return {"error": str(e)}
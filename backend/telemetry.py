@@ -0,0 +1,218 @@
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# =========================
+# Metric Registry
+# =========================
+
+# Seconds; covers sub-millisecond SQL up to slow multimodal model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+METRIC_HELP = {
+    "gst_stage_duration_seconds": ("histogram", "Duration of pipeline stages"),
+    "gst_model_call_duration_seconds": ("histogram", "Duration of model provider calls"),
+    "gst_model_calls_total": ("counter", "Model provider calls by kind and status"),
+    "gst_model_prompt_tokens": ("histogram", "Prompt tokens per model call"),
+    "gst_model_response_tokens": ("histogram", "Response tokens per model call"),
+    "gst_sql_rows": ("histogram", "Rows returned by generated SQL"),
+    "gst_cache_hits_total": ("counter", "Cache hits by cache name"),
+    "gst_cache_misses_total": ("counter", "Cache misses by cache name"),
+    "gst_requests_total": ("counter", "API requests by endpoint and outcome"),
+    "gst_model_retries_total": ("counter", "Retried model calls by kind"),
+    "gst_rate_limit_wait_seconds": ("histogram", "Time spent waiting for rate limit tokens"),
+    "gst_embed_batch_size": ("histogram", "Texts per batched embedding call"),
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_bucket_bounds = {}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def inc(name: str, labels: dict = None, amount: float = 1.0):
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+
+
+def observe(name: str, value: float, labels: dict = None, buckets: tuple = DEFAULT_BUCKETS):
+    key = (name, _label_key(labels))
+    with _lock:
+        bounds = _bucket_bounds.setdefault(name, buckets)
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [0] * len(bounds) + [0.0, 0]
+        idx = bisect.bisect_left(bounds, value)
+        if idx < len(bounds):
+            state[idx] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+def cache_hit(cache: str, hit: bool):
+    inc("gst_cache_hits_total" if hit else "gst_cache_misses_total", {"cache": cache})
+
+
+# =========================
+# Request Traces
+# =========================
+
+_current_trace = contextvars.ContextVar("gst_trace", default=None)
+
+
+class Trace:
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.spans = []
+
+    def summary(self) -> list[dict]:
+        return [dict(s) for s in self.spans]
+
+
+def start_trace(trace_id: str = None) -> Trace:
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+class _SharedSpans:
+    def __init__(self, traces: list):
+        self.traces = traces
+
+    def append(self, entry: dict):
+        for trace in self.traces:
+            trace.spans.append(dict(entry))
+
+
+class _SharedTrace:
+    """
+    Stands in for the current trace while one call serves several requests
+    (e.g. a batched embedding): every span lands on each request's trace.
+    """
+
+    def __init__(self, traces: list):
+        self.spans = _SharedSpans(traces)
+
+
+@contextmanager
+def traced_for(contexts: list):
+    """
+    Record spans on the request traces of contexts captured with
+    contextvars.copy_context() where the work was submitted. Needed on
+    worker threads, which do not inherit the submitter's context.
+    """
+    traces = []
+    for context in contexts:
+        trace = context.get(_current_trace)
+        if trace is not None and all(trace is not t for t in traces):
+            traces.append(trace)
+    token = _current_trace.set(_SharedTrace(traces) if traces else None)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Time a pipeline stage: feeds gst_stage_duration_seconds and, inside a
+    request, appends {stage, duration_ms, attributes} to the trace. The
+    yielded dict can be filled with extra attributes (rows, tokens, ...).
+    """
+    attrs = dict(attributes)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("gst_stage_duration_seconds", elapsed, {"stage": stage})
+        trace = _current_trace.get()
+        if trace is not None:
+            entry = {"stage": stage, "duration_ms": round(elapsed * 1000, 2), "status": status}
+            entry.update(attrs)
+            trace.spans.append(entry)
+
+
+def record_model_call(kind: str, seconds: float, ok: bool,
+                      prompt_tokens: int = None, response_tokens: int = None):
+    labels = {"kind": kind}
+    observe("gst_model_call_duration_seconds", seconds, labels)
+    inc("gst_model_calls_total", {"kind": kind, "status": "ok" if ok else "error"})
+    if prompt_tokens is not None:
+        observe("gst_model_prompt_tokens", prompt_tokens, labels, TOKEN_BUCKETS)
+    if response_tokens is not None:
+        observe("gst_model_response_tokens", response_tokens, labels, TOKEN_BUCKETS)
+
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append({
+            "stage": f"model.{kind}",
+            "duration_ms": round(seconds * 1000, 2),
+            "status": "ok" if ok else "error",
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+        })
+
+
+# =========================
+# Prometheus Exposition
+# =========================
+
+def _escape_label_value(value) -> str:
+    # Exposition format escapes backslash, double quote and line feed
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    rendered = ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs)
+    return "{" + rendered + "}"
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        bounds = dict(_bucket_bounds)
+
+    names = sorted({n for n, _ in counters} | {n for n, _ in histograms})
+    for name in names:
+        kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (n, labels), state in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds[name], state[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {state[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {state[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,85 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Every store lives in a throwaway directory; set before any backend module
+# is imported, since they read their paths at import time
+TEST_DIR = tempfile.mkdtemp(prefix="gst_tests_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'invoices.db')}",
+    "INVOICE_PARTITION_DIR": os.path.join(TEST_DIR, "partitions"),
+    "ANALYTICS_EXPORT_DIR": os.path.join(TEST_DIR, "analytics_export"),
+    "EXTRACTION_CACHE_DIR": os.path.join(TEST_DIR, "extraction_cache"),
+    "GST_VECTOR_STORE": os.path.join(TEST_DIR, "vector_store.pkl"),
+    "GST_DOCS_DIR": os.path.join(TEST_DIR, "gst_docs"),
+    "INVOICE_DEDUP_INDEX": os.path.join(TEST_DIR, "dedup_index.pkl"),
+    "MODEL_PROVIDER": "fake",
+})
+
+INVOICE_COLUMNS = (
+    "invoice_id, invoice_date, seller_name, seller_state, seller_gstin, buyer_name, buyer_state, "
+    "buyer_gstin, sub_total, cgst_total, sgst_total, igst_total, total_tax, grand_total, payment_method"
+)
+ITEM_COLUMNS = (
+    "invoice_id, description, quantity, unit_price, total_price, hsn_code, item_category, "
+    "cgst_rate, sgst_rate, igst_rate, tax_amount"
+)
+
+
+def insert_invoices(rows: list):
+    """
+    rows: (invoice_id, invoice_date, sub_total); one line item each at 18%.
+    """
+    from database import engine
+
+    conn = sqlite3.connect(engine.url.database)
+    for invoice_id, invoice_date, sub_total in rows:
+        tax = round(sub_total * 0.18, 2)
+        conn.execute(
+            f"INSERT INTO invoices ({INVOICE_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            (invoice_id, invoice_date, "Seller", "Karnataka", "29ABCDE1234F1Z5", "Buyer", "Karnataka",
+             "29XYZAB1234C1Z5", sub_total, tax / 2, tax / 2, 0.0, tax, sub_total + tax, "UPI"),
+        )
+        conn.execute(
+            f"INSERT INTO invoice_items ({ITEM_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            (invoice_id, "Widget", 1, sub_total, sub_total, "8471", "Goods", 9.0, 9.0, 0.0, tax),
+        )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def invoice_db():
+    """
+    Empty live tables and no archived partitions. Returns a seeding helper:
+    seed(n, start, end) spreads n invoices evenly over [start, end).
+    """
+    from database import init_db, engine
+    import invoice_partitions
+
+    init_db()
+    conn = sqlite3.connect(engine.url.database)
+    conn.execute("DELETE FROM invoice_items")
+    conn.execute("DELETE FROM invoices")
+    conn.commit()
+    conn.close()
+    shutil.rmtree(invoice_partitions.PARTITION_DIR, ignore_errors=True)
+
+    def seed(n: int, start: date = date(2021, 4, 1), end: date = date(2024, 4, 1)) -> list:
+        days = (end - start).days
+        rows = [
+            (f"INV{i:05d}", (start + timedelta(days=i * days // n)).isoformat(), float(100 + i))
+            for i in range(n)
+        ]
+        insert_invoices(rows)
+        return rows
+
+    return seed
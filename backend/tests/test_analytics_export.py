@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from conftest import insert_invoices
+from database import engine
+from analytics_export import export_table, aggregate
+from invoice_partitions import archive_closed_periods, archive_financial_year
+
+
+def _db_totals() -> tuple:
+    conn = sqlite3.connect(engine.url.database)
+    try:
+        return conn.execute("SELECT COUNT(*), SUM(grand_total) FROM invoices").fetchone()
+    finally:
+        conn.close()
+
+
+def _exported_totals(export_dir) -> tuple:
+    rows = aggregate("invoices", [], {"grand_total": ["count", "sum"]}, export_dir=str(export_dir))
+    return rows[0]["grand_total_count"], rows[0]["grand_total_sum"]
+
+
+def test_export_after_archive_and_vacuum(invoice_db, tmp_path):
+    seeded = invoice_db(400)
+    count, total = _db_totals()
+    export_table("invoices", export_dir=str(tmp_path))
+    assert _exported_totals(tmp_path) == (count, pytest.approx(total))
+
+    # Archiving moves rows out of the live table and VACUUM can reuse rowids
+    archive_financial_year("2021-22", force=True)
+    archive_closed_periods(vacuum_live=True)
+    insert_invoices([("INV-NEW", "2024-05-10", 500.0)])
+    export_table("invoices", export_dir=str(tmp_path))
+
+    count, total = _exported_totals(tmp_path)
+    assert count == len(seeded) + 1
+    assert total == pytest.approx(sum(r[2] * 1.18 for r in seeded) + 590.0)
+
+
+def test_incremental_export_only_adds_new_rows(invoice_db, tmp_path):
+    invoice_db(50)
+    assert export_table("invoices", export_dir=str(tmp_path)) == 50
+    assert export_table("invoices", export_dir=str(tmp_path)) == 0
+
+    insert_invoices([("INV-NEW", "2024-05-10", 500.0)])
+    assert export_table("invoices", export_dir=str(tmp_path)) == 1
+    assert _exported_totals(tmp_path)[0] == 51
+
+
+def test_replaced_and_edited_invoices_are_counted_once(invoice_db, tmp_path):
+    seeded = invoice_db(50)
+    export_table("invoices", export_dir=str(tmp_path))
+
+    # A replace re-inserts the invoice with a new rowid above the high-water mark
+    conn = sqlite3.connect(engine.url.database)
+    conn.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (seeded[3][0],))
+    conn.execute("DELETE FROM invoices WHERE invoice_id = ?", (seeded[3][0],))
+    conn.commit()
+    conn.close()
+    insert_invoices([(seeded[3][0], seeded[3][1], 1000.0)])
+    export_table("invoices", export_dir=str(tmp_path))
+    count, total = _db_totals()
+    assert _exported_totals(tmp_path) == (count, pytest.approx(total))
+
+    # An in-place edit below the mark changes the checksum
+    conn = sqlite3.connect(engine.url.database)
+    conn.execute("UPDATE invoices SET grand_total = 1.0 WHERE invoice_id = ?", (seeded[10][0],))
+    conn.commit()
+    conn.close()
+    export_table("invoices", export_dir=str(tmp_path))
+    count, total = _db_totals()
+    assert _exported_totals(tmp_path) == (count, pytest.approx(total))
+
+
+def test_monthly_aggregate_matches_database(invoice_db, tmp_path):
+    seeded = invoice_db(120)
+    archive_financial_year("2022-23", force=True)
+    export_table("invoices", export_dir=str(tmp_path))
+
+    rows = aggregate("invoices", ["month"], {"grand_total": "count"},
+                     months=("2022-06", "2022-06"), export_dir=str(tmp_path))
+    expected = sum(1 for r in seeded if r[1].startswith("2022-06"))
+    assert [r["grand_total_count"] for r in rows if r["month"] == "2022-06"] == [expected]
@@ -0,0 +1,153 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import compliance_checks
+from compliance_checks import checks_for_query, get_compliance_report, gstin_valid, run_checks
+from conftest import INVOICE_COLUMNS, ITEM_COLUMNS
+from database import engine
+
+GSTIN_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def with_checksum(first14: str) -> str:
+    total = 0
+    for i, ch in enumerate(first14):
+        product = GSTIN_CHARS.index(ch) * (1 if i % 2 == 0 else 2)
+        total += product // 36 + product % 36
+    return first14 + GSTIN_CHARS[(36 - total % 36) % 36]
+
+
+SELLER = with_checksum("29ABCDE1234F1Z")
+BUYER = with_checksum("29PQRST6789K1Z")
+BUYER_MH = with_checksum("27PQRST6789K1Z")
+
+BASE_INVOICE = {
+    "invoice_id": "INV1", "invoice_date": "2024-06-01",
+    "seller_name": "Seller", "seller_state": "Karnataka", "seller_gstin": SELLER,
+    "buyer_name": "Buyer", "buyer_state": "Karnataka", "buyer_gstin": BUYER,
+    "sub_total": 1000.0, "cgst_total": 90.0, "sgst_total": 90.0, "igst_total": 0.0,
+    "total_tax": 180.0, "grand_total": 1180.0, "payment_method": "UPI",
+}
+BASE_ITEM = {
+    "invoice_id": "INV1", "description": "Laptop", "quantity": 1, "unit_price": 1000.0,
+    "total_price": 1000.0, "hsn_code": "8471", "item_category": "Goods",
+    "cgst_rate": 9.0, "sgst_rate": 9.0, "igst_rate": 0.0, "tax_amount": 180.0,
+}
+
+
+def insert(invoice: dict = None, item: dict = None, invoice_id: str = "INV1"):
+    invoice = dict(BASE_INVOICE, **(invoice or {}), invoice_id=invoice_id)
+    item = dict(BASE_ITEM, **(item or {}), invoice_id=invoice_id)
+    conn = sqlite3.connect(engine.url.database)
+    conn.execute(
+        f"INSERT INTO invoices ({INVOICE_COLUMNS}) VALUES ({','.join('?' * 15)})",
+        [invoice[c.strip()] for c in INVOICE_COLUMNS.split(",")],
+    )
+    conn.execute(
+        f"INSERT INTO invoice_items ({ITEM_COLUMNS}) VALUES ({','.join('?' * 11)})",
+        [item[c.strip()] for c in ITEM_COLUMNS.split(",")],
+    )
+    conn.commit()
+    conn.close()
+
+
+def violations(report: dict) -> dict:
+    return {name: v["violations"] for name, v in report["checks"].items() if v["violations"]}
+
+
+def test_gstin_checksum():
+    valid = np.array(["27AAPFU0939F1ZV", SELLER, BUYER])
+    assert gstin_valid(valid).all()
+
+    invalid = np.array([
+        "27AAPFU0939F1ZW",   # wrong check character
+        "27AAPFU0939F1Z",    # too short
+        "2XAAPFU0939F1ZV",   # state code not numeric
+        "27AAPFU0939F1YV",   # 14th character must be Z
+        "URP", "",
+    ])
+    assert not gstin_valid(invalid).any()
+
+
+def test_clean_invoice_has_no_violations(invoice_db):
+    insert()
+    assert violations(run_checks()) == {}
+
+
+@pytest.mark.parametrize("check, invoice, item", [
+    ("igst_on_intra_state", {"cgst_total": 0.0, "sgst_total": 0.0, "igst_total": 180.0},
+     {"cgst_rate": 0.0, "sgst_rate": 0.0, "igst_rate": 18.0}),
+    ("cgst_sgst_on_inter_state", {"buyer_state": "Maharashtra", "buyer_gstin": BUYER_MH}, {}),
+    ("cgst_sgst_unequal", {"cgst_total": 100.0, "sgst_total": 80.0},
+     {"cgst_rate": 10.0, "sgst_rate": 8.0}),
+    ("tax_amount_mismatch", {"cgst_total": 125.0, "sgst_total": 125.0, "total_tax": 250.0,
+                             "grand_total": 1250.0}, {"tax_amount": 250.0}),
+    ("invalid_gst_slab", {"cgst_total": 85.0, "sgst_total": 85.0, "total_tax": 170.0,
+                          "grand_total": 1170.0}, {"cgst_rate": 8.5, "sgst_rate": 8.5, "tax_amount": 170.0}),
+    ("totals_mismatch", {"grand_total": 2000.0}, {}),
+    ("tax_split_mismatch", {"cgst_total": 100.0}, {}),
+    ("line_items_mismatch", {"sub_total": 900.0, "grand_total": 1080.0}, {}),
+    ("invalid_seller_gstin", {"seller_gstin": SELLER[:-1] + ("0" if SELLER[-1] != "0" else "1")}, {}),
+    ("invalid_buyer_gstin", {"buyer_gstin": BUYER[:-1] + ("0" if BUYER[-1] != "0" else "1")}, {}),
+    ("gstin_state_mismatch", {"seller_state": "Maharashtra"}, {}),
+])
+def test_each_check_flags_its_violation(invoice_db, check, invoice, item):
+    insert(invoice, item)
+    assert violations(run_checks()) == {check: 1}
+
+
+def test_hsn_rate_outlier(invoice_db):
+    for n in range(3):
+        insert(invoice_id=f"INV{n}")
+    insert({"cgst_total": 60.0, "sgst_total": 60.0, "total_tax": 120.0, "grand_total": 1120.0},
+           {"cgst_rate": 6.0, "sgst_rate": 6.0, "tax_amount": 120.0}, invoice_id="ODD")
+    report = run_checks()
+    assert violations(report) == {"hsn_rate_outlier": 1}
+    assert report["flags"][0]["invoice_id"] == "ODD"
+
+
+@pytest.mark.parametrize("buyer_gstin", ["URP", "", "NA"])
+def test_unregistered_buyer_uses_state_name(invoice_db, buyer_gstin):
+    # B2C sale inside Karnataka: CGST/SGST is right, whatever the GSTIN field holds
+    insert({"buyer_gstin": buyer_gstin})
+    found = violations(run_checks())
+    assert "cgst_sgst_on_inter_state" not in found
+    assert "igst_on_intra_state" not in found
+
+
+def test_flag_rows_capped_but_counts_exact(invoice_db):
+    for n in range(5):
+        insert({"grand_total": 2000.0}, invoice_id=f"INV{n}")
+    report = run_checks(["totals_mismatch"], max_flags=2)
+    assert report["checks"]["totals_mismatch"]["violations"] == 5
+    assert len(report["flags"]) == 2
+
+
+def test_report_cache_keeps_several_selections(invoice_db, monkeypatch):
+    insert()
+    calls = []
+    real_run_checks = compliance_checks.run_checks
+
+    def counting_run_checks(checks=None):
+        calls.append(checks)
+        return real_run_checks(checks)
+
+    monkeypatch.setattr(compliance_checks, "run_checks", counting_run_checks)
+    compliance_checks._report_cache.clear()
+
+    for _ in range(3):
+        get_compliance_report(["totals_mismatch"])
+        get_compliance_report(["invalid_seller_gstin"])
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Total tax collected per seller in 2023", []),
+    ("What is the GST rate on cement?", []),
+    ("Which invoices charged IGST on intra-state supplies?", ["igst_on_intra_state"]),
+    ("Are all invoices compliant?", list(compliance_checks.CHECKS)),
+])
+def test_checks_for_query(query, expected):
+    assert checks_for_query(query) == expected
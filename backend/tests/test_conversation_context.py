@@ -0,0 +1,99 @@
+import pytest
+
+from conversation_context import (
+    SessionState, SessionStore, is_follow_up, patch_sql_period, mentioned_period, wants_same_data
+)
+
+JANUARY_SQL = (
+    "SELECT buyer_name, SUM(grand_total) FROM invoices "
+    "WHERE invoice_date BETWEEN '2024-01-01' AND '2024-01-31' GROUP BY buyer_name"
+)
+
+
+@pytest.fixture
+def structured_turn():
+    return SessionState("s1", query_type="STRUCTURED_QUERY", last_query="Top buyers in January 2024",
+                        sql_query=JANUARY_SQL, query_result=[], turns=1)
+
+
+@pytest.fixture
+def rules_turn():
+    return SessionState("s2", query_type="UNSTRUCTURED_QUERY",
+                        last_query="Explain the rules for input tax credit", turns=1)
+
+
+@pytest.mark.parametrize("query", [
+    "and for March?",
+    "what about February 2024?",
+    "same for 2023",
+    "explain those",
+    "why is that?",
+    "for March?",
+    "only Karnataka sellers",
+])
+def test_follow_ups(structured_turn, query):
+    assert is_follow_up(query, structured_turn)
+
+
+@pytest.mark.parametrize("query", [
+    "Show the top 10 buyers in 2023",
+    "Total tax collected per seller in 2023",
+    "How many invoices in March 2024?",
+    "What is the GST rate on cement?",
+    # Reference words inside ordinary questions
+    "Which GST rule applies to goods that are exported?",
+    "Is the GST rate the same for services?",
+    "List invoices above 10000",
+])
+def test_new_questions_are_not_follow_ups(structured_turn, query):
+    assert not is_follow_up(query, structured_turn)
+
+
+def test_period_after_rules_question_is_reclassified(rules_turn):
+    assert not is_follow_up("How many invoices in March 2024?", rules_turn)
+    assert not is_follow_up("and in March 2024?", rules_turn)
+    assert is_follow_up("what about reverse charge?", rules_turn)
+
+
+def test_period_needs_a_patchable_previous_query(structured_turn):
+    structured_turn.sql_query = "SELECT * FROM invoices ORDER BY invoice_date DESC LIMIT 20"
+    assert not is_follow_up("and for March?", structured_turn)
+
+
+def test_first_turn_is_never_a_follow_up():
+    assert not is_follow_up("and for March?", SessionState("s3"))
+
+
+def test_patch_moves_month_and_month_end():
+    patched = patch_sql_period(JANUARY_SQL, "and for February?")
+    assert "BETWEEN '2024-02-01' AND '2024-02-29'" in patched
+
+
+def test_patch_year_only():
+    sql = "SELECT COUNT(*) FROM invoices WHERE strftime('%Y', invoice_date) = '2024'"
+    assert patch_sql_period(sql, "same for 2023").endswith("= '2023'")
+
+
+def test_mentioned_period_ignores_the_verb_may():
+    assert mentioned_period("may I see the totals") == (None, None)
+    assert mentioned_period("and in May 2023?") == (5, 2023)
+
+
+def test_wants_same_data():
+    assert wants_same_data("explain those")
+    assert not wants_same_data("explain those for March")
+
+
+def test_session_ids_are_minted_server_side():
+    store = SessionStore()
+    state = store.get_or_create("client-chosen-id")
+    assert state.session_id != "client-chosen-id"
+    assert store.get_or_create(state.session_id) is state
+
+
+def test_record_turn_updates_under_the_lock():
+    state = SessionState("s4")
+    snapshot = state.snapshot()
+    state.record_turn(query_type="STRUCTURED_QUERY", sql_query=JANUARY_SQL)
+    assert (state.turns, state.sql_query) == (1, JANUARY_SQL)
+    assert snapshot.turns == 0 and snapshot.sql_query is None
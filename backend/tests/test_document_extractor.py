@@ -0,0 +1,106 @@
+import io
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+import document_extractor
+from document_extractor import chunk_text, iter_chunks, iter_pdf_pages, iter_text
+from simple_vector_store import base_doc_id, chunk_id
+
+
+def make_pdf(page_texts: list) -> bytes:
+    """A PDF with one Helvetica line per page; "" gives a page with no text layer."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for text in page_texts:
+        page = writer.add_blank_page(612, 792)
+        if not text:
+            continue
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 10 Tf 20 700 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    calls = []
+
+    def extract_with_model(file_bytes, mime_type):
+        calls.append(len(PdfReader(io.BytesIO(file_bytes)).pages))
+        return f"Scanned page text number {len(calls)}"
+
+    monkeypatch.setattr(document_extractor, "extract_with_model", extract_with_model)
+    return calls
+
+
+def test_chunk_ids_round_trip():
+    assert chunk_id("notice.pdf", 7) == "notice.pdf#chunk0007"
+    assert base_doc_id(chunk_id("notice.pdf", 12345)) == "notice.pdf"
+    assert base_doc_id("circular#0042") == "circular#0042"
+    assert base_doc_id("notice#2023.pdf") == "notice#2023.pdf"
+
+
+def test_chunks_respect_size_and_overlap():
+    text = " ".join(f"Sentence {i} about input tax credit." for i in range(200))
+    chunks = chunk_text(text, max_chars=300, overlap=50)
+    assert all(len(c) <= 300 for c in chunks)
+    assert all(c.endswith(".") for c in chunks)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous[-30:] in current
+
+
+def test_chunking_pages_matches_chunking_the_joined_text():
+    pages = [f"Page {p}. " + " ".join(f"Rule {p}.{i} applies." for i in range(40)) for p in range(5)]
+    assert list(iter_chunks(pages, 400, 40)) == chunk_text("\n\n".join(pages), 400, 40)
+    assert list(iter_chunks(["", "  "])) == []
+
+
+def test_text_pages_are_parsed_locally(fake_ocr):
+    pdf = make_pdf(["GST rule one applies to all taxable supplies",
+                    "GST rule two covers reverse charge on services"])
+    assert [t for _, t in iter_pdf_pages(pdf)] == [
+        "GST rule one applies to all taxable supplies",
+        "GST rule two covers reverse charge on services",
+    ]
+    assert fake_ocr == []
+
+
+def test_pages_without_text_go_to_the_model_one_at_a_time(fake_ocr):
+    pdf = make_pdf(["GST rule one applies to all taxable supplies", "", ""])
+    pages = list(iter_text(pdf, "application/pdf"))
+    assert pages == [
+        "GST rule one applies to all taxable supplies",
+        "Scanned page text number 1",
+        "Scanned page text number 2",
+    ]
+    assert fake_ocr == [1, 1]
+
+
+def test_large_pdfs_use_the_shared_pool(fake_ocr, monkeypatch):
+    monkeypatch.setattr(document_extractor, "PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(document_extractor, "EXTRACT_WORKERS", 2)
+    texts = [f"Notification {n} amends the rate schedule for services" for n in range(6)]
+    pdf = make_pdf(texts[:5] + [""])
+
+    pages = [t for _, t in iter_pdf_pages(pdf)]
+    assert pages == texts[:5] + ["Scanned page text number 1"]
+    assert document_extractor._pdf_pool is not None and document_extractor._pdf_pool._processes
+
+
+def test_unreadable_pdf_falls_back_to_the_whole_file(fake_ocr, monkeypatch):
+    sent = []
+    monkeypatch.setattr(document_extractor, "extract_with_model",
+                        lambda file_bytes, mime_type: sent.append(mime_type) or "model text")
+    assert list(iter_text(b"%PDF-1.4 truncated", "application/pdf")) == ["model text"]
+    assert sent == ["application/pdf"]
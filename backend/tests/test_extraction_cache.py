@@ -0,0 +1,84 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from database import engine
+from extraction_cache import ExtractionCache, get_extraction_cache, rematerialize
+from structured_agent import EXTRACTION_VERSION
+
+
+def invoice(invoice_id: str, grand_total: float = 1180.0) -> dict:
+    return {
+        "invoice_id": invoice_id, "invoice_date": "2024-06-01",
+        "seller_name": "Seller", "seller_gstin": "29ABCDE1234F1Z5",
+        "buyer_name": "Buyer", "sub_total": 1000.0, "total_tax": 180.0, "grand_total": grand_total,
+        "items": [{"description": "Laptop", "quantity": 1, "total_price": 1000.0, "tax_amount": 180.0}],
+    }
+
+
+@pytest.fixture
+def cache():
+    shared = get_extraction_cache()
+    shutil.rmtree(shared.root, ignore_errors=True)
+    return shared
+
+
+def _live_totals() -> dict:
+    conn = sqlite3.connect(engine.url.database)
+    try:
+        return dict(conn.execute("SELECT invoice_id, grand_total FROM invoices"))
+    finally:
+        conn.close()
+
+
+def test_versions_are_separate_namespaces(tmp_path):
+    store = ExtractionCache(str(tmp_path))
+    store.put("ab" * 32, "v1-aaaa", invoice("A"))
+    store.put("ab" * 32, "v2-bbbb", invoice("B"))
+
+    assert store.get("ab" * 32, "v1-aaaa")["invoice_id"] == "A"
+    assert store.get("ab" * 32, "v2-bbbb")["invoice_id"] == "B"
+    assert store.get("ab" * 32, "v3-cccc") is None
+    assert store.versions() == ["v1-aaaa", "v2-bbbb"]
+    assert [e["data"]["invoice_id"] for e in store.iter_entries("v1-aaaa")] == ["A"]
+
+
+def test_extraction_version_tracks_schema_and_prompt():
+    assert EXTRACTION_VERSION.startswith("v") and len(EXTRACTION_VERSION.split("-")[1]) == 8
+
+
+def test_rejected_mark_is_kept_and_cleared(tmp_path):
+    store = ExtractionCache(str(tmp_path))
+    store.put("cd" * 32, "v1", invoice("A"))
+    store.mark_rejected("cd" * 32, "v1", {"invoice_id": "ORIG", "reason": "near-duplicate content"})
+
+    entry, = store.iter_entries("v1")
+    assert entry["rejected_as_duplicate_of"]["invoice_id"] == "ORIG"
+    assert store.get("cd" * 32, "v1")["invoice_id"] == "A"
+
+    store.mark_rejected("cd" * 32, "v1", None)
+    entry, = store.iter_entries("v1")
+    assert "rejected_as_duplicate_of" not in entry
+
+
+def test_rematerialize_skips_rejected_duplicates(invoice_db, cache):
+    cache.put("01" * 32, EXTRACTION_VERSION, invoice("ORIG"))
+    cache.put("02" * 32, EXTRACTION_VERSION, invoice("COPY"))
+    cache.mark_rejected("02" * 32, EXTRACTION_VERSION, {"invoice_id": "ORIG"})
+
+    summary = rematerialize()
+    assert (summary["saved"], summary["rejected"]) == (1, 1)
+    assert set(_live_totals()) == {"ORIG"}
+
+
+def test_rematerialize_keeps_existing_unless_replace(invoice_db, cache):
+    cache.put("03" * 32, EXTRACTION_VERSION, invoice("INV1", grand_total=1180.0))
+    assert rematerialize()["saved"] == 1
+
+    cache.put("03" * 32, EXTRACTION_VERSION, invoice("INV1", grand_total=1200.0))
+    assert rematerialize()["skipped"] == 1
+    assert _live_totals() == {"INV1": 1180.0}
+
+    assert rematerialize(replace=True)["saved"] == 1
+    assert _live_totals() == {"INV1": 1200.0}
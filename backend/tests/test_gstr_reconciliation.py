@@ -0,0 +1,85 @@
+import pytest
+
+from gstr_reconciliation import (
+    FUZZY_MATCHED, MATCHED, MISMATCH, MISSING_IN_BOOKS, MISSING_IN_SUPPLIER, PROBABLE_MATCH,
+    _normalize_record, normalize_invoice_no, reconcile_bucket
+)
+
+GSTIN = "29ABCDE1234F1Z5"
+
+
+def record(invoice_no, invoice_date="2024-06-01", value=1180.0, tax=180.0, gstin=GSTIN):
+    return _normalize_record({
+        "gstin": gstin, "invoice_no": invoice_no, "invoice_date": invoice_date,
+        "taxable_value": value - tax, "tax": tax, "invoice_value": value,
+    })
+
+
+def statuses(report):
+    return sorted((r["status"], r["book_invoice_no"], r["supplier_invoice_no"]) for r in report)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("inv/0042", "INV-42"),
+    ("INV 042", "INV42"),
+    ("2023/0042", "2023/42"),
+    ("GST/23-24/007", "gst-23-24-7"),
+    ("000", "0"),
+])
+def test_equivalent_invoice_numbers_share_a_key(a, b):
+    assert normalize_invoice_no(a) == normalize_invoice_no(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("1-23", "12-3"),
+    ("INV-10", "INV-1"),
+    ("2023/0042", "20230042"),
+])
+def test_distinct_invoice_numbers_keep_distinct_keys(a, b):
+    assert normalize_invoice_no(a) != normalize_invoice_no(b)
+
+
+@pytest.mark.parametrize("value", [None, "", " / - "])
+def test_blank_invoice_numbers_give_a_blank_key(value):
+    assert normalize_invoice_no(value) == ""
+
+
+def test_exact_match_and_mismatch():
+    books = [record("INV-1"), record("INV-2", tax=200.0)]
+    suppliers = [record("inv/001"), record("INV-02")]
+    assert statuses(reconcile_bucket(books, suppliers)) == [
+        (MATCHED, "INV-1", "inv/001"),
+        (MISMATCH, "INV-2", "INV-02"),
+    ]
+
+
+def test_fuzzy_and_probable_matches():
+    books = [record("INV-1001", value=500.0, tax=50.0), record("ABC", value=900.0, tax=90.0)]
+    suppliers = [
+        record("INV-1010", "2024-06-03", value=500.5, tax=50.0),
+        record("XYZ-77", "2024-06-02", value=900.0, tax=90.0),
+    ]
+    assert statuses(reconcile_bucket(books, suppliers)) == [
+        (FUZZY_MATCHED, "INV-1001", "INV-1010"),
+        (PROBABLE_MATCH, "ABC", "XYZ-77"),
+    ]
+
+
+def test_blank_invoice_numbers_skip_the_exact_pass():
+    # Two unrelated invoices without numbers must not be paired by their empty key
+    books = [record("", value=500.0), record("INV-9", value=700.0)]
+    suppliers = [record(None, value=2000.0), record("", "2024-06-02", value=700.0)]
+    assert statuses(reconcile_bucket(books, suppliers)) == [
+        (MISSING_IN_BOOKS, "", ""),
+        (MISSING_IN_SUPPLIER, "", ""),
+        (PROBABLE_MATCH, "INV-9", ""),
+    ]
+
+
+def test_other_gstins_are_never_paired():
+    books = [record("INV-1")]
+    suppliers = [record("INV-1", gstin="27ABCDE1234F1Z5")]
+    assert statuses(reconcile_bucket(books, suppliers)) == [
+        (MISSING_IN_BOOKS, "", "INV-1"),
+        (MISSING_IN_SUPPLIER, "INV-1", ""),
+    ]
@@ -0,0 +1,112 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import insert_invoices
+from invoice_dedup import (
+    INDEX_VERSION, NEAR_DUPLICATE_THRESHOLD, InvoiceDedupIndex, file_sha256, invoice_text,
+    minhash_signature
+)
+
+
+def rent_invoice(invoice_id="RENT/2024/04", invoice_date="2024-04-01", **changes) -> dict:
+    data = {
+        "invoice_id": invoice_id, "invoice_date": invoice_date,
+        "seller_name": "Prestige Estates", "seller_gstin": "29ABCDE1234F1Z5",
+        "buyer_name": "Acme Pvt Ltd", "buyer_gstin": "29PQRST6789K1Z1",
+        "grand_total": 59000.0, "total_tax": 9000.0,
+        "items": [{"description": "Office rent for the month", "hsn_code": "997212",
+                   "quantity": 1, "total_price": 50000.0, "tax_amount": 9000.0}],
+    }
+    data.update(changes)
+    return data
+
+
+@pytest.fixture
+def index(invoice_db, tmp_path):
+    built = InvoiceDedupIndex(str(tmp_path / "dedup.pkl"))
+    built.add("RENT/2024/04", rent_invoice(), file_sha256(b"april scan"))
+    return built
+
+
+def _similarity(a: dict, b: dict) -> float:
+    return float(np.mean(minhash_signature(invoice_text(a)) == minhash_signature(invoice_text(b))))
+
+
+def _jaccard(a: dict, b: dict) -> float:
+    def shingles(text):
+        return {text[i:i + 5] for i in range(len(text) - 4)}
+    sa, sb = shingles(invoice_text(a)), shingles(invoice_text(b))
+    return len(sa & sb) / len(sa | sb)
+
+
+def test_minhash_estimates_jaccard_similarity():
+    assert _similarity(rent_invoice(), rent_invoice()) == 1.0
+    for invoice_id in ("RENT/2024/O4", "RENT 2024 04", "RENT/2024/04-A", "R-24-4"):
+        other = rent_invoice(invoice_id)
+        assert _similarity(rent_invoice(), other) == pytest.approx(_jaccard(rent_invoice(), other), abs=0.15)
+    unrelated = rent_invoice("X-1", "2023-01-15", seller_name="Other Traders", grand_total=120.0,
+                             items=[{"description": "Printer toner", "hsn_code": "8443", "total_price": 100}])
+    assert _similarity(rent_invoice(), unrelated) < 0.3
+
+
+def test_same_file_is_found_by_hash(index):
+    assert index.lookup_file(file_sha256(b"april scan")) == "RENT/2024/04"
+    assert index.lookup_file(file_sha256(b"may scan")) is None
+
+
+def test_same_invoice_id_is_a_hard_duplicate(index):
+    found = index.find_duplicate(rent_invoice(grand_total=1.0))
+    assert (found["reason"], found["soft"]) == ("same invoice_id", False)
+
+
+def test_rescan_with_new_id_matches_fingerprint(index):
+    found = index.find_duplicate(rent_invoice("RENT-2024-04"))
+    assert found["invoice_id"] == "RENT/2024/04"
+    assert found["reason"] == "same seller, date, total and line items" and not found["soft"]
+
+
+def test_ocr_noise_is_a_near_duplicate(index):
+    # Re-scan that misreads the invoice number and a line amount
+    noisy = rent_invoice("RENT/2024/04-A", items=[{
+        "description": "Office rent for the month", "hsn_code": "997212",
+        "quantity": 1, "total_price": 50008.0, "tax_amount": 9000.0,
+    }])
+    found = index.find_duplicate(noisy)
+    assert found["reason"] == "near-duplicate content" and not found["soft"]
+    assert found["similarity"] >= NEAR_DUPLICATE_THRESHOLD
+
+
+def test_recurring_invoice_is_not_a_duplicate(index):
+    # Next month's rent reads almost the same, but it is a new invoice
+    may = rent_invoice("RENT/2024/05", "2024-05-01")
+    assert _similarity(rent_invoice(), may) >= NEAR_DUPLICATE_THRESHOLD
+    assert index.find_duplicate(may) is None
+
+
+def test_same_header_with_other_items_is_soft(index):
+    other_items = rent_invoice("MAINT/77", items=[
+        {"description": "Maintenance charges", "hsn_code": "995419", "total_price": 50000.0},
+    ], seller_name="Prestige Estates Facility Desk", buyer_name="Acme Private Limited Finance")
+    found = index.find_duplicate(other_items)
+    assert found["reason"] == "same seller, date and total" and found["soft"]
+
+
+def test_log_is_replayed_on_load(index):
+    index.add("RENT/2024/05", rent_invoice("RENT/2024/05", "2024-05-01"), file_sha256(b"may scan"))
+    reloaded = InvoiceDedupIndex(index.path)
+    assert reloaded.lookup_file(file_sha256(b"may scan")) == "RENT/2024/05"
+    assert reloaded.find_duplicate(rent_invoice("RENT/2024/05", "2024-05-01"))["invoice_id"] == "RENT/2024/05"
+
+
+def test_older_index_is_rebuilt_keeping_file_hashes(invoice_db, tmp_path):
+    insert_invoices([("INV1", "2024-06-01", 1000.0)])
+    path = str(tmp_path / "old.pkl")
+    with open(path, "wb") as f:
+        pickle.dump({"file_hashes": {"abc": "INV1"}, "invoice_ids": set(), "signatures": {}}, f)
+
+    rebuilt = InvoiceDedupIndex(path)
+    assert rebuilt.data["version"] == INDEX_VERSION
+    assert rebuilt.lookup_file("abc") == "INV1"
+    assert rebuilt.find_duplicate({"invoice_id": "INV1"})["reason"] == "same invoice_id"
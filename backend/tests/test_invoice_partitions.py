@@ -0,0 +1,140 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import invoice_partitions
+from conftest import insert_invoices
+from database import engine
+from invoice_partitions import (
+    archive_financial_year, archive_closed_periods, attach_partitions, archived_invoice_ids,
+    closed_financial_years, date_range_from_sql, late_rows_in_archived_years, load_manifest
+)
+from sql_guard import run_guarded_query
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM invoices WHERE invoice_date BETWEEN '2022-06-01' AND '2022-06-30'",
+     ("2022-06-01", "2022-06-30")),
+    ("SELECT * FROM invoices i WHERE i.invoice_date >= '2023-04-01' AND i.invoice_date < '2023-05-01'",
+     ("2023-04-01", "2023-05-01")),
+    ("SELECT * FROM invoices WHERE strftime('%Y', invoice_date) = '2022'",
+     ("2022-01-01", "2022-12-31")),
+    ("SELECT * FROM invoices WHERE invoice_date >= '2022-01-01' AND invoice_date >= '2023-01-01'",
+     ("2023-01-01", None)),
+])
+def test_date_range_from_sql(sql, expected):
+    assert date_range_from_sql(sql) == expected
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM invoices",
+    "SELECT * FROM invoices WHERE invoice_date >= '2023-01-01' OR grand_total > 100",
+    "SELECT * FROM invoices WHERE seller_name = 'invoice_date >= ''2023-01-01'''",
+    "SELECT * FROM invoice_items it JOIN invoices i ON i.invoice_id = it.invoice_id "
+    "JOIN (SELECT invoice_id, invoice_date FROM other) o ON o.invoice_id = i.invoice_id "
+    "WHERE o.invoice_date >= '2023-01-01'",
+])
+def test_unbounded_or_unsafe_predicates_scan_everything(sql):
+    assert date_range_from_sql(sql) is None
+
+
+@pytest.fixture
+def archived_db(invoice_db):
+    # FY 2021-22 .. 2023-24, the first two archived
+    rows = invoice_db(300)
+    archive_financial_year("2021-22", force=True)
+    archive_financial_year("2022-23", force=True)
+    return rows
+
+
+def test_routes_to_partitions_in_range(archived_db):
+    conn = sqlite3.connect(f"file:{engine.url.database}?mode=ro", uri=True)
+    try:
+        attached = attach_partitions(
+            conn, "SELECT * FROM invoices WHERE invoice_date BETWEEN '2022-06-01' AND '2022-06-30'"
+        )
+    finally:
+        conn.close()
+    assert set(attached) == {"p0.invoices", "p0.invoice_items"}
+
+
+def test_live_only_ranges_attach_nothing(archived_db):
+    conn = sqlite3.connect(f"file:{engine.url.database}?mode=ro", uri=True)
+    try:
+        assert attach_partitions(conn, "SELECT * FROM invoices WHERE invoice_date >= '2023-06-01'") == {}
+    finally:
+        conn.close()
+
+
+def test_results_include_archived_rows(archived_db):
+    in_june_2022 = [r for r in archived_db if "2022-06-01" <= r[1] <= "2022-06-30"]
+    result = run_guarded_query(
+        "SELECT COUNT(*) AS n FROM invoices WHERE invoice_date BETWEEN '2022-06-01' AND '2022-06-30'"
+    )
+    assert result.rows == [{"n": len(in_june_2022)}]
+
+    everything = run_guarded_query("SELECT COUNT(*) AS n FROM invoices")
+    assert everything.rows == [{"n": len(archived_db)}]
+
+
+def test_archived_invoice_ids(archived_db):
+    archived = {r[0] for r in archived_db if r[1] < "2023-04-01"}
+    live = {r[0] for r in archived_db if r[1] >= "2023-04-01"}
+    assert archived_invoice_ids(sorted(archived | live)) == archived
+
+
+def _count(sql="SELECT COUNT(*) AS n FROM invoices"):
+    return run_guarded_query(sql).rows[0]["n"]
+
+
+def test_closed_years_skip_empty_and_archived_years(invoice_db):
+    # Nothing dated in FY 2022-23
+    insert_invoices([("A1", "2021-06-01", 100.0), ("A2", "2023-06-01", 100.0)])
+    assert closed_financial_years(date(2026, 1, 1)) == ["2021-22", "2023-24"]
+
+    archive_financial_year("2021-22", force=True)
+    assert closed_financial_years(date(2026, 1, 1)) == ["2023-24"]
+
+
+def test_late_invoice_in_archived_year_is_reported_not_rearchived(invoice_db):
+    invoice_db(100, start=date(2021, 4, 1), end=date(2022, 4, 1))
+    archive_closed_periods(date(2026, 1, 1))
+    insert_invoices([("LATE1", "2021-09-15", 100.0)])
+
+    assert late_rows_in_archived_years() == {"2021-22": 1}
+    assert archive_closed_periods(date(2026, 1, 1)) == []
+    assert _count() == 101
+
+
+def test_rerun_reuses_partition_left_before_registration(invoice_db, monkeypatch):
+    invoice_db(100, start=date(2021, 4, 1), end=date(2022, 4, 1))
+    monkeypatch.setattr(invoice_partitions, "_save_manifest", _crash)
+    with pytest.raises(RuntimeError):
+        archive_financial_year("2021-22", force=True)
+    monkeypatch.undo()
+
+    # Live rows are untouched and the orphaned file is picked up
+    assert load_manifest() == [] and _count() == 100
+    entry = archive_financial_year("2021-22", force=True)
+    assert entry["invoices"] == 100 and "pending" not in entry
+    assert _count() == 100
+
+
+def test_pending_partition_counts_rows_once_and_resumes(invoice_db, monkeypatch):
+    invoice_db(100, start=date(2021, 4, 1), end=date(2022, 4, 1))
+    monkeypatch.setattr(invoice_partitions, "_delete_live_rows", _crash)
+    with pytest.raises(RuntimeError):
+        archive_financial_year("2021-22", force=True)
+    monkeypatch.undo()
+
+    assert load_manifest()[0]["pending"]
+    assert _count() == 100
+
+    archive_closed_periods(date(2026, 1, 1))
+    assert "pending" not in load_manifest()[0]
+    assert _count() == 100
+
+
+def _crash(*args, **kwargs):
+    raise RuntimeError("simulated crash")
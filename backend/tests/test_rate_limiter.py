@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+import rate_limiter
+import unstructured_agent
+from model_provider import ModelProviderError
+from rate_limiter import SingleFlight, TokenBucket, call_with_retry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock.slept
+
+
+def test_bucket_allows_burst_then_waits(no_sleep):
+    bucket = TokenBucket("test", rate_per_minute=60, burst_seconds=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert no_sleep == []
+
+    bucket.acquire()
+    assert len(no_sleep) == 1 and 0 < no_sleep[0] <= 1.0
+
+
+def test_bucket_halves_on_throttle_and_recovers():
+    bucket = TokenBucket("test", rate_per_minute=600)
+    bucket.penalize()
+    bucket.penalize()
+    assert bucket.rate == pytest.approx(bucket.max_rate / 4)
+    assert bucket.tokens <= 0
+
+    for _ in range(10):
+        bucket.penalize()
+    assert bucket.rate == pytest.approx(bucket.min_rate)
+
+    for _ in range(100):
+        bucket.reward()
+    assert bucket.rate == pytest.approx(bucket.max_rate)
+
+
+def _failing(errors: list):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+    return fn, calls
+
+
+def test_retries_transient_errors(no_sleep):
+    fn, calls = _failing([ModelProviderError("busy", code=503), TimeoutError()])
+    assert call_with_retry(fn) == "ok"
+    assert len(calls) == 3 and len(no_sleep) == 2
+
+
+def test_does_not_retry_permanent_errors(no_sleep):
+    fn, calls = _failing([ModelProviderError("bad request", code=400)])
+    with pytest.raises(ModelProviderError):
+        call_with_retry(fn)
+    assert len(calls) == 1
+
+
+def test_raises_after_last_attempt(no_sleep):
+    fn, calls = _failing([ModelProviderError("busy", code=503)] * 5)
+    with pytest.raises(ModelProviderError):
+        call_with_retry(fn, max_attempts=3)
+    assert len(calls) == 3
+
+
+def test_rate_limited_error_penalizes_bucket(no_sleep):
+    bucket = TokenBucket("test", rate_per_minute=600)
+    fn, _ = _failing([ModelProviderError("quota", code=429)])
+    assert call_with_retry(fn, bucket) == "ok"
+    assert bucket.rate < bucket.max_rate
+
+
+def test_single_flight_shares_one_call(monkeypatch):
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls, results, joined = [], [], []
+    # Followers report a hit once they are attached to the leader's call
+    monkeypatch.setattr(rate_limiter, "cache_hit", lambda name, hit: hit and joined.append(1))
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "shared"
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    while len(joined) < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(5)
+    assert results == ["shared"] * 4
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight("test")
+
+    def fails():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("k", fails)
+    assert flight._calls == {}
+
+
+def test_embedding_failures_are_raised(monkeypatch):
+    class FailingBatcher:
+        def embed(self, texts, task_type):
+            raise ModelProviderError("quota", code=429)
+
+    monkeypatch.setattr(unstructured_agent, "get_batcher", lambda: FailingBatcher())
+    with pytest.raises(ModelProviderError):
+        unstructured_agent.get_embeddings(["passage"])
+    with pytest.raises(ModelProviderError):
+        unstructured_agent.ingest_document_text("doc.txt", "Some GST rule text.")
+    assert "error" in unstructured_agent.process_unstructured_query("What is ITC?")
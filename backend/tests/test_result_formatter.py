@@ -0,0 +1,49 @@
+from datetime import date
+
+from result_formatter import estimate_tokens, summarize_rows
+
+
+def test_small_results_are_rendered_verbatim():
+    rows = [{"invoice_id": "INV1", "grand_total": 1180.0, "invoice_date": date(2024, 6, 1)}]
+    assert summarize_rows(rows) == (
+        "rows: 1\n"
+        "invoice_id:str | grand_total:float | invoice_date:date\n"
+        "INV1|1180|2024-06-01"
+    )
+
+
+def test_large_results_are_sampled_with_aggregates():
+    rows = [{"seller": f"S{i % 3}", "total": float(i)} for i in range(100)]
+    summary = summarize_rows(rows, max_rows=10)
+    lines = summary.splitlines()
+    assert lines[0] == "rows: 100, showing 10 sampled rows"
+    assert "aggregates over all 100 rows:" in lines
+    assert "total: sum=4950 min=0 max=99 avg=49.5" in lines
+    assert "seller: S0=34, S1=33, S2=33" in lines
+
+
+def test_capped_results_say_so():
+    rows = [{"n": i} for i in range(50)]
+    summary = summarize_rows(rows, max_rows=10, truncated=True, total_rows=1000)
+    assert summary.startswith("rows: 50 of 1000 (row cap reached), showing 10 sampled rows")
+    assert "aggregates over the first 50 rows only (result was capped):" in summary
+
+
+def test_mixed_type_columns_only_aggregate_numbers():
+    # SQLite lets a numeric column hold NULLs, numeric text and booleans
+    values = [10, None, "12.5", 20.0, 30, True] * 10
+    rows = [{"amount": v} for v in values]
+    summary = summarize_rows(rows, max_rows=10)
+    assert "amount: sum=600 min=10 max=30 avg=20 (20 non-numeric values skipped)" in summary
+
+
+def test_text_column_after_numeric_first_value():
+    rows = [{"code": 8471}] + [{"code": f"HSN{i % 3}"} for i in range(60)]
+    summary = summarize_rows(rows, max_rows=10)
+    assert "code: HSN0=20, HSN1=20, HSN2=20, 8471=1" in summary
+
+
+def test_errors_and_empty_results_pass_through():
+    assert summarize_rows("Error: no such table") == "Error: no such table"
+    assert summarize_rows([]) == "No data found"
+    assert estimate_tokens("") == 0 and estimate_tokens("abcdefgh") == 2
@@ -0,0 +1,72 @@
+import numpy as np
+
+from result_formatter import CHARS_PER_TOKEN
+from retrieval import RetrievalConfig, lexical_overlap, mmr_order, pack_chunks, query_terms, retrieve
+from simple_vector_store import SimpleVectorStore
+
+
+def chunk(chunk_id: str, tokens: int) -> dict:
+    return {"id": chunk_id, "document": "x" * (tokens * CHARS_PER_TOKEN), "score": 1.0}
+
+
+def unit(*values) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_query_terms_keep_section_references():
+    assert query_terms("Can ITC be claimed under section 16(2) for the 5 invoices?") == {
+        "itc", "claimed", "section", "16(2)", "5", "invoices"
+    }
+    assert lexical_overlap({"itc", "16(2)"}, "Section 16(2) lists the ITC conditions") == 1.0
+    assert lexical_overlap(set(), "anything") == 0.0
+
+
+def test_mmr_with_full_relevance_weight_keeps_relevance_order():
+    relevance = np.array([0.5, 0.9, 0.7], dtype=np.float32)
+    vectors = np.stack([unit(1, 0), unit(1, 0.01), unit(0, 1)])
+    assert mmr_order(relevance, vectors, mmr_lambda=1.0) == [1, 2, 0]
+
+
+def test_mmr_demotes_near_duplicates():
+    # Two chunks of one circular, then a different rule
+    relevance = np.array([0.90, 0.89, 0.80], dtype=np.float32)
+    vectors = np.stack([unit(1, 0), unit(1, 0.02), unit(0.2, 1)])
+    assert mmr_order(relevance, vectors, mmr_lambda=0.7) == [0, 2, 1]
+
+
+def test_pack_skips_chunks_that_do_not_fit():
+    ranked = [chunk("a", 600), chunk("b", 700), chunk("c", 300), chunk("d", 100)]
+    assert [c["id"] for c in pack_chunks(ranked, token_budget=1000, k=4)] == ["a", "c", "d"]
+
+
+def test_pack_stops_at_k():
+    ranked = [chunk(str(i), 10) for i in range(10)]
+    assert [c["id"] for c in pack_chunks(ranked, token_budget=1000, k=3)] == ["0", "1", "2"]
+
+
+def test_pack_trims_the_best_chunk_when_nothing_fits():
+    packed = pack_chunks([chunk("huge", 5000), chunk("big", 3000)], token_budget=100, k=4)
+    assert [c["id"] for c in packed] == ["huge"]
+    assert len(packed[0]["document"]) == 100 * CHARS_PER_TOKEN
+    assert pack_chunks([], token_budget=100, k=4) == []
+
+
+def test_retrieve_reranks_and_packs(tmp_path):
+    store = SimpleVectorStore(str(tmp_path / "store.pkl"))
+    store.upsert(
+        documents=[
+            "Section 16(2): conditions for claiming input tax credit.",
+            "Section 16(2): conditions for claiming input tax credit (repeat).",
+            "Reverse charge: input tax credit is available once the tax is paid.",
+            "Composition scheme dealers cannot collect tax.",
+        ],
+        embeddings=[[1, 0, 0], [1, 0.02, 0], [0.6, 0.8, 0], [0, 0, 1]],
+        ids=["itc#chunk0000", "itc#chunk0001", "rcm", "composition"],
+    )
+    config = RetrievalConfig(k=2, token_budget=1000, candidates=4, mmr_lambda=0.5)
+    ranked = retrieve(store, "input tax credit under 16(2)", [1, 0.1, 0], config)
+    # The second chunk of the same section loses its slot to the next rule
+    assert [c["id"] for c in ranked] == ["itc#chunk0001", "rcm"]
+    assert ranked[0]["score"] > ranked[1]["score"]
+    assert retrieve(SimpleVectorStore(str(tmp_path / "empty.pkl")), "itc", [1, 0, 0], config) == []
@@ -0,0 +1,49 @@
+import pytest
+
+import sql_guard
+from sql_guard import SQLGuardError, run_guarded_query, validate_select
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "DELETE FROM invoices",
+    "UPDATE invoices SET grand_total = 0",
+    "SELECT * FROM invoices; DROP TABLE invoices",
+    "PRAGMA table_info(invoices)",
+    "WITH x AS (SELECT 1) DELETE FROM invoices",
+    "ATTACH DATABASE 'other.db' AS other",
+])
+def test_rejects_anything_but_a_single_select(sql):
+    with pytest.raises(SQLGuardError):
+        validate_select(sql)
+
+
+def test_keywords_inside_literals_and_fences_are_allowed():
+    sql = "```sql\nSELECT * FROM invoices WHERE seller_name = 'DROP; DELETE' -- UPDATE\n;```"
+    assert validate_select(sql).startswith("SELECT * FROM invoices")
+
+
+def test_truncates_at_row_cap(invoice_db):
+    invoice_db(30)
+
+    capped = run_guarded_query("SELECT * FROM invoices", max_rows=10)
+    assert len(capped.rows) == 10
+    assert capped.truncated
+
+    exact = run_guarded_query("SELECT * FROM invoices", max_rows=30)
+    assert len(exact.rows) == 30
+    assert not exact.truncated
+
+
+def test_rejects_expensive_plan(invoice_db, monkeypatch):
+    invoice_db(30)
+    monkeypatch.setattr(sql_guard, "MAX_ESTIMATED_ROWS", 100)
+
+    with pytest.raises(SQLGuardError, match="too expensive"):
+        run_guarded_query("SELECT a.invoice_id FROM invoices a, invoices b")
+
+
+def test_aborts_queries_over_the_time_budget(invoice_db):
+    runaway = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT MAX(x) FROM c"
+    with pytest.raises(SQLGuardError, match="time budget"):
+        run_guarded_query(runaway, timeout_seconds=0.2)
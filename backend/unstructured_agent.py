@@ -1,93 +1,85 @@
 import os
-from dotenv import load_dotenv
-load_dotenv()
-from google import genai
-from google.genai import types
+import threading
+from model_provider import get_provider
+from simple_vector_store import SimpleVectorStore, chunk_id
+from document_extractor import iter_text, iter_chunks, chunk_text
+from embedding_batcher import get_batcher
+from telemetry import span
+from result_formatter import estimate_tokens
+from conversation_context import merge_chunks
+from retrieval import retrieve, pack_chunks, RAG_RETRIEVAL, RetrievalConfig
 
-# Initialize Gemini client
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY is not set in your environment!")
+VECTOR_STORE_PATH = os.getenv("GST_VECTOR_STORE", "gst_vector_store.pkl")
 
-client = genai.Client(api_key=api_key)
-model_name = "gemini-2.5-flash"
+# Simple Vector Store, loaded on first use (or warmed in the background at startup)
+_store = None
+_store_lock = threading.Lock()
 
-from simple_vector_store import SimpleVectorStore
 
-# Initialize Simple Vector Store
-store = SimpleVectorStore("gst_vector_store.pkl")
+def get_store() -> SimpleVectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SimpleVectorStore(VECTOR_STORE_PATH)
+    return _store
+
+
+def is_store_loaded() -> bool:
+    return _store is not None
 
 # Chroma classes removed
 
 
 
 def get_embeddings(texts: list[str]) -> list[list[float]]:
+    # Routed through the micro-batcher so concurrent callers share embed calls.
+    # Errors left after the provider's retries propagate: a placeholder
+    # vector would be stored or searched as if it were real.
     try:
-        response = client.models.embed_content(
-            model="text-embedding-004",
-            contents=texts,
-            config=types.EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT")
-        )
-        return [e.values for e in response.embeddings]
+        return get_batcher().embed(texts, task_type="RETRIEVAL_DOCUMENT")
     except Exception as e:
         print(f"Embedding error: {e}")
-        return [[0.0] * 768 for _ in range(len(texts))]
+        raise
 
-def extract_text_from_doc(file_bytes: bytes, mime_type: str):
+def extract_passages_from_doc(file_bytes: bytes, mime_type: str) -> list[str]:
     """
-    Uses Gemini to extract text from a GST document (PDF/Image).
+    Extracts passages from a GST document. Text, DOCX and text-layer PDFs are
+    parsed locally; only scans, images and unknown formats go to the model.
+    PDFs are chunked page by page as they are extracted.
     """
-    # Check file size (Gemini has limits)
-    file_size_mb = len(file_bytes) / (1024 * 1024)
-    print(f"File size: {file_size_mb:.2f} MB")
-    
-    # Skip very large files to prevent hanging
-    if file_size_mb > 10:
-        print(f"WARNING: File too large ({file_size_mb:.2f} MB). Skipping Gemini extraction.")
-        print("For large PDFs, consider using a dedicated PDF parser instead.")
-        return None
-    
-    prompt = "Extract all text from this document for RAG ingestion. If it's a GST rule or notice, ensure all details are captured."
-
-    try:
-        print("Calling Gemini API for text extraction...")
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[
-                prompt,
-                types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
-            ]
-        )
-        print("Gemini API call completed successfully")
-        return response.text.strip()
-    except Exception as e:
-        print(f"Text extraction error details: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
+    print(f"File size: {len(file_bytes) / (1024 * 1024):.2f} MB")
+    with span("document_extraction", mime_type=mime_type):
+        return list(iter_chunks(iter_text(file_bytes, mime_type)))
 
 def ingest_document_text(doc_id: str, content: str):
+    print(f"Content length: {len(content)} characters")
+    ingest_passages(doc_id, chunk_text(content))
+
+def ingest_passages(doc_id: str, chunks: list[str]):
     try:
         print(f"Starting ingestion for: {doc_id}")
-        print(f"Content length: {len(content)} characters")
         
-        # Limit content size to prevent large payloads (less critical for pickle but good practice)
-        MAX_CONTENT_LENGTH = 50000 
-        if len(content) > MAX_CONTENT_LENGTH:
-            print(f"WARNING: Content too large ({len(content)} chars). Truncating.")
-            content = content[:MAX_CONTENT_LENGTH]
+        # Large documents are split into passages stored as doc_id#chunk0000, doc_id#chunk0001, ...
+        ids = [doc_id] if len(chunks) == 1 else [chunk_id(doc_id, i) for i in range(len(chunks))]
+        print(f"Split into {len(chunks)} passages")
         
         # Generate embeddings manually
         print("Generating embeddings...")
-        embeddings = get_embeddings([content])
+        with span("ingest_embedding", passages=len(chunks)):
+            embeddings = get_embeddings(chunks)
         print(f"Embeddings generated: {len(embeddings)} vectors")
         
         print("Upserting to Vector Store...")
-        store.upsert(
-            documents=[content],
-            embeddings=embeddings,
-            ids=[doc_id]
-        )
+        with span("vector_upsert"):
+            # Passages from a previous, possibly longer, version of the
+            # document are dropped in the same swap
+            get_store().replace_document(
+                doc_id,
+                documents=chunks,
+                embeddings=embeddings,
+                ids=ids
+            )
         print(f"Successfully upserted {doc_id} to Vector Store")
     except Exception as e:
         print(f"Vector Store Upsert Error: {e}")
@@ -96,25 +88,47 @@ def ingest_document_text(doc_id: str, content: str):
         raise
 
 def ingest_document_file(doc_id: str, file_bytes: bytes, mime_type: str):
-    text_content = extract_text_from_doc(file_bytes, mime_type)
-    if text_content:
-        ingest_document_text(doc_id, text_content)
+    chunks = extract_passages_from_doc(file_bytes, mime_type)
+    if chunks:
+        ingest_passages(doc_id, chunks)
         return True
     else:
         # If extraction failed, we want to know why in main.py
         return False
 
-def process_unstructured_query(query: str):
+def retrieve_rule_chunks(query: str, prior_chunks: list = None, config: RetrievalConfig = RAG_RETRIEVAL) -> list:
+    """
+    Rule passages for a query packed into config's budget. prior_chunks:
+    rule chunks retrieved earlier in the same conversation; follow-ups
+    pack new and earlier chunks into the same budget and passage count.
+    """
     # Generate embeddings manually for the query
-    query_embeddings = get_embeddings([query])
-    
-    results = store.query(
-        query_embeddings=query_embeddings,
-        n_results=3
-    )
-    
-    documents = results.get('documents', [[]])[0]
-    context = "\n\n".join(documents) if documents else "No GST rules found."
+    with span("query_embedding"):
+        query_embeddings = get_embeddings([query])
+
+    with span("vector_search") as attrs:
+        chunks = retrieve(get_store(), query, query_embeddings[0], config)
+        if prior_chunks:
+            chunks = pack_chunks(merge_chunks(prior_chunks, chunks), config.token_budget, config.k)
+        attrs["documents"] = len(chunks)
+        attrs["context_tokens"] = sum(estimate_tokens(c["document"]) for c in chunks)
+    return chunks
+
+
+def rule_context(chunks: list) -> str:
+    documents = [c["document"] for c in chunks]
+    return "\n\n".join(documents) if documents else "No GST rules found."
+
+
+def process_unstructured_query(query: str, prior_chunks: list = None, config: RetrievalConfig = RAG_RETRIEVAL):
+    """
+    Answer a rules question from retrieved passages; see retrieve_rule_chunks.
+    """
+    try:
+        chunks = retrieve_rule_chunks(query, prior_chunks, config)
+    except Exception as e:
+        return {"error": f"Rule retrieval failed: {e}"}
+    context = rule_context(chunks)
 
     prompt = f"""
     Rule Context:
@@ -127,14 +141,12 @@ def process_unstructured_query(query: str):
     """
 
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                "temperature": 0.0,
-                "max_output_tokens": 300
-            }
-        )
-        return {"rag_answer": response.text.strip()}
+        with span("rag_answer"):
+            response_text = get_provider().generate(
+                prompt,
+                temperature=0.0,
+                max_output_tokens=300
+            )
+        return {"rag_answer": response_text.strip(), "rule_chunks": chunks}
     except Exception as e:
         return {"error": str(e)}
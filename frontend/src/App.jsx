@@ -9,6 +9,7 @@ function App() {
     const [messages, setMessages] = useState([]);
     const [loading, setLoading] = useState(false);
     const [uploading, setUploading] = useState(null); // 'invoice' or 'gst'
+    const [sessionId, setSessionId] = useState(null); // server-side conversation context
     const messagesEndRef = useRef(null);
     const invoiceInputRef = useRef(null);
 
@@ -34,7 +35,9 @@ function App() {
             const response = await axios.post(endpoint, formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
-            const content = `Successfully uploaded invoice: ${response.data.data.invoice_id}`;
+            const warning = response.data.warning;
+            const content = `Successfully uploaded invoice: ${response.data.data.invoice_id}` +
+                (warning ? ` (note: ${warning.message.toLowerCase()}, ${warning.similar_to.invoice_id}: ${warning.similar_to.reason})` : '');
 
             setMessages(prev => [...prev, {
                 role: 'assistant',
@@ -43,10 +46,14 @@ function App() {
             }]);
         } catch (error) {
             console.error("Upload Error:", error);
+            const detail = error.response?.data?.detail;
+            const reason = detail?.duplicate_of
+                ? `${detail.message} (matches invoice ${detail.duplicate_of.invoice_id})`
+                : detail || error.message;
             setMessages(prev => [...prev, {
                 role: 'assistant',
                 error: true,
-                data: { reasoning: `Upload Failed: ${error.response?.data?.detail || error.message}` }
+                data: { reasoning: `Upload Failed: ${reason}` }
             }]);
         } finally {
             setUploading(null);
@@ -64,7 +71,8 @@ function App() {
         setLoading(true);
 
         try {
-            const response = await axios.post(API_URL, { query: userMessage.content });
+            const response = await axios.post(API_URL, { query: userMessage.content, session_id: sessionId });
+            if (response.data.session_id) setSessionId(response.data.session_id);
             const aiMessage = { role: 'assistant', data: response.data };
             setMessages(prev => [...prev, aiMessage]);
         } catch (error) {